@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+"""
+End-to-end load test of the magic link flow, fully offline :
+
+    login POST -> email received by a local SMTP sink -> WaitView -> ValidateTokenView
+
+A test server and the SMTP sink are started in this process, then `--concurrency` clients
+run `--logins` complete logins, each with its own user, out of a table of `--users` users.
+Reports requests/sec, latency percentiles of each step and the email delivery lag
+(from the start of the login POST to the reception of the email by the sink).
+
+    python benchmarks/login_flow.py --concurrency 8 --logins 400 --users 10000
+"""
+
+import argparse
+import http.cookiejar
+import json
+import os
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+STEPS = ("login_post", "email_delivery", "wait_view", "validate_token")
+MAGIC_LINK_RE = re.compile(r"https://[^/\s]+(/\S+)")
+NEXT_STEP_RE = re.compile(r"var url = '([^']+)'")
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def setup_django(settings_module, sink):
+    os.environ["DJANGO_SETTINGS_MODULE"] = settings_module
+    import django
+    from django.conf import settings
+
+    settings.EMAIL_HOST = sink.host
+    settings.EMAIL_PORT = sink.port
+    django.setup()
+
+
+def setup_users(count):
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+
+    from magicauth import settings as magicauth_settings
+    from magicauth.models import MagicToken
+
+    call_command("migrate", verbosity=0)
+    user_model = get_user_model()
+    MagicToken.objects.all().delete()
+    user_model.objects.all().delete()
+    emails = [f"user{i}@benchmark.test" for i in range(count)]
+    fields = {magicauth_settings.EMAIL_FIELD, user_model.USERNAME_FIELD}
+    user_model.objects.bulk_create(
+        (user_model(**{field: email for field in fields}) for email in emails),
+        batch_size=1000,
+    )
+    return emails
+
+
+def start_server():
+    from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+    from django.core.wsgi import get_wsgi_application
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadedWSGIServer(("127.0.0.1", 0), QuietHandler)
+    httpd.set_app(get_wsgi_application())
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, "http://%s:%s" % httpd.server_address
+
+
+def run_login(base_url, sink, email):
+    """
+    Run a full login for `email`, return the duration of each step in seconds.
+    """
+    from django.urls import reverse
+
+    opener = urllib.request.build_opener(
+        urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect()
+    )
+
+    def request(path, data=None):
+        try:
+            with opener.open(base_url + path, data) as response:
+                return response.status, response.read().decode()
+        except urllib.error.HTTPError as e:
+            return e.code, ""
+
+    timings = {}
+    started = time.monotonic()
+    data = urllib.parse.urlencode({"email": email}).encode()
+    status, _ = request(reverse("magicauth-login"), data)
+    timings["login_post"] = time.monotonic() - started
+    assert status == 302, f"login POST returned {status}"
+
+    message = sink.wait_for(email)
+    timings["email_delivery"] = message.received_at - started
+    wait_path = MAGIC_LINK_RE.search(message.text_body).group(1)
+
+    started = time.monotonic()
+    status, content = request(wait_path)
+    timings["wait_view"] = time.monotonic() - started
+    assert status == 200, f"WaitView returned {status}"
+
+    started = time.monotonic()
+    status, _ = request(NEXT_STEP_RE.search(content).group(1))
+    timings["validate_token"] = time.monotonic() - started
+    assert status == 302, f"ValidateTokenView returned {status}"
+    return timings
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def run(args):
+    from tests.smtp_sink import SMTPSink
+
+    with SMTPSink() as sink:
+        setup_django(args.settings, sink)
+        emails = setup_users(max(args.users, args.logins))
+        httpd, base_url = start_server()
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(
+                executor.map(
+                    lambda email: run_login(base_url, sink, email),
+                    emails[: args.logins],
+                )
+            )
+        duration = time.monotonic() - started
+        httpd.shutdown()
+
+    http_steps = [step for step in STEPS if step != "email_delivery"]
+    report = {
+        "concurrency": args.concurrency,
+        "logins": args.logins,
+        "users": len(emails),
+        "duration_seconds": round(duration, 3),
+        "logins_per_second": round(len(results) / duration, 2),
+        "requests_per_second": round(len(results) * len(http_steps) / duration, 2),
+        "steps_ms": {
+            step: {
+                f"p{percent}": round(
+                    percentile([r[step] for r in results], percent) * 1000, 2
+                )
+                for percent in (50, 90, 99)
+            }
+            for step in STEPS
+        },
+    }
+    return report
+
+
+def print_report(report):
+    print(
+        f"{report['logins']} logins, concurrency {report['concurrency']}, "
+        f"{report['users']} users, {report['duration_seconds']}s"
+    )
+    print(
+        f"{report['logins_per_second']} logins/s, "
+        f"{report['requests_per_second']} requests/s"
+    )
+    print(f"{'step':<16}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}")
+    for step, values in report["steps_ms"].items():
+        print(f"{step:<16}{values['p50']:>10}{values['p90']:>10}{values['p99']:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument(
+        "--users", type=int, default=1000, help="size of the user table"
+    )
+    parser.add_argument("--settings", default="benchmarks.settings")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
@@ -0,0 +1,23 @@
+"""
+Settings for benchmarks/login_flow.py. Use --settings to benchmark against another
+configuration (PostgreSQL, cache backend...), the SMTP sink host and port are always
+overridden by the benchmark.
+"""
+
+import os
+import tempfile
+
+from tests.test_settings import *  # noqa: F401, F403
+
+DEBUG = False
+ALLOWED_HOSTS = ["*"]
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.path.join(tempfile.gettempdir(), "magicauth-benchmark.sqlite3"),
+        "OPTIONS": {"timeout": 30},
+    }
+}
+
+EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
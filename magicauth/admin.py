@@ -1,9 +1,142 @@
-from django.contrib import admin
+import csv
+from itertools import chain
 
-from .models import MagicToken
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.http import StreamingHttpResponse
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+
+from magicauth import settings as magicauth_settings
+
+from .models import AuthEvent, LoginFunnelDay, MagicToken
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    On PostgreSQL, use the planner statistics instead of a full COUNT(*) for the
+    unfiltered changelist. Small tables and filtered querysets still get an exact count.
+    """
+
+    # Below this estimate, an exact count is cheap enough.
+    estimate_threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == "postgresql" and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= self.estimate_threshold:
+                return int(row[0])
+        return super().count
+
+
+class ExpiredListFilter(admin.SimpleListFilter):
+    title = _("expired")
+    parameter_name = "expired"
+
+    def lookups(self, request, model_admin):
+        return (("yes", _("Yes")), ("no", _("No")))
+
+    def queryset(self, request, queryset):
+        if self.value() == "yes":
+            return queryset.expired()
+        if self.value() == "no":
+            return queryset.valid()
+        return queryset
+
+
+class Echo:
+    """
+    Pseudo-buffer for csv.writer : the written row is returned instead of stored.
+    """
+
+    def write(self, value):
+        return value
 
 
 @admin.register(MagicToken)
 class MagicTokenAdmin(admin.ModelAdmin):
     list_display = ("key", "user", "created")
+    list_select_related = ("user",)
+    list_filter = (ExpiredListFilter,)
+    raw_id_fields = ("user",)
+    date_hierarchy = "created"
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ("purge_expired", "export_csv")
+    purge_chunk_size = 1000
+    export_chunk_size = 2000
+
+    @admin.action(description=_("Delete expired tokens among selection"))
+    def purge_expired(self, request, queryset):
+        deleted = queryset.expired().delete_in_chunks(self.purge_chunk_size)
+        self.message_user(
+            request, _("%d expired tokens deleted.") % deleted, messages.SUCCESS
+        )
+
+    @admin.action(description=_("Export selection as CSV"))
+    def export_csv(self, request, queryset):
+        """
+        Stream the selection without loading it in memory. Token keys are not exported :
+        a valid key is enough to log in.
+        """
+        email_field = f"user__{magicauth_settings.EMAIL_FIELD}"
+        rows = (
+            queryset.order_by()
+            .values_list("user_id", email_field, "created")
+            .iterator(chunk_size=self.export_chunk_size)
+        )
+        writer = csv.writer(Echo())
+        header = [("user_id", "email", "created")]
+        response = StreamingHttpResponse(
+            (writer.writerow(row) for row in chain(header, rows)),
+            content_type="text/csv",
+        )
+        response["Content-Disposition"] = 'attachment; filename="magic_tokens.csv"'
+        return response
+
+
+@admin.register(AuthEvent)
+class AuthEventAdmin(admin.ModelAdmin):
+    list_display = ("created", "event", "user", "email", "ip_address")
+    list_select_related = ("user",)
+    list_filter = ("event",)
     raw_id_fields = ("user",)
+    date_hierarchy = "created"
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(LoginFunnelDay)
+class LoginFunnelDayAdmin(admin.ModelAdmin):
+    list_display = (
+        "day",
+        "site",
+        "links_requested",
+        "links_clicked",
+        "logins_completed",
+        "tokens_expired",
+        "tokens_not_found",
+    )
+    list_filter = ("site",)
+    date_hierarchy = "day"
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,16 @@
+from django.urls import path
+
+from . import api_views as magicauth_api_views
+
+urlpatterns = [
+    path(
+        "login/",
+        magicauth_api_views.LoginAPIView.as_view(),
+        name="magicauth-api-login",
+    ),
+    path(
+        "token/<str:key>/",
+        magicauth_api_views.TokenAPIView.as_view(),
+        name="magicauth-api-token",
+    ),
+]
@@ -0,0 +1,169 @@
+"""
+JSON endpoints of the login flow, for single page applications and mobile apps.
+They reuse the forms and mixins of the HTML views, without template rendering (except for
+the email), messages or redirects.
+
+Query budget, with the default settings (user cache and email filter disabled) :
+ - LoginAPIView POST : 3 queries (user exists, user lookup, token insert), plus 1 for
+   MAGICAUTH_MAX_OUTSTANDING_TOKENS or MAGICAUTH_TOKEN_REUSE_SECONDS, plus the OTP devices
+   queries with MAGICAUTH_ENABLE_2FA.
+ - TokenAPIView GET : 1 query (token lookup).
+ - TokenAPIView POST : token lookup, user lookup, last login update, tokens delete, plus
+   the session save.
+"""
+
+import json
+import math
+
+from django.db import transaction
+from django.http import Http404, JsonResponse
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views import View
+
+from magicauth import settings as magicauth_settings
+from magicauth.audit import record_event
+from magicauth.circuit_breaker import EmailUnavailable
+from magicauth.forms import EmailForm
+from magicauth.funnel import record_funnel
+from magicauth.limiter import SendLimitMixin
+from magicauth.login_status import start_attempt
+from magicauth.models import AuthEvent, LoginFunnelDay
+from magicauth.next_url import NextUrlMixin
+from magicauth.otp_forms import OTPForm, TokenValidationForm
+from magicauth.send_token import SendTokenMixin
+from magicauth.views import TokenLoginMixin
+
+
+def get_form_errors(form):
+    return {
+        field: [str(error) for error in errors] for field, errors in form.errors.items()
+    }
+
+
+class JsonDataMixin(object):
+    def get_data(self):
+        """
+        Accept a JSON body or a form-encoded one.
+        """
+        if self.request.content_type == "application/json":
+            try:
+                data = json.loads(self.request.body or b"{}")
+            except ValueError:
+                return None
+            return data if isinstance(data, dict) else None
+        return self.request.POST
+
+    def error_response(self, errors, status=400):
+        return JsonResponse({"errors": errors}, status=status)
+
+
+@method_decorator(transaction.non_atomic_requests, name="dispatch")
+class LoginAPIView(SendLimitMixin, JsonDataMixin, NextUrlMixin, SendTokenMixin, View):
+    """
+    POST {"email": "...", "otp_token": "..."} : sends the magic link.
+    202 when the email is sent, 400 with the errors of each field otherwise, 503 when
+    the email can not be sent for now (see magicauth/circuit_breaker.py) or when too many
+    requests are in progress (see magicauth/limiter.py).
+    With MAGICAUTH_LOGIN_STATUS_LONG_POLL, the 202 response has the "attempt" id to
+    long-poll the magicauth-login-status URL with.
+    """
+
+    form_class = EmailForm
+    otp_form_class = OTPForm
+
+    def post(self, request, *args, **kwargs):
+        data = self.get_data()
+        if data is None:
+            return self.error_response({"__all__": ["Invalid JSON body."]})
+        try:
+            next_url = self.get_next_url(request)
+        except Http404:
+            return self.error_response({"next": ["Unsafe next URL."]})
+
+        form = self.form_class(data)
+        if not form.is_valid():
+            record_event(
+                AuthEvent.LINK_REQUEST_FAILED, request, email=str(data.get("email", ""))
+            )
+            return self.error_response(get_form_errors(form))
+        user_email = form.cleaned_data["email"]
+        self.user = self.get_user_from_email(user_email)
+
+        if magicauth_settings.ENABLE_2FA:
+            otp_form = self.otp_form_class(self.user, data=data)
+            if not otp_form.is_valid():
+                record_event(AuthEvent.OTP_FAILED, request, self.user.pk, user_email)
+                return self.error_response(get_form_errors(otp_form))
+
+        try:
+            token = self.send_token(
+                user_email=user_email, extra_context={"next_url": next_url}
+            )
+        except EmailUnavailable:
+            response = self.error_response(
+                {"__all__": [magicauth_settings.EMAIL_UNAVAILABLE_MESSAGE]}, status=503
+            )
+            response["Retry-After"] = (
+                magicauth_settings.EMAIL_CIRCUIT_BREAKER_RESET_SECONDS
+            )
+            return response
+        record_event(AuthEvent.LINK_REQUESTED, request, self.user.pk, user_email)
+        record_funnel(request, LoginFunnelDay.LINKS_REQUESTED)
+        data = {"status": "sent"}
+        if magicauth_settings.LOGIN_STATUS_LONG_POLL:
+            data["attempt"] = start_attempt(token)
+        return JsonResponse(data, status=202)
+
+    def overloaded_response(self):
+        return self.error_response(
+            {"__all__": ["Too many login requests, retry later."]}, status=503
+        )
+
+    def get_user_from_email(self, user_email):
+        # The user was already looked up for this request
+        user = getattr(self, "user", None)
+        if user is not None:
+            return user
+        return super().get_user_from_email(user_email)
+
+
+class TokenAPIView(JsonDataMixin, NextUrlMixin, TokenLoginMixin, View):
+    """
+    GET : status of the token, without consuming it.
+        200 {"status": "valid", "expires_in": seconds}, 410 if expired, 404 if unknown.
+    POST : consumes the token and logs in its user (session cookie).
+        200 {"status": "logged_in", "next": url}, 410 if expired, 404 if unknown.
+    """
+
+    form_class = TokenValidationForm
+
+    def get_form(self):
+        return self.form_class(data={"token": self.kwargs.get("key")})
+
+    def token_error_response(self, form):
+        if "token_expired" in self.get_token_error_codes(form):
+            return JsonResponse({"status": "expired"}, status=410)
+        return JsonResponse({"status": "invalid"}, status=404)
+
+    def get(self, request, *args, **kwargs):
+        form = self.get_form()
+        if not form.is_valid():
+            return self.token_error_response(form)
+        token = form.cleaned_data["token"]
+        age = (timezone.now() - token.created).total_seconds()
+        expires_in = math.floor(magicauth_settings.TOKEN_DURATION_SECONDS - age)
+        return JsonResponse({"status": "valid", "expires_in": expires_in})
+
+    def post(self, request, *args, **kwargs):
+        try:
+            next_url = self.get_next_url(request)
+        except Http404:
+            return self.error_response({"next": ["Unsafe next URL."]})
+        form = self.get_form()
+        if not form.is_valid():
+            self.record_token_error(form)
+            self.delete_expired_token(form)
+            return self.token_error_response(form)
+        self.login_token_user(form.cleaned_data["token"])
+        return JsonResponse({"status": "logged_in", "next": next_url})
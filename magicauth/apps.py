@@ -1,6 +1,30 @@
 from django.apps import AppConfig
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
 
 
 class MagicauthConfig(AppConfig):
     name = "magicauth"
     verbose_name = "Magic Auth"
+
+    def ready(self):
+        from magicauth import checks  # noqa: F401 (registers the checks)
+        from magicauth.bloom import remember_user_email
+        from magicauth.user_cache import invalidate_user
+
+        user_model = get_user_model()
+        post_save.connect(
+            remember_user_email,
+            sender=user_model,
+            dispatch_uid="magicauth_bloom_remember_user_email",
+        )
+        post_save.connect(
+            invalidate_user,
+            sender=user_model,
+            dispatch_uid="magicauth_user_cache_invalidate_saved_user",
+        )
+        post_delete.connect(
+            invalidate_user,
+            sender=user_model,
+            dispatch_uid="magicauth_user_cache_invalidate_deleted_user",
+        )
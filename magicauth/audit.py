@@ -0,0 +1,127 @@
+"""
+Audit trail of the login flow : link requests, validations, expirations and failures.
+
+MAGICAUTH_AUDIT_LOG selects how events are written :
+ - None (default) : no audit trail.
+ - "sync" : one INSERT per event, in the request.
+ - "buffered" : events are kept in memory and inserted with bulk_create by a background
+   thread, when AUDIT_BUFFER_SIZE events are waiting or after AUDIT_FLUSH_SECONDS, and at
+   process exit. Events still in memory are lost if the process is killed. If the bulk
+   insert fails, the events are inserted one by one and the ones still failing are
+   logged as lost.
+"""
+
+import atexit
+import logging
+import os
+import threading
+
+from django.db import connections, router, transaction
+
+from magicauth import settings as magicauth_settings
+from magicauth.models import AuthEvent
+
+logger = logging.getLogger(__name__)
+
+
+class AuditBuffer(object):
+    def __init__(self):
+        self.events = self.new_events()
+        self.lock = threading.Lock()
+        self.timer = None
+        atexit.register(self.flush)
+        if hasattr(os, "register_at_fork"):
+            # Events recorded before a fork belong to the parent process
+            os.register_at_fork(after_in_child=self.reset)
+
+    def new_events(self):
+        return []
+
+    def get_flush_seconds(self):
+        return magicauth_settings.AUDIT_FLUSH_SECONDS
+
+    def add(self, event):
+        with self.lock:
+            self.events.append(event)
+            is_full = len(self.events) >= magicauth_settings.AUDIT_BUFFER_SIZE
+            if not is_full:
+                self.start_timer()
+        if is_full:
+            self.start_flush()
+
+    def start_timer(self):
+        """
+        Flush within get_flush_seconds(). Called with the lock held.
+        """
+        if self.timer is None:
+            self.timer = threading.Timer(self.get_flush_seconds(), self.flush_in_thread)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def cancel_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def start_flush(self):
+        threading.Thread(target=self.flush_in_thread, daemon=True).start()
+
+    def flush_in_thread(self):
+        try:
+            self.flush()
+        finally:
+            # Each thread has its own database connections
+            connections.close_all()
+
+    def flush(self):
+        with self.lock:
+            self.cancel_timer()
+            events, self.events = self.events, self.new_events()
+        if events:
+            self.write(events)
+
+    def write(self, events):
+        try:
+            # All or nothing, so that the retry does not insert a batch twice
+            with transaction.atomic(using=router.db_for_write(AuthEvent)):
+                AuthEvent.objects.bulk_create(events, batch_size=500)
+        except Exception:
+            # e.g. an event of a user deleted meanwhile : the others are still saved
+            lost = 0
+            for event in events:
+                try:
+                    event.save()
+                except Exception:
+                    lost += 1
+            logger.exception(
+                "[MagicAuth] audit events could not be inserted in bulk, %d lost", lost
+            )
+
+    def reset(self):
+        self.events, self.timer = self.new_events(), None
+        self.lock = threading.Lock()
+
+
+audit_buffer = AuditBuffer()
+
+
+def get_ip_address(request):
+    if request is None:
+        return None
+    return request.META.get("REMOTE_ADDR") or None
+
+
+def record_event(event, request=None, user_id=None, email=""):
+    mode = magicauth_settings.AUDIT_LOG
+    if not mode:
+        return
+    auth_event = AuthEvent(
+        event=event,
+        user_id=user_id,
+        email=(email or "")[:255],
+        ip_address=get_ip_address(request),
+    )
+    if mode == "sync":
+        auth_event.save()
+    else:
+        audit_buffer.add(auth_event)
@@ -0,0 +1,200 @@
+"""
+Optional Bloom filter of the known user emails, so that the login form can reject unknown
+emails (typos, enumeration scripts) without querying the user table.
+
+A Bloom filter can answer "definitely not there" or "maybe there" : a miss skips the
+database, a hit falls back to the usual query. Deleted users can not be removed from the
+filter, they stay "maybe there" until the filter is rebuilt, which only costs a query.
+
+The filter is built from the database by a background thread (or by the
+magicauth_build_email_filter command), shared between processes through the cache, and
+rebuilt every EMAIL_BLOOM_FILTER_REFRESH_SECONDS. Until the first build is done, every
+email is checked in the database. Users saved in the meantime are added to the local
+filter and remembered in the cache, so that other processes know them too.
+"""
+
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.db import connections
+
+from magicauth import settings as magicauth_settings
+from magicauth.utils import get_cache
+
+FILTER_CACHE_KEY = "magicauth:email-bloom-filter"
+RECENT_EMAIL_CACHE_KEY = "magicauth:email-bloom-filter:recent:%s"
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter(object):
+    def __init__(self, capacity, false_positive_rate=0.01, max_bytes=None):
+        capacity = max(capacity, 1)
+        num_bits = math.ceil(
+            -capacity * math.log(false_positive_rate) / (math.log(2) ** 2)
+        )
+        if max_bytes:
+            num_bits = min(num_bits, max_bytes * 8)
+        self.num_bits = max(num_bits, 8)
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray(math.ceil(self.num_bits / 8))
+
+    def positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first_hash = int.from_bytes(digest[:8], "little")
+        second_hash = int.from_bytes(digest[8:], "little") | 1
+        return (
+            (first_hash + i * second_hash) % self.num_bits
+            for i in range(self.num_hashes)
+        )
+
+    def add(self, value):
+        for position in self.positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self.positions(value)
+        )
+
+
+def normalize_email(email):
+    return email.strip().lower()
+
+
+def build_email_filter():
+    """
+    Build the filter from the user table and share it through the cache.
+    """
+    user_model = get_user_model()
+    # Leave room for the users created until the next rebuild
+    capacity = int(user_model.objects.count() * 1.2) + 1000
+    email_filter = BloomFilter(
+        capacity,
+        magicauth_settings.EMAIL_BLOOM_FILTER_FALSE_POSITIVE_RATE,
+        magicauth_settings.EMAIL_BLOOM_FILTER_MAX_BYTES,
+    )
+    emails = (
+        user_model.objects.order_by()
+        .values_list(magicauth_settings.EMAIL_FIELD, flat=True)
+        .iterator(chunk_size=10000)
+    )
+    for email in emails:
+        if email:
+            email_filter.add(normalize_email(email))
+    get_cache().set(
+        FILTER_CACHE_KEY,
+        (time.time(), email_filter),
+        timeout=magicauth_settings.EMAIL_BLOOM_FILTER_REFRESH_SECONDS,
+    )
+    return email_filter
+
+
+class LocalEmailFilter(object):
+    """
+    The copy of the filter held by this process.
+    """
+
+    def __init__(self):
+        self.email_filter = None
+        self.expires_at = 0
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def is_building(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def get(self):
+        """
+        The filter, possibly outdated while it is rebuilt. None until it is first built.
+        Never waits for the user table to be scanned.
+        """
+        if time.time() >= self.expires_at and not self.is_building():
+            with self.lock:
+                if time.time() >= self.expires_at and not self.is_building():
+                    self.load()
+        return self.email_filter
+
+    def load(self):
+        """
+        Called with the lock held. Takes the filter from the cache, or starts building it.
+        """
+        refresh_seconds = magicauth_settings.EMAIL_BLOOM_FILTER_REFRESH_SECONDS
+        built_at, email_filter = get_cache().get(FILTER_CACHE_KEY, (0, None))
+        if email_filter is None or time.time() - built_at >= refresh_seconds:
+            self.thread = threading.Thread(target=self.build_in_background, daemon=True)
+            self.thread.start()
+            return
+        self.email_filter = email_filter
+        self.expires_at = built_at + refresh_seconds
+
+    def build(self):
+        built_at, email_filter = time.time(), build_email_filter()
+        with self.lock:
+            self.email_filter = email_filter
+            self.expires_at = (
+                built_at + magicauth_settings.EMAIL_BLOOM_FILTER_REFRESH_SECONDS
+            )
+
+    def build_in_background(self):
+        try:
+            self.build()
+        except Exception:
+            # The outdated filter, or the database, is used until the next attempt
+            logger.exception("[MagicAuth] email filter could not be built")
+        finally:
+            connections.close_all()
+
+    def add(self, email):
+        if self.email_filter is not None:
+            self.email_filter.add(email)
+
+    def reset(self):
+        if self.is_building():
+            self.thread.join()
+        self.email_filter, self.expires_at, self.thread = None, 0, None
+
+
+local_email_filter = LocalEmailFilter()
+
+
+def email_might_exist(email):
+    """
+    False if no user has this email. True if a user may have it, or if the filter is
+    disabled.
+    """
+    if not magicauth_settings.EMAIL_BLOOM_FILTER:
+        return True
+    email_filter = local_email_filter.get()
+    if email_filter is None:
+        # Not built yet : the database is queried
+        return True
+    email = normalize_email(email)
+    if email in email_filter:
+        return True
+    # Users created by other processes since the filter was built
+    return get_cache().get(RECENT_EMAIL_CACHE_KEY % email) is not None
+
+
+def remember_user_email(sender, instance, **kwargs):
+    """
+    post_save receiver for the user model.
+    """
+    if not magicauth_settings.EMAIL_BLOOM_FILTER:
+        return
+    email = getattr(instance, magicauth_settings.EMAIL_FIELD, None)
+    if not email:
+        return
+    email = normalize_email(email)
+    local_email_filter.add(email)
+    # Kept until every process has rebuilt its filter
+    get_cache().set(
+        RECENT_EMAIL_CACHE_KEY % email,
+        True,
+        timeout=2 * magicauth_settings.EMAIL_BLOOM_FILTER_REFRESH_SECONDS,
+    )
@@ -0,0 +1,208 @@
+"""
+System checks for the settings that make the login flow slow at scale.
+They run with `manage.py check` and at startup, except the stale tokens check, which
+queries the database and only runs with `manage.py check --database default`.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings as django_settings
+from django.contrib.auth import get_user_model
+from django.core import checks
+from django.core.exceptions import FieldDoesNotExist
+from django.db import DatabaseError, connections, router
+from django.db.models import F
+from django.db.models.functions import Lower, Upper
+from django.utils import timezone
+
+from magicauth import settings as magicauth_settings
+
+SMTP_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+DUMMY_CACHE_BACKEND = "django.core.cache.backends.dummy.DummyCache"
+# Tokens older than this many TOKEN_DURATION_SECONDS mean that the cleanup does not run.
+# About 2 days with the default duration, so that a daily cleanup passes.
+STALE_TOKEN_DURATIONS = 600
+MAX_WAIT_SECONDS = 10
+
+
+def get_index_expressions(model):
+    indexes = list(model._meta.indexes) + [
+        constraint
+        for constraint in model._meta.constraints
+        if getattr(constraint, "expressions", None)
+        or getattr(constraint, "fields", None)
+    ]
+    for index in indexes:
+        if index.fields:
+            # The first field of a multi-column index is usable on its own
+            yield F(index.fields[0].lstrip("-"))
+        elif index.expressions:
+            yield index.expressions[0]
+
+
+def is_case_insensitive_index(expression, field_name):
+    expression = getattr(expression, "expression", expression)  # OrderBy
+    return isinstance(expression, (Upper, Lower)) and (
+        expression.get_source_expressions()[0] == F(field_name)
+    )
+
+
+@checks.register(checks.Tags.models)
+def check_email_field_index(app_configs, **kwargs):
+    user_model = get_user_model()
+    field_name = magicauth_settings.EMAIL_FIELD
+    try:
+        field = user_model._meta.get_field(field_name)
+    except FieldDoesNotExist:
+        return [
+            checks.Error(
+                f"MAGICAUTH_EMAIL_FIELD {field_name!r} is not a field of "
+                f"{user_model._meta.label}.",
+                id="magicauth.E001",
+            )
+        ]
+    expressions = list(get_index_expressions(user_model))
+    vendor = connections[router.db_for_read(user_model)].vendor
+    if vendor == "postgresql":
+        # iexact compiles to UPPER(field) = UPPER(%s), which a plain index can not serve
+        if any(is_case_insensitive_index(e, field_name) for e in expressions):
+            return []
+        hint = (
+            f"Add models.Index(Upper({field_name!r}), name=...) to the user model, "
+            f"the email lookups are case insensitive."
+        )
+    else:
+        if field.db_index or field.unique or field.primary_key:
+            return []
+        if F(field_name) in expressions or any(
+            is_case_insensitive_index(e, field_name) for e in expressions
+        ):
+            return []
+        hint = f"Add db_index=True or unique=True to {user_model._meta.label}.{field_name}."
+    return [
+        checks.Warning(
+            f"{user_model._meta.label}.{field_name} has no index usable by the "
+            f"magicauth email lookups, each login scans the user table.",
+            hint=hint,
+            obj=user_model,
+            id="magicauth.W001",
+        )
+    ]
+
+
+@checks.register("magicauth")
+def check_email_backend(app_configs, **kwargs):
+    if django_settings.EMAIL_BACKEND != SMTP_BACKEND:
+        return []
+    if magicauth_settings.EMAIL_CONNECTION_POOL:
+        return []
+    if magicauth_settings.EMAIL_DISPATCH == "scheduled":
+        return []  # Sent outside the request, by batches sharing a connection
+    return [
+        checks.Warning(
+            "The login emails are sent with the SMTP backend, opening a new connection "
+            "for each email inside the login request.",
+            hint="Set MAGICAUTH_EMAIL_CONNECTION_POOL = True or "
+            'MAGICAUTH_EMAIL_DISPATCH = "scheduled", or use an email backend that '
+            "queues the messages.",
+            id="magicauth.W002",
+        )
+    ]
+
+
+@checks.register(checks.Tags.caches)
+def check_cache_backend(app_configs, **kwargs):
+    features = [
+        name
+        for name, enabled in [
+            ("MAGICAUTH_USER_CACHE", magicauth_settings.USER_CACHE),
+            ("MAGICAUTH_EMAIL_BLOOM_FILTER", magicauth_settings.EMAIL_BLOOM_FILTER),
+            (
+                "MAGICAUTH_OTP_THROTTLE",
+                magicauth_settings.ENABLE_2FA and magicauth_settings.OTP_THROTTLE,
+            ),
+            (
+                "MAGICAUTH_MAX_CONCURRENT_SENDS_GLOBAL",
+                magicauth_settings.MAX_CONCURRENT_SENDS_GLOBAL,
+            ),
+            (
+                "MAGICAUTH_EMAIL_CIRCUIT_BREAKER",
+                magicauth_settings.EMAIL_CIRCUIT_BREAKER,
+            ),
+            (
+                "MAGICAUTH_LOGIN_STATUS_LONG_POLL",
+                magicauth_settings.LOGIN_STATUS_LONG_POLL,
+            ),
+            (
+                "MAGICAUTH_LOGIN_PAGE_CACHE_SECONDS",
+                magicauth_settings.LOGIN_PAGE_CACHE_SECONDS,
+            ),
+            ("MAGICAUTH_WAIT_TOKEN_PRECHECK", magicauth_settings.WAIT_TOKEN_PRECHECK),
+        ]
+        if enabled
+    ]
+    if not features:
+        return []
+    alias = magicauth_settings.CACHE_ALIAS
+    cache_settings = django_settings.CACHES.get(alias)
+    if cache_settings is None:
+        return [
+            checks.Error(
+                f"MAGICAUTH_CACHE_ALIAS {alias!r} is not defined in CACHES.",
+                id="magicauth.E002",
+            )
+        ]
+    if cache_settings.get("BACKEND") != DUMMY_CACHE_BACKEND:
+        return []
+    return [
+        checks.Warning(
+            f"The {alias!r} cache is a DummyCache, {', '.join(features)} "
+            f"do nothing on it and only add work to each login.",
+            hint="Use a real cache backend or set MAGICAUTH_CACHE_ALIAS.",
+            id="magicauth.W003",
+        )
+    ]
+
+
+@checks.register(checks.Tags.database)
+def check_stale_tokens(app_configs, databases=None, **kwargs):
+    from magicauth.models import MagicToken
+
+    stale_seconds = STALE_TOKEN_DURATIONS * magicauth_settings.TOKEN_DURATION_SECONDS
+    cutoff = timezone.now() - timedelta(seconds=stale_seconds)
+    errors = []
+    for alias in databases or []:
+        if not router.allow_migrate_model(alias, MagicToken):
+            continue
+        try:
+            has_stale_tokens = (
+                MagicToken.objects.using(alias).filter(created__lt=cutoff).exists()
+            )
+        except DatabaseError:
+            continue  # Not migrated yet
+        if has_stale_tokens:
+            errors.append(
+                checks.Warning(
+                    f"The {alias!r} database has tokens expired for more than "
+                    f"{stale_seconds} seconds, expired tokens are not cleaned up.",
+                    hint="Run `manage.py magicauth_cleanup_tokens` daily.",
+                    obj=MagicToken,
+                    id="magicauth.W004",
+                )
+            )
+    return errors
+
+
+@checks.register("magicauth")
+def check_wait_seconds(app_configs, **kwargs):
+    if magicauth_settings.WAIT_SECONDS <= MAX_WAIT_SECONDS:
+        return []
+    return [
+        checks.Warning(
+            f"MAGICAUTH_WAIT_SECONDS is {magicauth_settings.WAIT_SECONDS}, each login "
+            f"keeps the user waiting that long before validating the token.",
+            hint=f"A few seconds ({MAX_WAIT_SECONDS} at most) are enough to let the "
+            f"antispam bots visit the link first.",
+            id="magicauth.W005",
+        )
+    ]
@@ -0,0 +1,105 @@
+"""
+Circuit breaker around the email sending, shared by all processes through the cache.
+
+ - Closed : emails are sent, consecutive failures are counted.
+ - Open : after EMAIL_CIRCUIT_BREAKER_THRESHOLD consecutive failures, emails are not sent
+   for EMAIL_CIRCUIT_BREAKER_RESET_SECONDS : EmailUnavailable is raised right away.
+ - Half-open : then a single process sends one email. The breaker closes if it is sent,
+   and opens again otherwise.
+"""
+
+import smtplib
+import time
+
+from magicauth import settings as magicauth_settings
+from magicauth.email_pool import CONNECTION_ERRORS
+from magicauth.utils import get_cache
+
+FAILURES_CACHE_KEY = "magicauth:email-breaker:failures"
+OPENED_AT_CACHE_KEY = "magicauth:email-breaker:opened-at"
+PROBE_CACHE_KEY = "magicauth:email-breaker:probe"
+
+
+def is_server_error(error):
+    """
+    Whether the email server is failing, as opposed to a refused message (unknown user,
+    mailbox full...) that says nothing about the other emails.
+    """
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPException):
+        return False
+    # Connection errors and timeouts
+    return isinstance(error, CONNECTION_ERRORS)
+
+
+class EmailUnavailable(Exception):
+    """
+    The email could not be sent, or was not even tried because the breaker is open.
+    """
+
+
+class CircuitBreaker(object):
+    def __init__(self, threshold, reset_seconds, is_failure=is_server_error):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.is_failure = is_failure
+
+    def is_open(self, opened_at):
+        """
+        Whether calls are refused. Past the reset delay, lets one caller probe.
+        """
+        if opened_at is None:
+            return False
+        if time.time() - opened_at < self.reset_seconds:
+            return True
+        return not get_cache().add(PROBE_CACHE_KEY, True, timeout=self.reset_seconds)
+
+    def call(self, func, *args, **kwargs):
+        cache = get_cache()
+        state = cache.get_many([FAILURES_CACHE_KEY, OPENED_AT_CACHE_KEY])
+        opened_at = state.get(OPENED_AT_CACHE_KEY)
+        if self.is_open(opened_at):
+            raise EmailUnavailable("The email circuit breaker is open.")
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if not self.is_failure(e):
+                # The server answered : only this message was refused
+                if state:
+                    self.reset()
+                raise
+            # A failed probe opens the breaker again
+            self.record_failure(reopen=opened_at is not None)
+            raise EmailUnavailable(str(e)) from e
+        if state:
+            self.reset()
+        return result
+
+    def record_failure(self, reopen=False):
+        cache = get_cache()
+        # Failures older than a few reset delays are not consecutive anymore
+        timeout = self.reset_seconds * 10
+        cache.add(FAILURES_CACHE_KEY, 0, timeout=timeout)
+        try:
+            failures = cache.incr(FAILURES_CACHE_KEY)
+        except ValueError:  # Expired in the meantime
+            failures = 1
+            cache.set(FAILURES_CACHE_KEY, failures, timeout=timeout)
+        if reopen or failures >= self.threshold:
+            cache.set(OPENED_AT_CACHE_KEY, time.time(), timeout=None)
+            cache.delete(PROBE_CACHE_KEY)
+
+    def reset(self):
+        get_cache().delete_many(
+            [FAILURES_CACHE_KEY, OPENED_AT_CACHE_KEY, PROBE_CACHE_KEY]
+        )
+
+
+def get_circuit_breaker():
+    return CircuitBreaker(
+        threshold=magicauth_settings.EMAIL_CIRCUIT_BREAKER_THRESHOLD,
+        reset_seconds=magicauth_settings.EMAIL_CIRCUIT_BREAKER_RESET_SECONDS,
+    )
@@ -0,0 +1,157 @@
+"""
+Process-wide pool of open email backend connections.
+
+Without it, each login link opens a new SMTP connection (TCP, TLS and AUTH) and closes it
+after a single message. With MAGICAUTH_EMAIL_CONNECTION_POOL enabled, the connections are
+kept open and reused : a warm connection only pays for sending the message.
+"""
+
+import os
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.mail import get_connection
+
+from magicauth import settings as magicauth_settings
+
+# Errors meaning the connection itself is broken (as opposed to a refused message). Every
+# smtplib.SMTPException is an OSError too : catch those first where it matters.
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, OSError)
+
+
+class EmailConnectionPool(object):
+    def __init__(
+        self,
+        size=4,
+        idle_timeout=60,
+        health_check_seconds=5,
+        backend=None,
+        **connection_kwargs,
+    ):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.health_check_seconds = health_check_seconds
+        self.backend = backend
+        self.connection_kwargs = connection_kwargs
+        self._idle = []  # (connection, last_used) pairs, most recently used last
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._pid = os.getpid()
+
+    def open_connection(self):
+        connection = get_connection(
+            self.backend, fail_silently=False, **self.connection_kwargs
+        )
+        connection.open()
+        return connection
+
+    def is_healthy(self, connection):
+        smtp_connection = getattr(connection, "connection", None)
+        if smtp_connection is None:
+            # Not an SMTP backend (or not opened) : nothing to check
+            return True
+        try:
+            return smtp_connection.noop()[0] == 250
+        except CONNECTION_ERRORS + (smtplib.SMTPException,):
+            return False
+
+    def discard(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def checkout(self):
+        while True:
+            with self._lock:
+                if self._pid != os.getpid():
+                    # Forked : the sockets belong to the parent process, forget them.
+                    self._idle, self._pid = [], os.getpid()
+                if not self._idle:
+                    break
+                connection, last_used = self._idle.pop()
+            idle_seconds = time.monotonic() - last_used
+            if idle_seconds > self.idle_timeout or (
+                idle_seconds > self.health_check_seconds
+                and not self.is_healthy(connection)
+            ):
+                self.discard(connection)
+                continue
+            return connection
+        return self.open_connection()
+
+    def checkin(self, connection):
+        with self._lock:
+            self._idle.append((connection, time.monotonic()))
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection. Blocks while `size` connections are already in use.
+        """
+        with self._slots:
+            connection = self.checkout()
+            try:
+                yield connection
+            except BaseException:
+                self.discard(connection)
+                raise
+            self.checkin(connection)
+
+    def send_messages(self, messages):
+        with self.connection() as connection:
+            smtp_connection = getattr(connection, "connection", None)
+            data_sent = []
+            if smtp_connection is not None:
+                send_data = smtp_connection.data
+
+                def data(msg):
+                    data_sent.append(True)
+                    return send_data(msg)
+
+                smtp_connection.data = data
+            try:
+                return connection.send_messages(messages)
+            except smtplib.SMTPServerDisconnected:
+                if data_sent:
+                    # The relay may have accepted the message : never send it twice
+                    raise
+                # The relay closed the connection since the health check : reconnect once.
+                self.discard(connection)
+                connection.open()
+                return connection.send_messages(messages)
+            finally:
+                if smtp_connection is not None:
+                    del smtp_connection.data
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            self.discard(connection)
+
+
+def get_connection_kwargs():
+    if magicauth_settings.EMAIL_TIMEOUT is None:
+        return {}
+    return {"timeout": magicauth_settings.EMAIL_TIMEOUT}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_email_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = EmailConnectionPool(
+                    size=magicauth_settings.EMAIL_POOL_SIZE,
+                    idle_timeout=magicauth_settings.EMAIL_POOL_IDLE_TIMEOUT,
+                    health_check_seconds=magicauth_settings.EMAIL_POOL_HEALTH_CHECK_SECONDS,
+                    **get_connection_kwargs(),
+                )
+    return _pool
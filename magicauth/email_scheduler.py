@@ -0,0 +1,385 @@
+"""
+Background sending of the emails, grouped by recipient domain.
+
+With MAGICAUTH_EMAIL_DISPATCH = "scheduled", the login views only queue their email. The
+scheduler threads then pick a domain with waiting emails and send up to EMAIL_BATCH_SIZE
+of them on one connection, so that a burst of emails to one provider neither opens a
+connection per email nor exceeds the limits of the provider :
+ - each domain gets at most `concurrency` connections at the same time and
+   `rate_per_minute` emails (EMAIL_DOMAIN_CONCURRENCY, EMAIL_DOMAIN_RATE_PER_MINUTE and
+   EMAIL_DOMAIN_LIMITS),
+ - a temporary (4xx) refusal pauses the domain only, the other domains keep going,
+ - login links (INTERACTIVE) are sent before the emails queued with send_bulk() (BULK),
+   and domains with login links waiting are served first.
+
+The queue is in memory, per process : emails still queued are lost if the process is
+killed, and are sent for at most DRAIN_SECONDS at process exit.
+"""
+
+import atexit
+import logging
+import os
+import smtplib
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from django.core.mail import get_connection
+
+from magicauth import settings as magicauth_settings
+from magicauth.email_pool import (
+    CONNECTION_ERRORS,
+    get_connection_kwargs,
+    get_email_pool,
+)
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BULK = 1
+# Longest pause of a domain, whatever the number of consecutive deferrals.
+MAX_DEFER_SECONDS = 3600
+DRAIN_SECONDS = 5
+
+
+def get_domain(message):
+    recipients = message.recipients()
+    return recipients[0].rpartition("@")[2].lower() if recipients else ""
+
+
+def is_temporary_error(error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return bool(codes) and all(400 <= code < 500 for code in codes)
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return False
+
+
+@contextmanager
+def batch_connection():
+    if magicauth_settings.EMAIL_CONNECTION_POOL:
+        with get_email_pool().connection() as connection:
+            yield connection
+        return
+    connection = get_connection(fail_silently=False, **get_connection_kwargs())
+    connection.open()
+    try:
+        yield connection
+    finally:
+        connection.close()
+
+
+class QueuedEmail(object):
+    def __init__(self, message, priority, expires_at=None):
+        self.message = message
+        self.priority = priority
+        self.expires_at = expires_at
+        self.attempts = 0
+
+    def is_expired(self, now):
+        return self.expires_at is not None and now >= self.expires_at
+
+
+class DomainQueue(object):
+    """
+    Waiting emails of one domain and its limits. Not thread safe, the scheduler calls it
+    with its lock held.
+    """
+
+    def __init__(self, concurrency, rate_per_minute, batch_size):
+        self.concurrency = concurrency
+        self.rate = rate_per_minute / 60 if rate_per_minute else None
+        self.batch_size = batch_size
+        self.queues = (deque(), deque())  # INTERACTIVE, BULK
+        self.in_flight = 0
+        self.deferrals = 0
+        self.deferred_until = 0
+        # Token bucket : emails that can be sent right now, up to a batch
+        self.allowance = float(batch_size)
+        self.updated = time.monotonic()
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.queues)
+
+    def has_interactive(self):
+        return bool(self.queues[INTERACTIVE])
+
+    def push(self, email, first=False):
+        queue = self.queues[email.priority]
+        if first:
+            queue.appendleft(email)
+        else:
+            queue.append(email)
+
+    def refill(self, now):
+        if self.rate is None:
+            self.allowance = float(self.batch_size)
+        else:
+            self.allowance = min(
+                self.batch_size, self.allowance + max(0, now - self.updated) * self.rate
+            )
+        self.updated = now
+
+    def ready_at(self, now):
+        """
+        Time from which a batch can be taken, None while the domain has nothing to send
+        or uses all its connections.
+        """
+        if not len(self) or self.in_flight >= self.concurrency:
+            return None
+        self.refill(now)
+        ready_at = self.deferred_until
+        if self.allowance < 1:
+            ready_at = max(ready_at, now + (1 - self.allowance) / self.rate)
+        return ready_at
+
+    def take_batch(self, now):
+        self.refill(now)
+        size = min(self.batch_size, int(self.allowance))
+        batch = []
+        for queue in self.queues:
+            while queue and len(batch) < size:
+                batch.append(queue.popleft())
+        self.allowance -= len(batch)
+        self.in_flight += 1
+        return batch
+
+    def is_idle(self, now):
+        """
+        Nothing to send nor in progress, no pause and a full allowance : forgetting the
+        domain loses no limit.
+        """
+        if len(self) or self.in_flight or self.deferred_until > now:
+            return False
+        self.refill(now)
+        return self.allowance >= self.batch_size
+
+    def defer(self, now, defer_seconds):
+        self.deferrals += 1
+        pause = defer_seconds * 2 ** (self.deferrals - 1)
+        self.deferred_until = now + min(pause, MAX_DEFER_SECONDS)
+
+
+class EmailScheduler(object):
+    def __init__(
+        self,
+        workers=4,
+        batch_size=20,
+        concurrency=2,
+        rate_per_minute=120,
+        domain_limits=None,
+        defer_seconds=30,
+        max_attempts=5,
+    ):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.rate_per_minute = rate_per_minute
+        self.domain_limits = domain_limits or {}
+        self.defer_seconds = defer_seconds
+        self.max_attempts = max_attempts
+        self.reset()
+        atexit.register(self.close, DRAIN_SECONDS)
+
+    def reset(self):
+        self.domains = {}
+        self.pending = 0  # queued or being sent
+        self.threads = []
+        self.closed = False
+        self.condition = threading.Condition()
+        self._pid = os.getpid()
+
+    def get_domain_queue(self, domain):
+        if domain not in self.domains:
+            limits = self.domain_limits.get(domain, {})
+            self.domains[domain] = DomainQueue(
+                concurrency=limits.get("concurrency", self.concurrency),
+                rate_per_minute=limits.get("rate_per_minute", self.rate_per_minute),
+                batch_size=self.batch_size,
+            )
+        return self.domains[domain]
+
+    def submit(self, message, priority=INTERACTIVE, expires_at=None):
+        if self._pid != os.getpid():
+            # Forked : the queue and the threads belong to the parent process
+            self.reset()
+        with self.condition:
+            queue = self.get_domain_queue(get_domain(message))
+            queue.push(QueuedEmail(message, priority, expires_at))
+            self.pending += 1
+            self.start_workers()
+            self.condition.notify()
+
+    def start_workers(self):
+        """
+        Called with the lock held.
+        """
+        self.threads = [thread for thread in self.threads if thread.is_alive()]
+        while len(self.threads) < self.workers:
+            thread = threading.Thread(target=self.run, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def next_batch(self):
+        """
+        Wait for a domain ready to send, and return it with its batch. Domains with login
+        emails waiting come first, the others in turn. Returns None once closed.
+        """
+        with self.condition:
+            while not self.closed:
+                now = time.monotonic()
+                chosen, wait, idle = None, None, []
+                for domain, queue in self.domains.items():
+                    ready_at = queue.ready_at(now)
+                    if ready_at is None:
+                        if queue.is_idle(now):
+                            idle.append(domain)
+                        continue
+                    if ready_at > now:
+                        wait = (
+                            ready_at - now
+                            if wait is None
+                            else min(wait, ready_at - now)
+                        )
+                    elif chosen is None or (
+                        queue.has_interactive() and not chosen[1].has_interactive()
+                    ):
+                        chosen = (domain, queue)
+                for domain in idle:
+                    # Forgotten, so that the scan does not grow with every domain seen
+                    del self.domains[domain]
+                if chosen is not None:
+                    domain, queue = chosen
+                    # Move the domain to the end for the next turn
+                    self.domains[domain] = self.domains.pop(domain)
+                    return queue, self.drop_expired(queue.take_batch(now), now)
+                self.condition.wait(wait)
+        return None
+
+    def drop_expired(self, batch, now):
+        """
+        Called with the lock held.
+        """
+        expired = [email for email in batch if email.is_expired(now)]
+        if expired:
+            logger.warning(
+                "[MagicAuth] %d queued emails expired before being sent", len(expired)
+            )
+            self.pending -= len(expired)
+        return [email for email in batch if not email.is_expired(now)]
+
+    def run(self):
+        while True:
+            next_batch = self.next_batch()
+            if next_batch is None:
+                return
+            queue, batch = next_batch
+            sent, retry = 0, []
+            try:
+                sent, retry = self.send_batch(batch)
+            except Exception:
+                # Never let an error stop the thread, the batch is given up
+                logger.exception("[MagicAuth] email batch could not be sent")
+            finally:
+                self.batch_done(queue, batch, sent, retry)
+
+    def send_batch(self, batch):
+        """
+        Send the batch on one connection. Returns the number of sent emails, and the
+        emails to send again later : the one refused with a temporary error and the ones
+        after it.
+        """
+        if not batch:
+            return 0, []
+        sent, remaining = 0, deque(batch)
+        try:
+            with batch_connection() as connection:
+                while remaining:
+                    email = remaining[0]
+                    try:
+                        connection.send_messages([email.message])
+                        sent += 1
+                    except smtplib.SMTPServerDisconnected:
+                        raise
+                    except smtplib.SMTPException as e:
+                        if is_temporary_error(e):
+                            email.attempts += 1
+                            return sent, list(remaining)
+                        logger.error("[MagicAuth] email refused : %s", e)
+                    except CONNECTION_ERRORS:
+                        raise
+                    except Exception:
+                        # e.g. a malformed message : it would fail again
+                        logger.exception("[MagicAuth] email could not be sent")
+                    remaining.popleft()
+        except CONNECTION_ERRORS as e:
+            logger.warning("[MagicAuth] email connection failed : %s", e)
+            if remaining:
+                remaining[0].attempts += 1
+            return sent, list(remaining)
+        return sent, []
+
+    def batch_done(self, queue, batch, sent, retry):
+        with self.condition:
+            queue.in_flight -= 1
+            if retry:
+                queue.defer(time.monotonic(), self.defer_seconds)
+            elif sent:
+                queue.deferrals = 0
+            given_up = [email for email in retry if email.attempts >= self.max_attempts]
+            if given_up:
+                logger.error(
+                    "[MagicAuth] email given up after %d deferrals", self.max_attempts
+                )
+            for email in reversed(retry):
+                if email.attempts < self.max_attempts:
+                    queue.push(email, first=True)
+            self.pending -= len(batch) - len(retry) + len(given_up)
+            self.condition.notify_all()
+
+    def join(self, timeout=None):
+        """
+        Wait until all the queued emails are sent or given up. Returns False on timeout.
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending, timeout)
+
+    def close(self, timeout=None):
+        if self._pid != os.getpid():
+            return
+        self.join(timeout)
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_email_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = EmailScheduler(
+                    workers=magicauth_settings.EMAIL_SCHEDULER_WORKERS,
+                    batch_size=magicauth_settings.EMAIL_BATCH_SIZE,
+                    concurrency=magicauth_settings.EMAIL_DOMAIN_CONCURRENCY,
+                    rate_per_minute=magicauth_settings.EMAIL_DOMAIN_RATE_PER_MINUTE,
+                    domain_limits=magicauth_settings.EMAIL_DOMAIN_LIMITS,
+                    defer_seconds=magicauth_settings.EMAIL_DEFER_SECONDS,
+                    max_attempts=magicauth_settings.EMAIL_MAX_ATTEMPTS,
+                )
+    return _scheduler
+
+
+def send_bulk(messages):
+    """
+    Queue emails sent after the login emails, e.g. invitations sent to many users.
+    """
+    scheduler = get_email_scheduler()
+    for message in messages:
+        scheduler.submit(message, priority=BULK)
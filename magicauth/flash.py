@@ -0,0 +1,73 @@
+"""
+Flash messages of the login flow in a signed cookie, with MAGICAUTH_SESSIONLESS_ANONYMOUS.
+
+The messages framework may keep messages in the session (SessionStorage, or a
+FallbackStorage with too many messages), so that each dead link visited by a scanner
+creates a session. In this mode the message is signed in a short lived cookie instead,
+shown by the login page and then removed : the anonymous steps never write a session.
+"""
+
+from django.contrib import messages
+from django.contrib.messages.storage.base import Message
+from django.core import signing
+
+from magicauth import settings as magicauth_settings
+
+FLASH_COOKIE_NAME = "magicauth_flash"
+FLASH_COOKIE_SALT = "magicauth.flash"
+# The message is shown on the next page, an older cookie is ignored.
+FLASH_MAX_AGE = 300
+
+
+def add_warning(request, response, message):
+    """
+    Attach a warning for the next page to `response`, and return it.
+    """
+    if not magicauth_settings.SESSIONLESS_ANONYMOUS:
+        messages.warning(request, message)
+        return response
+    response.set_cookie(
+        FLASH_COOKIE_NAME,
+        # signing.dumps() is ASCII, whatever the message
+        signing.dumps([messages.WARNING, message], salt=FLASH_COOKIE_SALT),
+        max_age=FLASH_MAX_AGE,
+        secure=request.is_secure(),
+        httponly=True,
+        samesite="Lax",
+    )
+    return response
+
+
+def get_flash_messages(request):
+    value = request.COOKIES.get(FLASH_COOKIE_NAME)
+    if not value:
+        return []
+    try:
+        level, message = signing.loads(
+            value, salt=FLASH_COOKIE_SALT, max_age=FLASH_MAX_AGE
+        )
+    except (signing.BadSignature, TypeError, ValueError):
+        return []
+    return [Message(level, message)]
+
+
+class FlashMessagesMixin(object):
+    """
+    Show the flash messages with the other messages, in the `messages` of the template
+    context, and remove the cookie.
+    """
+
+    def get_context_data(self, **kwargs):
+        flash_messages = get_flash_messages(self.request)
+        if flash_messages:
+            kwargs["messages"] = [
+                *messages.get_messages(self.request),
+                *flash_messages,
+            ]
+        return super().get_context_data(**kwargs)
+
+    def dispatch(self, request, *args, **kwargs):
+        response = super().dispatch(request, *args, **kwargs)
+        if FLASH_COOKIE_NAME in request.COOKIES:
+            response.delete_cookie(FLASH_COOKIE_NAME, samesite="Lax")
+        return response
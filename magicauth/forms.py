@@ -1,8 +1,10 @@
 from django import forms
-from django.contrib.auth import get_user_model
 from django.utils.module_loading import import_string
 
 from magicauth import settings as magicauth_settings
+from magicauth.bloom import email_might_exist
+from magicauth.tracing import span
+from magicauth.user_cache import user_exists
 
 email_unknown_callback = import_string(magicauth_settings.EMAIL_UNKNOWN_CALLBACK)
 
@@ -14,8 +16,13 @@ class EmailForm(forms.Form):
         user_email = self.cleaned_data["email"]
         user_email = user_email.lower()
 
-        email_field = magicauth_settings.EMAIL_FIELD
-        field_lookup = {f"{email_field}__iexact": user_email}
-        if not get_user_model().objects.filter(**field_lookup).exists():
+        with span("magicauth.user_lookup", step="email_form") as current_span:
+            if email_might_exist(user_email):
+                user_found = user_exists(user_email, current_span)
+            else:
+                user_found = False
+                current_span.set_attribute("bloom_filter_miss", True)
+            current_span.set_attribute("user_found", user_found)
+        if not user_found:
             email_unknown_callback(user_email)
         return user_email
@@ -0,0 +1,106 @@
+"""
+Daily login funnel per site, in the LoginFunnelDay model : links requested, logins
+completed, tokens expired and not found. Dashboards read these few rows instead of
+counting tokens, which are deleted once used.
+
+MAGICAUTH_LOGIN_FUNNEL selects how the counters are updated :
+ - None (default) : no funnel.
+ - "sync" : one UPDATE ... SET counter = counter + 1 per step, in the request.
+ - "buffered" : steps are counted in memory and added to the rows by a background
+   thread after LOGIN_FUNNEL_FLUSH_SECONDS, and at process exit, with one UPDATE per
+   day, site and counter. Counts still in memory are lost if the process is killed.
+   Counts that could not be written are kept for the next flush.
+"""
+
+import logging
+from collections import Counter
+
+from django.contrib.sites.shortcuts import get_current_site
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from magicauth import settings as magicauth_settings
+from magicauth.audit import AuditBuffer
+from magicauth.models import LoginFunnelDay
+
+logger = logging.getLogger(__name__)
+
+
+def increment(day, site, counter, count=1):
+    """
+    Atomically add `count` to a counter of the (day, site) row, creating the row if
+    needed.
+    """
+    rows = LoginFunnelDay.objects.filter(day=day, site=site)
+    if rows.update(**{counter: F(counter) + count}):
+        return
+    try:
+        with transaction.atomic():
+            LoginFunnelDay.objects.create(day=day, site=site, **{counter: count})
+    except IntegrityError:
+        # Created concurrently
+        rows.update(**{counter: F(counter) + count})
+
+
+class FunnelBuffer(AuditBuffer):
+    """
+    Counts of (day, site, counter), written on a timer : they do not grow with the
+    number of logins, so there is no size limit.
+    """
+
+    def new_events(self):
+        return Counter()
+
+    def get_flush_seconds(self):
+        return magicauth_settings.LOGIN_FUNNEL_FLUSH_SECONDS
+
+    def add(self, key):
+        with self.lock:
+            self.events[key] += 1
+            self.start_timer()
+
+    def write(self, counts):
+        remaining = Counter(counts)
+        try:
+            for (day, site, counter), count in counts.items():
+                increment(day, site, counter, count)
+                del remaining[day, site, counter]
+        except Exception:
+            logger.exception(
+                "[MagicAuth] %d login funnel counts could not be written, kept for the "
+                "next flush",
+                len(remaining),
+            )
+            self.restore(remaining)
+
+    def restore(self, counts):
+        # Bounded : one count per day, site and counter
+        with self.lock:
+            self.events.update(counts)
+            self.start_timer()
+
+
+funnel_buffer = FunnelBuffer()
+
+
+def get_day():
+    now = timezone.now()
+    return timezone.localdate(now) if timezone.is_aware(now) else now.date()
+
+
+def get_site(request):
+    if request is None:
+        return ""
+    return get_current_site(request).domain[:255]
+
+
+def record_funnel(request, counter):
+    mode = magicauth_settings.LOGIN_FUNNEL
+    if not mode:
+        return
+    day, site = get_day(), get_site(request)
+    if mode == "sync":
+        increment(day, site, counter)
+    else:
+        funnel_buffer.add((day, site, counter))
@@ -0,0 +1,116 @@
+"""
+Admission control of the login form submissions, so that a login storm can not take all
+the workers of the site : above MAX_CONCURRENT_SENDS submissions in progress in the
+process (or MAX_CONCURRENT_SENDS_GLOBAL in all processes, counted in the cache), the next
+ones are answered with a 503 right away.
+
+The global count is approximate : each submission pushes the expiry of the counter
+GLOBAL_COUNTER_SECONDS later, so that it expires once no submission started for that long
+and the slots of killed processes are not lost for good. A submission ending after the
+counter expired may bring it below zero, it is then set back to zero.
+"""
+
+import threading
+from contextlib import contextmanager
+
+from django.template.response import TemplateResponse
+
+from magicauth import settings as magicauth_settings
+from magicauth.utils import get_cache
+
+GLOBAL_COUNTER_CACHE_KEY = "magicauth:sends-in-progress"
+GLOBAL_COUNTER_SECONDS = 60
+
+
+class SendsOverloaded(Exception):
+    pass
+
+
+_semaphores = {}
+_semaphores_lock = threading.Lock()
+
+
+def get_semaphore(size):
+    with _semaphores_lock:
+        if size not in _semaphores:
+            _semaphores[size] = threading.BoundedSemaphore(size)
+        return _semaphores[size]
+
+
+@contextmanager
+def process_slot():
+    size = magicauth_settings.MAX_CONCURRENT_SENDS
+    if not size:
+        yield
+        return
+    semaphore = get_semaphore(size)
+    if not semaphore.acquire(blocking=False):
+        raise SendsOverloaded()
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+
+@contextmanager
+def global_slot():
+    limit = magicauth_settings.MAX_CONCURRENT_SENDS_GLOBAL
+    if not limit:
+        yield
+        return
+    cache = get_cache()
+    cache.add(GLOBAL_COUNTER_CACHE_KEY, 0, timeout=GLOBAL_COUNTER_SECONDS)
+    try:
+        in_progress = cache.incr(GLOBAL_COUNTER_CACHE_KEY)
+        # incr() keeps the expiry of the key
+        cache.touch(GLOBAL_COUNTER_CACHE_KEY, timeout=GLOBAL_COUNTER_SECONDS)
+    except ValueError:  # Expired in the meantime
+        in_progress = 1
+        cache.set(GLOBAL_COUNTER_CACHE_KEY, 1, timeout=GLOBAL_COUNTER_SECONDS)
+    try:
+        if in_progress > limit:
+            raise SendsOverloaded()
+        yield
+    finally:
+        try:
+            if cache.decr(GLOBAL_COUNTER_CACHE_KEY) < 0:
+                # Started before the counter expired
+                cache.incr(GLOBAL_COUNTER_CACHE_KEY)
+        except ValueError:
+            pass
+
+
+@contextmanager
+def send_slot():
+    """
+    Raises SendsOverloaded when no slot is free.
+    """
+    with process_slot(), global_slot():
+        yield
+
+
+class SendLimitMixin(object):
+    """
+    Limits the concurrent POST requests of the view, see send_slot().
+    """
+
+    overloaded_template_name = magicauth_settings.OVERLOADED_VIEW_TEMPLATE
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method != "POST":
+            return super().dispatch(request, *args, **kwargs)
+        try:
+            with send_slot():
+                return super().dispatch(request, *args, **kwargs)
+        except SendsOverloaded:
+            response = self.overloaded_response()
+            response["Retry-After"] = magicauth_settings.SEND_RETRY_AFTER_SECONDS
+            return response
+
+    def overloaded_response(self):
+        return TemplateResponse(
+            self.request,
+            self.overloaded_template_name,
+            {"RETRY_AFTER_SECONDS": magicauth_settings.SEND_RETRY_AFTER_SECONDS},
+            status=503,
+        )
@@ -0,0 +1,86 @@
+"""
+"Logged in elsewhere" notification of the email sent page.
+
+Each login attempt gets an opaque id, mapped to its token in the cache. The email sent
+page long-polls LoginStatusView with this id, which only reads the cache, and the token
+validation marks the attempt as logged in. The page then tells the user that they are
+logged in on the device where they opened the link : the session itself is not handed
+off, the attempt id is in the URL and must not be enough to log in.
+
+Under WSGI a waiting request would hold a worker, so the view answers at once and the
+page polls every SHORT_POLL_SECONDS instead.
+"""
+
+import asyncio
+import hashlib
+import secrets
+import time
+
+from asgiref.sync import sync_to_async
+
+from magicauth import settings as magicauth_settings
+from magicauth.utils import get_cache
+
+ATTEMPT_CACHE_KEY = "magicauth:login-attempt:%s"
+TOKEN_ATTEMPT_CACHE_KEY = "magicauth:login-attempt-by-token:%s"
+PENDING = "pending"
+SHORT_POLL_SECONDS = 5
+LOGGED_IN = "logged_in"
+
+
+def get_token_attempt_cache_key(token_key):
+    # The token key is a secret, it is not stored in the cache as is
+    return TOKEN_ATTEMPT_CACHE_KEY % hashlib.sha256(token_key.encode()).hexdigest()
+
+
+def start_attempt(token):
+    """
+    Return the attempt id of the token, a reused token keeps its attempt.
+    """
+    cache = get_cache()
+    token_attempt_key = get_token_attempt_cache_key(token.key)
+    attempt_id = cache.get(token_attempt_key) or secrets.token_urlsafe(18)
+    cache.set_many(
+        {token_attempt_key: attempt_id, ATTEMPT_CACHE_KEY % attempt_id: PENDING},
+        timeout=magicauth_settings.TOKEN_DURATION_SECONDS,
+    )
+    return attempt_id
+
+
+def notify_logged_in(token):
+    if not magicauth_settings.LOGIN_STATUS_LONG_POLL:
+        return
+    cache = get_cache()
+    token_attempt_key = get_token_attempt_cache_key(token.key)
+    attempt_id = cache.get(token_attempt_key)
+    if attempt_id is None:
+        return
+    cache.set(
+        ATTEMPT_CACHE_KEY % attempt_id,
+        LOGGED_IN,
+        timeout=magicauth_settings.TOKEN_DURATION_SECONDS,
+    )
+    cache.delete(token_attempt_key)
+
+
+def get_attempt_status(attempt_id):
+    """
+    PENDING, LOGGED_IN, or None for an unknown or expired attempt.
+    """
+    return get_cache().get(ATTEMPT_CACHE_KEY % attempt_id)
+
+
+async def wait_for_login(attempt_id):
+    """
+    Poll the cache until the attempt is not pending anymore, or for
+    LOGIN_STATUS_TIMEOUT_SECONDS. Returns the last status.
+    """
+    deadline = time.monotonic() + magicauth_settings.LOGIN_STATUS_TIMEOUT_SECONDS
+    while True:
+        # Not thread sensitive : the waiting requests do not queue on a single thread
+        status = await sync_to_async(get_attempt_status, thread_sensitive=False)(
+            attempt_id
+        )
+        if status != PENDING or time.monotonic() >= deadline:
+            return status
+        await asyncio.sleep(magicauth_settings.LOGIN_STATUS_POLL_SECONDS)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from magicauth.bloom import build_email_filter
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the Bloom filter of user emails used by MAGICAUTH_EMAIL_BLOOM_FILTER and "
+        "store it in the cache, so that web processes do not have to build it."
+    )
+
+    def handle(self, *args, **options):
+        email_filter = build_email_filter()
+        self.stdout.write(
+            f"Email filter built : {len(email_filter.bits)} bytes, "
+            f"{email_filter.num_hashes} hash functions."
+        )
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from magicauth import partitioning
+from magicauth import settings as magicauth_settings
+from magicauth.models import MagicToken
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the expired tokens. With MAGICAUTH_TOKEN_PARTITIONING on PostgreSQL, "
+        "create the partitions of the next days and drop the expired ones instead. "
+        "Meant to run at least daily, e.g. from a cron job."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--convert",
+            action="store_true",
+            help="Convert the token table to a partitioned table first (locks it).",
+        )
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        use_partitions = magicauth_settings.TOKEN_PARTITIONING and (
+            partitioning.is_supported(connection)
+        )
+        if not use_partitions:
+            if options["convert"]:
+                raise CommandError(
+                    "Partitioning needs MAGICAUTH_TOKEN_PARTITIONING and PostgreSQL 11+."
+                )
+            deleted = MagicToken.objects.expired().delete_in_chunks(
+                chunk_size=options["chunk_size"]
+            )
+            self.stdout.write(f"Deleted {deleted} expired tokens.")
+            return
+
+        with transaction.atomic():
+            if not partitioning.is_partitioned(connection):
+                if not options["convert"]:
+                    raise CommandError(
+                        "The token table is not partitioned yet, run with --convert."
+                    )
+                partitioning.convert_table(
+                    connection, magicauth_settings.TOKEN_PARTITION_DAYS_AHEAD
+                )
+                self.stdout.write("Converted the token table to a partitioned table.")
+            dropped = partitioning.maintain_partitions(connection)
+        self.stdout.write(f"Dropped {len(dropped)} expired partitions.")
@@ -0,0 +1,34 @@
+import csv
+
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_datetime
+
+from magicauth.models import AuthEvent
+
+
+class Command(BaseCommand):
+    help = (
+        "Export the authentication events as CSV on the standard output. "
+        "The events are streamed, the whole table is never loaded in memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", help="ISO datetime of the first event to export")
+        parser.add_argument(
+            "--until", help="ISO datetime after the last event to export"
+        )
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        events = AuthEvent.objects.order_by("id")
+        if options["since"]:
+            events = events.filter(created__gte=parse_datetime(options["since"]))
+        if options["until"]:
+            events = events.filter(created__lt=parse_datetime(options["until"]))
+        fields = ("id", "created", "event", "user_id", "email", "ip_address")
+        writer = csv.writer(self.stdout)
+        writer.writerow(fields)
+        for row in events.values_list(*fields).iterator(
+            chunk_size=options["chunk_size"]
+        ):
+            writer.writerow(row)
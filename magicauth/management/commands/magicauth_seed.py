@@ -0,0 +1,125 @@
+import random
+from datetime import timedelta
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from magicauth import settings as magicauth_settings
+from magicauth.models import MagicToken
+
+EMAIL_DOMAIN = "seed.magicauth.test"
+
+
+def get_seed_email(index):
+    return f"user{index}@{EMAIL_DOMAIN}"
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate users and tokens for load tests and query plans checks, by chunks. "
+        f"The users get emails like {get_seed_email(0)}, the tokens are spread over them "
+        "with a created date mostly expired, some fresh. Do not run in production."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10000)
+        parser.add_argument("--tokens", type=int, default=100000)
+        parser.add_argument(
+            "--fresh-ratio",
+            type=float,
+            default=0.05,
+            help="Proportion of tokens created less than TOKEN_DURATION_SECONDS ago.",
+        )
+        parser.add_argument(
+            "--days", type=int, default=30, help="Age of the oldest expired tokens."
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--chunk-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        chunk_size = options["chunk_size"]
+        self.create_users(options["users"], chunk_size)
+        if options["tokens"]:
+            self.create_tokens(rng, options)
+
+    def create_users(self, count, chunk_size):
+        user_model = get_user_model()
+        fields = {magicauth_settings.EMAIL_FIELD, user_model.USERNAME_FIELD}
+        for start in range(0, count, chunk_size):
+            emails = map(get_seed_email, range(start, min(start + chunk_size, count)))
+            user_model.objects.bulk_create(
+                [
+                    user_model(
+                        password=UNUSABLE_PASSWORD_PREFIX,
+                        **{field: email for field in fields},
+                    )
+                    for email in emails
+                ],
+                # Users of a previous run are kept
+                ignore_conflicts=True,
+            )
+        self.stdout.write(f"{count} users ready.")
+
+    def get_seed_users(self):
+        lookup = {f"{magicauth_settings.EMAIL_FIELD}__endswith": f"@{EMAIL_DOMAIN}"}
+        return get_user_model().objects.filter(**lookup).order_by("pk")
+
+    def get_created(self, rng, now, options):
+        duration = magicauth_settings.TOKEN_DURATION_SECONDS
+        if rng.random() < options["fresh_ratio"]:
+            age = rng.uniform(0, duration)
+        else:
+            age = rng.uniform(duration, max(duration, options["days"] * 86400))
+        return now - timedelta(seconds=age)
+
+    def generate_tokens(self, rng, options):
+        """
+        Yield (key, user_id, created) tuples, the same ones for the same seed.
+        """
+        seed_users = self.get_seed_users()
+        user_count = seed_users.count()
+        if not user_count:
+            raise CommandError("No seed users, run with --users.")
+        per_user, remainder = divmod(options["tokens"], user_count)
+        # Streamed, to keep the memory bounded with millions of users
+        user_ids = seed_users.values_list("pk", flat=True)
+        now = timezone.now()
+        for index, user_id in enumerate(user_ids.iterator(chunk_size=10000)):
+            for _ in range(per_user + (index < remainder)):
+                key = f"{rng.getrandbits(160):040x}"
+                yield key, user_id, self.get_created(rng, now, options)
+
+    def create_tokens(self, rng, options):
+        # bulk_create() would replace the created dates (auto_now_add)
+        connection = connections[router.db_for_write(MagicToken)]
+        quote = connection.ops.quote_name
+        created_field = MagicToken._meta.get_field("created")
+        sql = (
+            f"INSERT INTO {quote(MagicToken._meta.db_table)} "
+            f"({quote('key')}, {quote('user_id')}, {quote('created')}) "
+            f"VALUES (%s, %s, %s)"
+        )
+        tokens = self.generate_tokens(rng, options)
+        inserted = 0
+        while True:
+            chunk = [
+                (key, user_id, created_field.get_db_prep_save(created, connection))
+                for key, user_id, created in islice(tokens, options["chunk_size"])
+            ]
+            if not chunk:
+                break
+            if not inserted and MagicToken.objects.filter(pk=chunk[0][0]).exists():
+                raise CommandError(
+                    f"The tokens of seed {options['seed']} already exist, "
+                    f"use another --seed."
+                )
+            with transaction.atomic(using=connection.alias):
+                with connection.cursor() as cursor:
+                    cursor.executemany(sql, chunk)
+            inserted += len(chunk)
+        self.stdout.write(f"{inserted} tokens created.")
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("magicauth", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="magictoken",
+            name="created",
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("magicauth", "0002_magictoken_created_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AuthEvent",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                (
+                    "created",
+                    models.DateTimeField(
+                        db_index=True, default=django.utils.timezone.now
+                    ),
+                ),
+                (
+                    "event",
+                    models.CharField(
+                        choices=[
+                            ("link_requested", "Link requested"),
+                            ("link_request_failed", "Link request failed"),
+                            ("otp_failed", "OTP failed"),
+                            ("token_validated", "Token validated"),
+                            ("token_expired", "Token expired"),
+                            ("token_not_found", "Token not found"),
+                        ],
+                        max_length=32,
+                    ),
+                ),
+                ("email", models.CharField(blank=True, max_length=255)),
+                ("ip_address", models.GenericIPAddressField(blank=True, null=True)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Authentication event",
+                "verbose_name_plural": "Authentication events",
+                "ordering": ("-created",),
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("magicauth", "0003_authevent"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LoginFunnelDay",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                ("day", models.DateField()),
+                ("site", models.CharField(blank=True, max_length=255)),
+                (
+                    "links_requested",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Links requested"
+                    ),
+                ),
+                (
+                    "logins_completed",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Logins completed"
+                    ),
+                ),
+                (
+                    "tokens_expired",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Tokens expired"
+                    ),
+                ),
+                (
+                    "tokens_not_found",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Tokens not found"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Login funnel day",
+                "verbose_name_plural": "Login funnel days",
+                "ordering": ("-day", "site"),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="loginfunnelday",
+            constraint=models.UniqueConstraint(
+                fields=("day", "site"), name="magicauth_loginfunnelday_day_site"
+            ),
+        ),
+    ]
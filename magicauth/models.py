@@ -1,10 +1,44 @@
+from datetime import timedelta
+
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from . import settings as magicauth_settings
 from .utils import generate_token
 
 
+class MagicTokenQuerySet(models.QuerySet):
+    def expired(self):
+        """
+        Tokens older than TOKEN_DURATION_SECONDS. Filters on the indexed `created`
+        column only, so it stays cheap on very large tables.
+        """
+        return self.filter(created__lt=get_expiry_cutoff())
+
+    def valid(self):
+        return self.filter(created__gte=get_expiry_cutoff())
+
+    def delete_in_chunks(self, chunk_size=1000):
+        """
+        Delete the tokens of this queryset by batches of `chunk_size` primary keys,
+        so that a large purge never holds a long lock nor a huge transaction.
+        Returns the number of deleted tokens.
+        """
+        deleted = 0
+        while True:
+            keys = list(self.order_by().values_list("pk", flat=True)[:chunk_size])
+            if not keys:
+                return deleted
+            self.model._base_manager.filter(pk__in=keys).delete()
+            deleted += len(keys)
+
+
+def get_expiry_cutoff():
+    return timezone.now() - timedelta(seconds=magicauth_settings.TOKEN_DURATION_SECONDS)
+
+
 class MagicToken(models.Model):
     key = models.CharField(
         verbose_name=_("Key"), primary_key=True, default=generate_token, max_length=255
@@ -12,7 +46,9 @@ class MagicToken(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL, related_name="magic_token", on_delete=models.CASCADE
     )
-    created = models.DateTimeField(auto_now_add=True)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    objects = MagicTokenQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Magic Token"
@@ -21,3 +57,84 @@ class MagicToken(models.Model):
 
     def __str__(self):
         return self.key
+
+
+class AuthEvent(models.Model):
+    """
+    Audit trail of the login flow, see magicauth/audit.py.
+    """
+
+    LINK_REQUESTED = "link_requested"
+    LINK_REQUEST_FAILED = "link_request_failed"
+    OTP_FAILED = "otp_failed"
+    TOKEN_VALIDATED = "token_validated"
+    TOKEN_EXPIRED = "token_expired"
+    TOKEN_NOT_FOUND = "token_not_found"
+    EVENT_CHOICES = (
+        (LINK_REQUESTED, _("Link requested")),
+        (LINK_REQUEST_FAILED, _("Link request failed")),
+        (OTP_FAILED, _("OTP failed")),
+        (TOKEN_VALIDATED, _("Token validated")),
+        (TOKEN_EXPIRED, _("Token expired")),
+        (TOKEN_NOT_FOUND, _("Token not found")),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    # Not auto_now_add : events are inserted later than they happen when buffered.
+    created = models.DateTimeField(default=timezone.now, db_index=True)
+    event = models.CharField(max_length=32, choices=EVENT_CHOICES)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name="+",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+    )
+    email = models.CharField(max_length=255, blank=True)
+    ip_address = models.GenericIPAddressField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = _("Authentication event")
+        verbose_name_plural = _("Authentication events")
+        ordering = ("-created",)
+
+    def __str__(self):
+        return f"{self.created} {self.event}"
+
+
+class LoginFunnelDay(models.Model):
+    """
+    Daily counters of the login flow per site, see magicauth/funnel.py. Links clicked
+    are logins_completed + tokens_expired + tokens_not_found.
+    """
+
+    LINKS_REQUESTED = "links_requested"
+    LOGINS_COMPLETED = "logins_completed"
+    TOKENS_EXPIRED = "tokens_expired"
+    TOKENS_NOT_FOUND = "tokens_not_found"
+    COUNTERS = (LINKS_REQUESTED, LOGINS_COMPLETED, TOKENS_EXPIRED, TOKENS_NOT_FOUND)
+
+    id = models.AutoField(primary_key=True)
+    day = models.DateField()
+    site = models.CharField(max_length=255, blank=True)
+    links_requested = models.PositiveIntegerField(_("Links requested"), default=0)
+    logins_completed = models.PositiveIntegerField(_("Logins completed"), default=0)
+    tokens_expired = models.PositiveIntegerField(_("Tokens expired"), default=0)
+    tokens_not_found = models.PositiveIntegerField(_("Tokens not found"), default=0)
+
+    class Meta:
+        verbose_name = _("Login funnel day")
+        verbose_name_plural = _("Login funnel days")
+        ordering = ("-day", "site")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["day", "site"], name="magicauth_loginfunnelday_day_site"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.site}"
+
+    @property
+    def links_clicked(self):
+        return self.logins_completed + self.tokens_expired + self.tokens_not_found
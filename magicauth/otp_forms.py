@@ -6,8 +6,10 @@ from django.core.validators import RegexValidator
 from django.utils import timezone
 from django.utils.translation import gettext as _
 
+from magicauth import otp_throttle
 from magicauth import settings as magicauth_settings
 from magicauth.models import MagicToken
+from magicauth.tracing import span
 
 
 class OTPForm(forms.Form):
@@ -33,19 +35,32 @@ class OTPForm(forms.Form):
 
         otp_token = self.cleaned_data["otp_token"]
         user = self.user
-        if not user_has_device(user):
-            raise ValidationError(
-                _(
-                    "Le système n'a pas trouvé d'appareil "
-                    "(carte OTP ou générateur sur téléphone) pour votre compte. "
-                    "Contactez le support pour en ajouter un."
+        with span("magicauth.otp_check", user_id=user.pk) as current_span:
+            attempts = otp_throttle.reserve_attempt(user)
+            current_span.set_attribute("throttled", otp_throttle.is_throttled(attempts))
+            if otp_throttle.is_throttled(attempts):
+                raise ValidationError(
+                    _("Trop de codes erronés. Réessayez dans quelques minutes."),
+                    code="otp_throttled",
+                )
+            if not user_has_device(user):
+                current_span.set_attribute("has_device", False)
+                raise ValidationError(
+                    _(
+                        "Le système n'a pas trouvé d'appareil "
+                        "(carte OTP ou générateur sur téléphone) pour votre compte. "
+                        "Contactez le support pour en ajouter un."
+                    )
                 )
-            )
 
-        for device in devices_for_user(user):
-            if device.verify_is_allowed() and device.verify_token(otp_token):
-                return otp_token
+            for device in devices_for_user(user):
+                if device.verify_is_allowed() and device.verify_token(otp_token):
+                    if attempts:
+                        otp_throttle.clear_failures(user)
+                    current_span.set_attribute("otp_valid", True)
+                    return otp_token
 
+            current_span.set_attribute("otp_valid", False)
         raise ValidationError(_("Ce code n'est pas valide."))
 
 
@@ -54,16 +69,21 @@ class TokenValidationForm(forms.Form):
 
     def clean_token(self):
         token = self.cleaned_data.get("token")
-        try:
-            token = MagicToken.objects.get(key=token)
-            if token.created < timezone.now() - timedelta(
+        with span("magicauth.token_lookup") as current_span:
+            try:
+                token = MagicToken.objects.get(key=token)
+            except MagicToken.DoesNotExist:
+                current_span.set_attribute("token_found", False)
+                raise ValidationError("", code="token_does_not_exist")
+            except MagicToken.MultipleObjectsReturned:
+                raise ValidationError("", code="multiple_token_returned")
+            token_expired = token.created < timezone.now() - timedelta(
                 seconds=magicauth_settings.TOKEN_DURATION_SECONDS
-            ):
-                # Do not raise here as we still want to cache the token in cleaned_data
-                # for further manipulations
-                self.add_error("token", ValidationError("", code="token_expired"))
-            return token
-        except MagicToken.DoesNotExist:
-            raise ValidationError("", code="token_does_not_exist")
-        except MagicToken.MultipleObjectsReturned:
-            raise ValidationError("", code="multiple_token_returned")
+            )
+            current_span.set_attribute("token_found", True)
+            current_span.set_attribute("token_expired", token_expired)
+        if token_expired:
+            # Do not raise here as we still want to cache the token in cleaned_data
+            # for further manipulations
+            self.add_error("token", ValidationError("", code="token_expired"))
+        return token
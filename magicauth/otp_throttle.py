@@ -0,0 +1,42 @@
+"""
+Throttling of the wrong OTP codes in the cache, before django-otp loads the devices.
+
+Each attempt of a user is counted with cache.incr() before the code is checked, for
+OTP_THROTTLE_SECONDS from the first one : parallel guesses each get their own count, none
+can pass the limit unnoticed. Past OTP_THROTTLE_MAX_FAILURES attempts, the codes are
+rejected until the count expires. A valid code clears the count.
+"""
+
+from magicauth import settings as magicauth_settings
+from magicauth.utils import get_cache
+
+FAILURES_CACHE_KEY = "magicauth:otp-failures:%s"
+
+
+def reserve_attempt(user):
+    """
+    Count an attempt and return the number of attempts since the window started, this one
+    included. 0 when the throttle is disabled.
+    """
+    if not magicauth_settings.OTP_THROTTLE:
+        return 0
+    cache = get_cache()
+    key = FAILURES_CACHE_KEY % user.pk
+    # The window starts at the first attempt, incr() keeps its expiry
+    cache.add(key, 0, timeout=magicauth_settings.OTP_THROTTLE_SECONDS)
+    try:
+        return cache.incr(key)
+    except ValueError:  # Expired in the meantime
+        cache.set(key, 1, timeout=magicauth_settings.OTP_THROTTLE_SECONDS)
+        return 1
+
+
+def is_throttled(attempts):
+    return (
+        magicauth_settings.OTP_THROTTLE
+        and attempts > magicauth_settings.OTP_THROTTLE_MAX_FAILURES
+    )
+
+
+def clear_failures(user):
+    get_cache().delete(FAILURES_CACHE_KEY % user.pk)
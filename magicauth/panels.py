@@ -0,0 +1,88 @@
+"""
+Panel for django-debug-toolbar : what magicauth did during the request, step by step, with
+the duration, the attributes and the SQL queries of each step, and the token lifecycle.
+
+Only for development. Add to your settings :
+
+    MAGICAUTH_TRACER = "magicauth.tracing.CollectingTracer"
+    DEBUG_TOOLBAR_PANELS = [..., "magicauth.panels.MagicauthPanel"]
+
+Without the toolbar, this module is never imported and the tracer setting stays unset,
+so the login flow runs with the no-op tracer.
+"""
+
+from debug_toolbar.panels import Panel
+
+from magicauth.tracing import CollectingTracer, get_tracer
+
+# Attributes of the steps, and the token state they mean
+TOKEN_STATES = [
+    ("magicauth.create_token", "token_reused", False, "created"),
+    ("magicauth.create_token", "token_reused", True, "reused"),
+    ("magicauth.token_lookup", "token_found", False, "not found"),
+    ("magicauth.token_lookup", "token_expired", True, "expired"),
+    ("magicauth.token_lookup", "token_expired", False, "valid"),
+    ("magicauth.login", None, None, "consumed"),
+]
+
+
+def get_token_states(spans):
+    states = []
+    for span in spans:
+        for name, attribute, value, state in TOKEN_STATES:
+            if span.name != name:
+                continue
+            if attribute is None or span.attributes.get(attribute) == value:
+                states.append(state)
+    return states
+
+
+def serialize_span(span):
+    duration = span.duration if span.end is not None else 0
+    return {
+        "name": span.name,
+        "depth": span.depth,
+        "duration_ms": round(duration * 1000, 2),
+        "attributes": {key: str(value) for key, value in span.attributes.items()},
+        "queries": [
+            {"sql": sql, "duration_ms": round(seconds * 1000, 2)}
+            for sql, seconds in span.queries
+        ],
+    }
+
+
+class MagicauthPanel(Panel):
+    title = "Magicauth"
+    template = "magicauth/debug_toolbar_panel.html"
+
+    def get_tracer(self):
+        tracer = get_tracer()
+        return tracer if isinstance(tracer, CollectingTracer) else None
+
+    @property
+    def nav_subtitle(self):
+        stats = self.get_stats()
+        if not stats.get("tracer_configured"):
+            return "MAGICAUTH_TRACER not set"
+        steps = [step for step in stats.get("steps", []) if step["depth"] == 0]
+        total_ms = sum(step["duration_ms"] for step in steps)
+        return f"{len(stats.get('steps', []))} steps in {total_ms:.1f} ms"
+
+    def enable_instrumentation(self):
+        tracer = self.get_tracer()
+        if tracer is not None:
+            tracer.start_collecting()
+
+    def disable_instrumentation(self):
+        tracer = self.get_tracer()
+        self.spans = tracer.stop_collecting() if tracer is not None else []
+
+    def generate_stats(self, request, response):
+        spans = getattr(self, "spans", [])
+        self.record_stats(
+            {
+                "tracer_configured": self.get_tracer() is not None,
+                "steps": [serialize_span(span) for span in spans],
+                "token_states": get_token_states(spans),
+            }
+        )
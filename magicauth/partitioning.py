@@ -0,0 +1,190 @@
+"""
+Optional PostgreSQL layout of the token table (PostgreSQL 11 or later) : the table is
+range-partitioned by `created`, one partition per day (UTC), with a BRIN index on
+`created`. Expired tokens are then removed by dropping whole partitions, instead of
+deleting rows one by one (which bloats the table and keeps the vacuum busy).
+
+The conversion and the maintenance are done by the magicauth_cleanup_tokens command.
+On other databases, or when MAGICAUTH_TOKEN_PARTITIONING is disabled, the command deletes
+the expired tokens by chunks from the regular table.
+
+Note : once the table is partitioned, its primary key is (key, created). Django still sees
+`key` as the primary key, which is fine as keys are random. Migrations altering the
+MagicToken table may not apply to the partitioned table.
+"""
+
+import re
+from datetime import datetime, time, timedelta, timezone
+
+from django.contrib.auth import get_user_model
+
+from magicauth import settings as magicauth_settings
+from magicauth.models import MagicToken, get_expiry_cutoff
+
+TABLE = MagicToken._meta.db_table
+DEFAULT_PARTITION = f"{TABLE}_default"
+PARTITION_NAME_RE = re.compile(r"_p(\d{8})$")
+
+
+def is_supported(connection):
+    return connection.vendor == "postgresql" and connection.pg_version >= 110000
+
+
+def is_partitioned(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass",
+            [TABLE],
+        )
+        return cursor.fetchone() is not None
+
+
+def get_partition_name(day):
+    return f"{TABLE}_p{day:%Y%m%d}"
+
+
+def get_day_bounds(day):
+    start = datetime.combine(day, time.min, tzinfo=timezone.utc)
+    return start.isoformat(), (start + timedelta(days=1)).isoformat()
+
+
+def get_partition_days(first_day, days_ahead, today=None):
+    today = today or datetime.now(timezone.utc).date()
+    last_day = today + timedelta(days=days_ahead)
+    return [
+        first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)
+    ]
+
+
+def create_partition(cursor, quote, day):
+    name = get_partition_name(day)
+    cursor.execute("SELECT to_regclass(%s)", [name])
+    if cursor.fetchone()[0] is not None:
+        return
+    start, end = get_day_bounds(day)
+    bounds = f"FOR VALUES FROM ('{start}') TO ('{end}')"
+    cursor.execute(
+        f"SELECT 1 FROM {quote(DEFAULT_PARTITION)} "
+        f"WHERE created >= %s AND created < %s LIMIT 1",
+        [start, end],
+    )
+    if cursor.fetchone() is None:
+        cursor.execute(
+            f"CREATE TABLE {quote(name)} PARTITION OF {quote(TABLE)} {bounds}"
+        )
+        return
+    # Tokens of that day went to the default partition (the cleanup did not run in time).
+    # A partition can not be created while the default one has rows in its range : the
+    # rows are moved to a new table first, which is then attached.
+    cursor.execute(
+        f"CREATE TABLE {quote(name)} (LIKE {quote(TABLE)} INCLUDING DEFAULTS)"
+    )
+    cursor.execute(
+        f"WITH moved AS ("
+        f"DELETE FROM {quote(DEFAULT_PARTITION)} WHERE created >= %s AND created < %s "
+        f"RETURNING key, user_id, created"
+        f") INSERT INTO {quote(name)} (key, user_id, created) "
+        f"SELECT key, user_id, created FROM moved",
+        [start, end],
+    )
+    cursor.execute(
+        f"ALTER TABLE {quote(TABLE)} ATTACH PARTITION {quote(name)} {bounds}"
+    )
+
+
+def create_partitions(connection, days):
+    """
+    Create the missing daily partitions. Must run in a transaction.
+    """
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for day in days:
+            create_partition(cursor, quote, day)
+
+
+def convert_table(connection, days_ahead):
+    """
+    Replace the token table by a partitioned one. Only the valid tokens are kept.
+    Must run in a transaction.
+    """
+    quote = connection.ops.quote_name
+    user_model = get_user_model()
+    user_id_type = MagicToken._meta.get_field("user").db_type(connection)
+    old_table = f"{TABLE}_unpartitioned"
+    cutoff = get_expiry_cutoff()
+    with connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {quote(TABLE)} IN ACCESS EXCLUSIVE MODE")
+        cursor.execute(f"ALTER TABLE {quote(TABLE)} RENAME TO {quote(old_table)}")
+        cursor.execute(
+            f"CREATE TABLE {quote(TABLE)} ("
+            f"key varchar(255) NOT NULL, "
+            f"user_id {user_id_type} NOT NULL "
+            f"REFERENCES {quote(user_model._meta.db_table)} "
+            f"({quote(user_model._meta.pk.column)}) DEFERRABLE INITIALLY DEFERRED, "
+            f"created timestamp with time zone NOT NULL, "
+            # The renamed table keeps the default name of its primary key
+            f"CONSTRAINT {quote(TABLE + '_key_created_pkey')} PRIMARY KEY (key, created)"
+            f") PARTITION BY RANGE (created)"
+        )
+        cursor.execute(
+            f"CREATE INDEX {quote(TABLE + '_user_id')} ON {quote(TABLE)} (user_id)"
+        )
+        cursor.execute(
+            f"CREATE INDEX {quote(TABLE + '_created_brin')} "
+            f"ON {quote(TABLE)} USING brin (created)"
+        )
+        # Catches the rows outside of the daily partitions, they are moved to their
+        # daily partition when it is created
+        cursor.execute(
+            f"CREATE TABLE {quote(DEFAULT_PARTITION)} PARTITION OF {quote(TABLE)} DEFAULT"
+        )
+    create_partitions(connection, get_partition_days(cutoff.date(), days_ahead))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {quote(TABLE)} (key, user_id, created) "
+            f"SELECT key, user_id, created FROM {quote(old_table)} WHERE created >= %s",
+            [cutoff],
+        )
+        cursor.execute(f"DROP TABLE {quote(old_table)}")
+
+
+def drop_expired_partitions(connection):
+    """
+    Drop the daily partitions whose tokens are all expired, delete the expired tokens of
+    the default partition. Returns the names of the dropped partitions.
+    """
+    quote = connection.ops.quote_name
+    cutoff = get_expiry_cutoff()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass",
+            [TABLE],
+        )
+        partitions = [row[0] for row in cursor.fetchall()]
+    dropped = []
+    with connection.cursor() as cursor:
+        for partition in sorted(partitions):
+            match = PARTITION_NAME_RE.search(partition)
+            if not match:
+                continue
+            day = datetime.strptime(match.group(1), "%Y%m%d").date()
+            _, end = get_day_bounds(day)
+            if datetime.fromisoformat(end) <= cutoff:
+                cursor.execute(f"DROP TABLE {quote(partition)}")
+                dropped.append(partition)
+        cursor.execute(
+            f"DELETE FROM {quote(DEFAULT_PARTITION)} WHERE created < %s", [cutoff]
+        )
+    return dropped
+
+
+def maintain_partitions(connection):
+    """
+    Create the partitions of the next days and drop the expired ones.
+    """
+    days_ahead = magicauth_settings.TOKEN_PARTITION_DAYS_AHEAD
+    create_partitions(
+        connection, get_partition_days(get_expiry_cutoff().date(), days_ahead)
+    )
+    return drop_expired_partitions(connection)
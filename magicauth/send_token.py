@@ -1,12 +1,27 @@
 import math
+import time
+from datetime import timedelta
+from functools import partial
 
-from django.contrib.auth import get_user_model
 from django.contrib.sites.shortcuts import get_current_site
-from django.core.mail import send_mail
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
 from django.template import loader
+from django.utils import timezone
 
 from magicauth import settings as magicauth_settings
+from magicauth.circuit_breaker import EmailUnavailable, get_circuit_breaker
+from magicauth.email_pool import get_connection_kwargs, get_email_pool
+from magicauth.email_scheduler import get_email_scheduler
 from magicauth.models import MagicToken
+from magicauth.token_probe import (
+    get_remaining_seconds,
+    mark_token,
+    unmark_token,
+    unmark_tokens,
+)
+from magicauth.tracing import span
+from magicauth.user_cache import get_user_by_email
 
 
 class SendTokenMixin(object):
@@ -23,6 +38,34 @@ class SendTokenMixin(object):
         token = MagicToken.objects.create(user=user)
         return token
 
+    def get_reusable_token(self, user):
+        """
+        Return the most recent token of the user if it was created less than
+        TOKEN_REUSE_SECONDS ago, so that rapid resubmits do not create new rows.
+        """
+        reuse_seconds = min(
+            magicauth_settings.TOKEN_REUSE_SECONDS,
+            magicauth_settings.TOKEN_DURATION_SECONDS,
+        )
+        if not reuse_seconds:
+            return None
+        min_created = timezone.now() - timedelta(seconds=reuse_seconds)
+        return MagicToken.objects.filter(user=user, created__gte=min_created).first()
+
+    def limit_outstanding_tokens(self, user):
+        """
+        Delete the oldest tokens of the user beyond MAX_OUTSTANDING_TOKENS.
+        """
+        max_tokens = magicauth_settings.MAX_OUTSTANDING_TOKENS
+        if not max_tokens:
+            return 0
+        stale_keys = MagicToken.objects.filter(user=user).values_list("pk", flat=True)
+        stale_keys = list(stale_keys[max_tokens:])
+        if stale_keys:
+            MagicToken.objects.filter(pk__in=stale_keys).delete()
+            unmark_tokens(stale_keys)
+        return len(stale_keys)
+
     def get_user_from_email(self, user_email):
         """
         Query the DB for the user corresponding to the email.
@@ -30,11 +73,10 @@ class SendTokenMixin(object):
         class)
          - We use magicauth_settings.EMAIL_FIELD, which is the name of the field in the user
         model. By default "username" but not always.
+         - With magicauth_settings.USER_CACHE, the user may come from the cache.
         """
-        user_class = get_user_model()
-        email_field = magicauth_settings.EMAIL_FIELD
-        field_lookup = {f"{email_field}__iexact": user_email}
-        user = user_class.objects.get(**field_lookup)
+        with span("magicauth.user_lookup", step="send_token") as current_span:
+            user = get_user_by_email(user_email, current_span)
         return user
 
     def get_email_context(self, user, token, extra_context=None):
@@ -53,8 +95,9 @@ class SendTokenMixin(object):
         return context
 
     def render_email(self, context):
-        text_message = loader.render_to_string(self.text_template, context)
-        html_message = loader.render_to_string(self.html_template, context)
+        with span("magicauth.render_email"):
+            text_message = loader.render_to_string(self.text_template, context)
+            html_message = loader.render_to_string(self.html_template, context)
 
         return text_message, html_message
 
@@ -63,16 +106,95 @@ class SendTokenMixin(object):
             self.get_email_context(user, token, extra_context)
         )
 
-        send_mail(
+        message = self.get_email_message(user_email, text_message, html_message)
+        with span("magicauth.send_email"):
+            if magicauth_settings.EMAIL_DISPATCH == "scheduled":
+                self.queue_email(message, token)
+            elif magicauth_settings.EMAIL_CIRCUIT_BREAKER:
+                self.dispatch_email_with_breaker(message)
+            else:
+                self.dispatch_email(message)
+
+    def get_email_message(self, user_email, text_message, html_message):
+        message = EmailMultiAlternatives(
             subject=self.email_subject,
-            message=text_message,
+            body=text_message,
             from_email=self.from_email,
-            html_message=html_message,
-            recipient_list=[user_email],
-            fail_silently=False,
+            to=[user_email],
         )
+        message.attach_alternative(html_message, "text/html")
+        return message
+
+    def dispatch_email(self, message):
+        """
+        Send the message, on a pooled connection if EMAIL_CONNECTION_POOL is enabled.
+        """
+        if magicauth_settings.EMAIL_CONNECTION_POOL:
+            get_email_pool().send_messages([message])
+        else:
+            message.connection = get_connection(
+                fail_silently=False, **get_connection_kwargs()
+            )
+            message.send(fail_silently=False)
+
+    def queue_email(self, message, token):
+        """
+        Hand the message to the email scheduler, which gives it up once the token expired.
+        """
+        expires_at = time.monotonic() + get_remaining_seconds(token)
+        get_email_scheduler().submit(message, expires_at=expires_at)
+
+    def dispatch_email_with_breaker(self, message):
+        """
+        Raises EmailUnavailable right away while the email server is failing, unless
+        there is an EMAIL_FALLBACK_BACKEND to send the message with.
+        """
+        try:
+            get_circuit_breaker().call(self.dispatch_email, message)
+        except EmailUnavailable:
+            if not magicauth_settings.EMAIL_FALLBACK_BACKEND:
+                raise
+            fallback_connection = get_connection(
+                magicauth_settings.EMAIL_FALLBACK_BACKEND, fail_silently=False
+            )
+            fallback_connection.send_messages([message])
+
+    def schedule_email(self, send):
+        """
+        Call `send` (which renders and dispatches the email) now, or with
+        SEND_EMAIL_ON_COMMIT once the current transaction is committed, so that a rollback
+        never leaves an email pointing to a missing token. Outside of a transaction,
+        on_commit() calls it immediately.
+        """
+        if magicauth_settings.SEND_EMAIL_ON_COMMIT:
+            transaction.on_commit(send)
+        else:
+            send()
 
     def send_token(self, user_email, extra_context=None):
         user = self.get_user_from_email(user_email)
-        token = self.create_token(user)
-        self.send_email(user, user_email, token, extra_context)
+        with span("magicauth.create_token", user_id=user.pk) as current_span:
+            # Short transaction : no lock is held while the email is sent
+            with transaction.atomic(savepoint=False):
+                token = self.get_reusable_token(user)
+                reused = token is not None
+                if not reused:
+                    token = self.create_token(user)
+                    tokens_deleted = self.limit_outstanding_tokens(user)
+                    current_span.set_attribute("tokens_deleted", tokens_deleted)
+            current_span.set_attribute("token_reused", reused)
+        if not reused:
+            mark_token(token)
+        if reused and magicauth_settings.TOKEN_REUSE_MODE == "skip":
+            return token
+        try:
+            self.schedule_email(
+                partial(self.send_email, user, user_email, token, extra_context)
+            )
+        except EmailUnavailable:
+            if not reused:
+                # Never sent : a retry must not reuse it (TOKEN_REUSE_MODE "skip")
+                unmark_token(token)
+                token.delete()
+            raise
+        return token
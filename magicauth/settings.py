@@ -24,9 +24,99 @@ EMAIL_TEXT_TEMPLATE = getattr(
 )
 FROM_EMAIL = getattr(django_settings, "MAGICAUTH_FROM_EMAIL")
 
+# Keep SMTP connections open and reuse them between login emails, instead of opening a new
+# connection (TCP, TLS, AUTH) for each email. The pool is per process.
+EMAIL_CONNECTION_POOL = getattr(
+    django_settings, "MAGICAUTH_EMAIL_CONNECTION_POOL", False
+)
+# Maximum number of connections used at the same time, per process.
+EMAIL_POOL_SIZE = getattr(django_settings, "MAGICAUTH_EMAIL_POOL_SIZE", 4)
+# Connections idle for longer than this are closed instead of being reused.
+EMAIL_POOL_IDLE_TIMEOUT = getattr(
+    django_settings, "MAGICAUTH_EMAIL_POOL_IDLE_TIMEOUT", 60
+)
+# Connections idle for longer than this are checked with a NOOP before being reused.
+EMAIL_POOL_HEALTH_CHECK_SECONDS = getattr(
+    django_settings, "MAGICAUTH_EMAIL_POOL_HEALTH_CHECK_SECONDS", 5
+)
+# "direct" sends each login email in the request. "scheduled" hands it to a background
+# scheduler sending the queued emails by recipient domain, in batches sharing a connection,
+# within per domain limits. See magicauth/email_scheduler.py.
+EMAIL_DISPATCH = getattr(django_settings, "MAGICAUTH_EMAIL_DISPATCH", "direct")
+if EMAIL_DISPATCH not in ["direct", "scheduled"]:
+    raise ValueError('EMAIL_DISPATCH must be "direct" or "scheduled"')
+# Number of scheduler threads, per process.
+EMAIL_SCHEDULER_WORKERS = getattr(
+    django_settings, "MAGICAUTH_EMAIL_SCHEDULER_WORKERS", 4
+)
+# Maximum number of emails sent on one connection.
+EMAIL_BATCH_SIZE = getattr(django_settings, "MAGICAUTH_EMAIL_BATCH_SIZE", 20)
+# Default limits of each recipient domain : connections at the same time...
+EMAIL_DOMAIN_CONCURRENCY = getattr(
+    django_settings, "MAGICAUTH_EMAIL_DOMAIN_CONCURRENCY", 2
+)
+# ... and emails per minute (None for no limit).
+EMAIL_DOMAIN_RATE_PER_MINUTE = getattr(
+    django_settings, "MAGICAUTH_EMAIL_DOMAIN_RATE_PER_MINUTE", 120
+)
+# Limits of some domains, e.g. {"gmail.com": {"concurrency": 4, "rate_per_minute": 600}}.
+EMAIL_DOMAIN_LIMITS = getattr(django_settings, "MAGICAUTH_EMAIL_DOMAIN_LIMITS", {})
+# A domain answering with a 4xx error is paused for this many seconds, doubled on each
+# consecutive deferral, and the email is given up after EMAIL_MAX_ATTEMPTS deferrals.
+# Login emails are also given up once their token expired.
+EMAIL_DEFER_SECONDS = getattr(django_settings, "MAGICAUTH_EMAIL_DEFER_SECONDS", 30)
+EMAIL_MAX_ATTEMPTS = getattr(django_settings, "MAGICAUTH_EMAIL_MAX_ATTEMPTS", 5)
+# Send the email from transaction.on_commit(), once the token is committed, when the token
+# is created inside a transaction (send_token called from your own atomic block).
+# The login views never run in the request transaction (ATOMIC_REQUESTS).
+SEND_EMAIL_ON_COMMIT = getattr(django_settings, "MAGICAUTH_SEND_EMAIL_ON_COMMIT", False)
+# Timeout in seconds of the connection to the email server and of each command sent to it.
+# None uses Django's EMAIL_TIMEOUT (no timeout by default).
+EMAIL_TIMEOUT = getattr(django_settings, "MAGICAUTH_EMAIL_TIMEOUT", None)
+# Stop trying to send emails for a while when the email server keeps failing, instead of
+# having each login wait for its timeout. See magicauth/circuit_breaker.py.
+EMAIL_CIRCUIT_BREAKER = getattr(
+    django_settings, "MAGICAUTH_EMAIL_CIRCUIT_BREAKER", False
+)
+# Number of consecutive failures after which sending stops...
+EMAIL_CIRCUIT_BREAKER_THRESHOLD = getattr(
+    django_settings, "MAGICAUTH_EMAIL_CIRCUIT_BREAKER_THRESHOLD", 5
+)
+# ... for this many seconds, then a single email is tried before sending again.
+EMAIL_CIRCUIT_BREAKER_RESET_SECONDS = getattr(
+    django_settings, "MAGICAUTH_EMAIL_CIRCUIT_BREAKER_RESET_SECONDS", 30
+)
+# Dotted path of an email backend used while the email server fails, e.g. a backend
+# queueing the emails. None shows EMAIL_UNAVAILABLE_MESSAGE on the login page instead.
+EMAIL_FALLBACK_BACKEND = getattr(
+    django_settings, "MAGICAUTH_EMAIL_FALLBACK_BACKEND", None
+)
+EMAIL_UNAVAILABLE_MESSAGE = getattr(
+    django_settings,
+    "MAGICAUTH_EMAIL_UNAVAILABLE_MESSAGE",
+    "L'envoi d'email est momentanément indisponible, veuillez réessayer dans quelques "
+    "instants.",
+)
+# Maximum number of login form submissions (user lookup, token, email) processed at the
+# same time by each process. The next ones get a 503 page right away. None for no limit.
+MAX_CONCURRENT_SENDS = getattr(django_settings, "MAGICAUTH_MAX_CONCURRENT_SENDS", None)
+# Same limit for all the processes together, counted in the cache. None for no limit.
+MAX_CONCURRENT_SENDS_GLOBAL = getattr(
+    django_settings, "MAGICAUTH_MAX_CONCURRENT_SENDS_GLOBAL", None
+)
+# Retry-After header of the 503 responses.
+SEND_RETRY_AFTER_SECONDS = getattr(
+    django_settings, "MAGICAUTH_SEND_RETRY_AFTER_SECONDS", 10
+)
+
 ###########################
 # View templates and urls
 ###########################
+# The default templates include their stylesheet (magicauth/static/magicauth/magicauth.css)
+# in a <style> element, so that the pages render without any other request. False links
+# to the static file instead (served by django.contrib.staticfiles or your web server).
+INLINE_CSS = getattr(django_settings, "MAGICAUTH_INLINE_CSS", True)
+
 # Login view :
 # the view in which your user enters their email to start the login process.
 LOGIN_URL = getattr(django_settings, "MAGICAUTH_LOGIN_URL", "login/")
@@ -35,6 +125,19 @@ LOGIN_URL = getattr(django_settings, "MAGICAUTH_LOGIN_URL", "login/")
 LOGIN_VIEW_TEMPLATE = getattr(
     django_settings, "MAGICAUTH_LOGIN_VIEW_TEMPLATE", "magicauth/login.html"
 )
+# Cache the login page rendered for anonymous visitors this many seconds, per language.
+# Only the CSRF token is replaced in each response, so the template must not depend on
+# anything else in the request. Pages with flash messages, or with a next URL other than
+# the default redirect, are never cached. 0 disables the cache.
+LOGIN_PAGE_CACHE_SECONDS = getattr(
+    django_settings, "MAGICAUTH_LOGIN_PAGE_CACHE_SECONDS", 0
+)
+# Keep the login flow free of sessions until the user is logged in : the "link no longer
+# works" message is passed to the login page in a signed cookie instead of the messages
+# framework, which may store it in the session. See magicauth/flash.py.
+SESSIONLESS_ANONYMOUS = getattr(
+    django_settings, "MAGICAUTH_SESSIONLESS_ANONYMOUS", False
+)
 # Name of the field in your User model that contains the email
 EMAIL_FIELD = getattr(django_settings, "MAGICAUTH_EMAIL_FIELD", "username")
 
@@ -59,6 +162,12 @@ WAIT_VIEW_TEMPLATE = getattr(
 # The view will look for the token in the "key" variable.
 WAIT_URL = getattr(django_settings, "MAGICAUTH_WAIT_URL", "chargement/code/<str:key>/")
 
+# Overloaded view :
+# shown instead of the login form processing when MAX_CONCURRENT_SENDS is reached.
+OVERLOADED_VIEW_TEMPLATE = getattr(
+    django_settings, "MAGICAUTH_OVERLOADED_VIEW_TEMPLATE", "magicauth/overloaded.html"
+)
+
 # Validate token view :
 # validates the token in the url, does the login, and redirects to
 # LOGGED_IN_REDIRECT_URL_NAME. This view has no template, the user never sees it.
@@ -67,6 +176,25 @@ VALIDATE_TOKEN_URL = getattr(
     django_settings, "MAGICAUTH_VALIDATE_TOKEN_URL", "code/<str:key>/"
 )
 
+# Login status view :
+# long-polled by the email sent page, which tells the user once they logged in with the
+# link, possibly on another device. See magicauth/login_status.py. Needs a cache shared by
+# all processes. Under ASGI each waiting page holds a request for up to
+# LOGIN_STATUS_TIMEOUT_SECONDS, under WSGI the page polls every few seconds instead.
+LOGIN_STATUS_LONG_POLL = getattr(
+    django_settings, "MAGICAUTH_LOGIN_STATUS_LONG_POLL", False
+)
+LOGIN_STATUS_URL = getattr(
+    django_settings, "MAGICAUTH_LOGIN_STATUS_URL", "statut-connexion/<str:attempt_id>/"
+)
+LOGIN_STATUS_TIMEOUT_SECONDS = getattr(
+    django_settings, "MAGICAUTH_LOGIN_STATUS_TIMEOUT_SECONDS", 25
+)
+# How often a waiting request reads the cache.
+LOGIN_STATUS_POLL_SECONDS = getattr(
+    django_settings, "MAGICAUTH_LOGIN_STATUS_POLL_SECONDS", 1
+)
+
 # Logged in redirect view :
 # view on which the user lands once logged in. This is a view in your site, probably
 # something like "home".
@@ -91,6 +219,20 @@ DEFAULT_AUTHENTICATION_BACKEND = getattr(
 TOKEN_DURATION_SECONDS = getattr(
     django_settings, "MAGICAUTH_TOKEN_DURATION_SECONDS", 5 * 60
 )
+# Rapid resubmits of the login form (double clicks, impatient retries) :
+# if the user already has a token created less than TOKEN_REUSE_SECONDS ago, it is reused
+# instead of creating a new one. 0 disables the reuse.
+TOKEN_REUSE_SECONDS = getattr(django_settings, "MAGICAUTH_TOKEN_REUSE_SECONDS", 0)
+# What to do when a token is reused : "resend" sends the same link again,
+# "skip" sends nothing (the user still lands on the email sent page).
+TOKEN_REUSE_MODE = getattr(django_settings, "MAGICAUTH_TOKEN_REUSE_MODE", "resend")
+if TOKEN_REUSE_MODE not in ["resend", "skip"]:
+    raise ValueError('TOKEN_REUSE_MODE must be either "resend" or "skip"')
+# Maximum number of tokens a user can have at the same time, the oldest ones are deleted.
+# None for no limit.
+MAX_OUTSTANDING_TOKENS = getattr(
+    django_settings, "MAGICAUTH_MAX_OUTSTANDING_TOKENS", None
+)
 # Function to call when the email entered in the form is not found in the database.
 # The default just raises an error whose message gets displayed on the login page.
 EMAIL_UNKNOWN_CALLBACK = getattr(
@@ -103,8 +245,71 @@ EMAIL_UNKNOWN_MESSAGE = getattr(
 )
 # How long the user will wait on the WAIT_URL page before doing the actual login.
 WAIT_SECONDS = getattr(django_settings, "MAGICAUTH_WAIT_SECONDS", 3)
+# Let the WAIT_URL page check the token first (in the cache, or with one query) and
+# redirect dead links to the login page at once. See magicauth/token_probe.py.
+WAIT_TOKEN_PRECHECK = getattr(django_settings, "MAGICAUTH_WAIT_TOKEN_PRECHECK", False)
 # This enables the 2FA OTP field
 ENABLE_2FA = getattr(django_settings, "MAGICAUTH_ENABLE_2FA", False)
+# Count the wrong OTP codes of each user in the cache, and reject the codes of a user
+# with OTP_THROTTLE_MAX_FAILURES wrong codes in OTP_THROTTLE_SECONDS without loading their
+# devices. This spares the device rows the throttling writes of django-otp during bursts.
+OTP_THROTTLE = getattr(django_settings, "MAGICAUTH_OTP_THROTTLE", False)
+OTP_THROTTLE_MAX_FAILURES = getattr(
+    django_settings, "MAGICAUTH_OTP_THROTTLE_MAX_FAILURES", 5
+)
+OTP_THROTTLE_SECONDS = getattr(django_settings, "MAGICAUTH_OTP_THROTTLE_SECONDS", 300)
+# Alias of the Django cache used by the cache-based features below.
+CACHE_ALIAS = getattr(django_settings, "MAGICAUTH_CACHE_ALIAS", "default")
+# Keep a Bloom filter of the user emails, so that unknown emails are rejected by the login
+# form without querying the database. See magicauth/bloom.py.
+EMAIL_BLOOM_FILTER = getattr(django_settings, "MAGICAUTH_EMAIL_BLOOM_FILTER", False)
+# Proportion of unknown emails that will still be checked in the database.
+EMAIL_BLOOM_FILTER_FALSE_POSITIVE_RATE = getattr(
+    django_settings, "MAGICAUTH_EMAIL_BLOOM_FILTER_FALSE_POSITIVE_RATE", 0.01
+)
+# Upper bound of the filter size. A smaller filter has more false positives.
+EMAIL_BLOOM_FILTER_MAX_BYTES = getattr(
+    django_settings, "MAGICAUTH_EMAIL_BLOOM_FILTER_MAX_BYTES", 16 * 1024 * 1024
+)
+# How often the filter is rebuilt from the database.
+EMAIL_BLOOM_FILTER_REFRESH_SECONDS = getattr(
+    django_settings, "MAGICAUTH_EMAIL_BLOOM_FILTER_REFRESH_SECONDS", 60 * 60
+)
+# Cache the users looked up by email, see magicauth/user_cache.py.
+USER_CACHE = getattr(django_settings, "MAGICAUTH_USER_CACHE", False)
+# How long an email is mapped to a user pk in the cache.
+USER_CACHE_TIMEOUT = getattr(django_settings, "MAGICAUTH_USER_CACHE_TIMEOUT", 60 * 60)
+# How long the user object itself is cached.
+USER_OBJECT_CACHE_TIMEOUT = getattr(
+    django_settings, "MAGICAUTH_USER_OBJECT_CACHE_TIMEOUT", 60
+)
+# Audit trail of the login flow, see magicauth/audit.py : None, "sync" or "buffered".
+AUDIT_LOG = getattr(django_settings, "MAGICAUTH_AUDIT_LOG", None)
+if AUDIT_LOG not in [None, "sync", "buffered"]:
+    raise ValueError('AUDIT_LOG must be None, "sync" or "buffered"')
+# In "buffered" mode, events are inserted when this many are waiting...
+AUDIT_BUFFER_SIZE = getattr(django_settings, "MAGICAUTH_AUDIT_BUFFER_SIZE", 100)
+# ... or at the latest this many seconds after the first one.
+AUDIT_FLUSH_SECONDS = getattr(django_settings, "MAGICAUTH_AUDIT_FLUSH_SECONDS", 5)
+# Daily counters of the login flow per site in the LoginFunnelDay model, for dashboards.
+# None (default), "sync" (one UPDATE per step, in the request) or "buffered" (counted in
+# memory and added every LOGIN_FUNNEL_FLUSH_SECONDS). See magicauth/funnel.py.
+LOGIN_FUNNEL = getattr(django_settings, "MAGICAUTH_LOGIN_FUNNEL", None)
+if LOGIN_FUNNEL not in [None, "sync", "buffered"]:
+    raise ValueError('LOGIN_FUNNEL must be None, "sync" or "buffered"')
+LOGIN_FUNNEL_FLUSH_SECONDS = getattr(
+    django_settings, "MAGICAUTH_LOGIN_FUNNEL_FLUSH_SECONDS", 30
+)
+# On PostgreSQL, let magicauth_cleanup_tokens keep the token table partitioned by day,
+# expired tokens are then dropped by whole partitions. See magicauth/partitioning.py.
+TOKEN_PARTITIONING = getattr(django_settings, "MAGICAUTH_TOKEN_PARTITIONING", False)
+# Number of daily partitions created in advance.
+TOKEN_PARTITION_DAYS_AHEAD = getattr(
+    django_settings, "MAGICAUTH_TOKEN_PARTITION_DAYS_AHEAD", 3
+)
+# Dotted path of a magicauth.tracing.Tracer class, to trace each step of the login flow.
+# e.g. "magicauth.tracing.OpenTelemetryTracer". None disables tracing.
+TRACER = getattr(django_settings, "MAGICAUTH_TRACER", None)
 # Can be 6 or 8 (https://django-otp-official.readthedocs.io/en/stable/overview.html#django_otp.plugins.otp_totp.models.TOTPDevice.digits)  # noqa: E501
 OTP_NUM_DIGITS = getattr(django_settings, "MAGICAUTH_OTP_NUM_DIGITS", 6)
 if OTP_NUM_DIGITS not in [6, 8]:
@@ -0,0 +1,43 @@
+import hashlib
+import os
+from functools import lru_cache
+
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+from magicauth import settings as magicauth_settings
+
+register = template.Library()
+
+CSS_PATH = "magicauth/magicauth.css"
+
+
+@lru_cache(maxsize=None)
+def get_css():
+    path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "static", CSS_PATH)
+    with open(path, encoding="utf-8") as css_file:
+        return css_file.read()
+
+
+@lru_cache(maxsize=None)
+def get_css_url():
+    url = static(CSS_PATH)
+    if url.endswith(CSS_PATH):
+        # Not renamed by a hashing storage (ManifestStaticFilesStorage) : bust the caches
+        # of the previous versions with the content hash
+        digest = hashlib.sha256(get_css().encode()).hexdigest()[:12]
+        url = f"{url}?v={digest}"
+    return url
+
+
+@register.simple_tag
+def magicauth_css():
+    """
+    The styles of the magicauth pages, in a <style> element with MAGICAUTH_INLINE_CSS
+    (no request for the page to render), or a link to the static file otherwise.
+    """
+    if magicauth_settings.INLINE_CSS:
+        return mark_safe(f"<style>{get_css()}</style>")
+    return format_html('<link href="{}" rel="stylesheet">', get_css_url())
@@ -0,0 +1,68 @@
+"""
+Cheap check of a token by WaitView, so that dead links go back to the login page at once
+instead of after WAIT_SECONDS and a redirect.
+
+The created tokens are marked in the cache until they expire, a marked token is alive
+without a query. Otherwise a single primary key query checks that the token exists and
+has not expired. The probe never consumes nor deletes the token : it may call a token
+alive that was just used, ValidateTokenView then rejects it as before.
+"""
+
+import hashlib
+from datetime import timedelta
+
+from django.utils import timezone
+
+from magicauth import settings as magicauth_settings
+from magicauth.models import MagicToken
+from magicauth.utils import get_cache
+
+TOKEN_CACHE_KEY = "magicauth:token-alive:%s"
+
+
+def get_token_cache_key(token_key):
+    # The token key is a secret, it is not stored in the cache as is
+    return TOKEN_CACHE_KEY % hashlib.sha256(token_key.encode()).hexdigest()
+
+
+def get_remaining_seconds(token):
+    expires = token.created + timedelta(
+        seconds=magicauth_settings.TOKEN_DURATION_SECONDS
+    )
+    return int((expires - timezone.now()).total_seconds())
+
+
+def mark_token(token):
+    if not magicauth_settings.WAIT_TOKEN_PRECHECK:
+        return
+    remaining_seconds = get_remaining_seconds(token)
+    if remaining_seconds > 0:
+        get_cache().set(get_token_cache_key(token.key), 1, timeout=remaining_seconds)
+
+
+def unmark_tokens(keys):
+    """
+    Remove the markers of deleted tokens. `keys` is only evaluated when the check is
+    enabled, a lazy queryset costs nothing otherwise.
+    """
+    if magicauth_settings.WAIT_TOKEN_PRECHECK:
+        get_cache().delete_many([get_token_cache_key(key) for key in keys])
+
+
+def unmark_token(token):
+    unmark_tokens([token.key])
+
+
+def is_token_alive(token_key):
+    if get_cache().get(get_token_cache_key(token_key)):
+        return True
+    created = (
+        MagicToken.objects.valid()
+        .filter(key=token_key)
+        .values_list("created", flat=True)
+        .first()
+    )
+    if created is None:
+        return False
+    mark_token(MagicToken(key=token_key, created=created))
+    return True
@@ -0,0 +1,197 @@
+"""
+Optional tracing of the steps of the login flow (user lookup, token creation, email
+rendering and sending, token validation, login).
+
+Tracing is disabled by default. To enable it, set MAGICAUTH_TRACER to the dotted path of a
+Tracer class, for instance "magicauth.tracing.OpenTelemetryTracer".
+When disabled, each traced step only costs a settings lookup and an empty context manager.
+"""
+
+import threading
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.utils.module_loading import import_string
+
+from magicauth import settings as magicauth_settings
+
+
+class NoOpSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+
+class Tracer(object):
+    """
+    Interface of a tracer : start_span returns a context manager. Entering it returns a
+    span object with a `set_attribute(key, value)` method.
+    """
+
+    def start_span(self, name, attributes):
+        raise NotImplementedError
+
+
+class NoOpTracer(Tracer):
+    def start_span(self, name, attributes):
+        return NOOP_SPAN
+
+
+class RecordedSpan(object):
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = dict(attributes)
+        self.start = None
+        self.end = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end = time.perf_counter()
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.tracer.spans.append(self)
+        return False
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+class InMemoryTracer(Tracer):
+    """
+    Keeps the finished spans in memory, in the order they ended. Meant for tests.
+    """
+
+    def __init__(self):
+        self.spans = []
+
+    def start_span(self, name, attributes):
+        return RecordedSpan(self, name, attributes)
+
+    def get_span(self, name):
+        return next(span for span in self.spans if span.name == name)
+
+    def clear(self):
+        self.spans = []
+
+
+class CollectedSpan(RecordedSpan):
+    """
+    A span of CollectingTracer, with the SQL queries run during the span (and not during
+    a nested span).
+    """
+
+    def __init__(self, tracer, name, attributes):
+        super().__init__(tracer, name, attributes)
+        self.depth = 0
+        self.queries = []
+        self.query_wrapper = None
+
+    def __enter__(self):
+        state = self.tracer.local
+        self.depth = len(state.stack)
+        state.spans.append(self)
+        state.stack.append(self)
+        self.query_wrapper = connection.execute_wrapper(self.record_query)
+        self.query_wrapper.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end = time.perf_counter()
+        self.query_wrapper.__exit__(exc_type, exc_value, traceback)
+        self.tracer.local.stack.pop()
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        return False
+
+    def record_query(self, execute, sql, params, many, context):
+        if self.tracer.local.stack[-1] is not self:
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+
+class CollectingTracer(Tracer):
+    """
+    Records the spans of the current thread, in the order they started, between
+    start_collecting() and stop_collecting(). Outside of them, spans are no-ops.
+    Used by the debug toolbar panel, see magicauth/panels.py.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def start_collecting(self):
+        self.local.spans, self.local.stack = [], []
+
+    def stop_collecting(self):
+        spans = getattr(self.local, "spans", None) or []
+        self.local.spans = None
+        return spans
+
+    def start_span(self, name, attributes):
+        if getattr(self.local, "spans", None) is None:
+            return NOOP_SPAN
+        return CollectedSpan(self, name, attributes)
+
+
+class OpenTelemetryTracer(Tracer):
+    """
+    Sends the spans to OpenTelemetry. Requires the opentelemetry-api package, the exporter
+    is configured by your project.
+    """
+
+    def __init__(self):
+        try:
+            from opentelemetry import trace
+        except ImportError as e:
+            raise ImproperlyConfigured(
+                "MAGICAUTH_TRACER is set to OpenTelemetryTracer but the "
+                "opentelemetry-api package is not installed."
+            ) from e
+        self.tracer = trace.get_tracer("magicauth")
+
+    def start_span(self, name, attributes):
+        return self.tracer.start_as_current_span(name, attributes=attributes)
+
+
+NOOP_SPAN = NoOpSpan()
+NOOP_TRACER = NoOpTracer()
+_tracers = {}
+
+
+def get_tracer():
+    tracer_path = magicauth_settings.TRACER
+    if not tracer_path:
+        return NOOP_TRACER
+    try:
+        return _tracers[tracer_path]
+    except KeyError:
+        tracer = _tracers[tracer_path] = import_string(tracer_path)()
+        return tracer
+
+
+def span(name, **attributes):
+    """
+    with span("magicauth.create_token", user_id=user.pk) as current_span:
+        ...
+        current_span.set_attribute("tokens_deleted", count)
+    """
+    return get_tracer().start_span(name, attributes)
@@ -24,4 +24,9 @@ urlpatterns = [
         magicauth_views.ValidateTokenView.as_view(),
         name="magicauth-validate-token",
     ),
+    path(
+        magicauth_settings.LOGIN_STATUS_URL,
+        magicauth_views.LoginStatusView.as_view(),
+        name="magicauth-login-status",
+    ),
 ]
@@ -0,0 +1,114 @@
+"""
+Lookup of users by email, with an optional cache.
+
+With MAGICAUTH_USER_CACHE enabled, the normalized email is mapped to the user pk in the
+cache for USER_CACHE_TIMEOUT seconds, and the user object itself is cached for
+USER_OBJECT_CACHE_TIMEOUT seconds. Both are invalidated when the user is saved or deleted,
+except for saves of other fields only (e.g. last_login, saved at each login).
+Updates done with QuerySet.update() do not send signals : the cached user object can then
+be stale for up to USER_OBJECT_CACHE_TIMEOUT seconds.
+"""
+
+import hashlib
+
+from django.contrib.auth import get_user_model
+
+from magicauth import settings as magicauth_settings
+from magicauth.tracing import NOOP_SPAN
+from magicauth.utils import get_cache
+
+EMAIL_CACHE_KEY = "magicauth:user-pk-by-email:%s"
+USER_CACHE_KEY = "magicauth:user:%s"
+
+
+def get_email_cache_key(email):
+    # Hashed to always get a valid cache key, whatever the email contains
+    email = email.strip().lower()
+    return EMAIL_CACHE_KEY % hashlib.sha256(email.encode()).hexdigest()
+
+
+def get_email_lookup(email):
+    return {f"{magicauth_settings.EMAIL_FIELD}__iexact": email}
+
+
+def get_cached_user(email):
+    cache = get_cache()
+    email_key = get_email_cache_key(email)
+    pk = cache.get(email_key)
+    if pk is None:
+        return None
+    user = cache.get(USER_CACHE_KEY % pk)
+    from_cache = user is not None
+    if not from_cache:
+        user = get_user_model().objects.filter(pk=pk).first()
+    user_email = getattr(user, magicauth_settings.EMAIL_FIELD, None) or ""
+    if user_email.lower() != email.strip().lower():
+        # The user was deleted or changed their email
+        cache.delete(email_key)
+        return None
+    if not from_cache:
+        cache.set(
+            USER_CACHE_KEY % pk,
+            user,
+            timeout=magicauth_settings.USER_OBJECT_CACHE_TIMEOUT,
+        )
+    return user
+
+
+def cache_user(user):
+    email = getattr(user, magicauth_settings.EMAIL_FIELD)
+    get_cache().set(
+        get_email_cache_key(email),
+        user.pk,
+        timeout=magicauth_settings.USER_CACHE_TIMEOUT,
+    )
+    get_cache().set(
+        USER_CACHE_KEY % user.pk,
+        user,
+        timeout=magicauth_settings.USER_OBJECT_CACHE_TIMEOUT,
+    )
+
+
+def get_user_by_email(email, current_span=NOOP_SPAN):
+    """
+    Return the user whose EMAIL_FIELD matches `email` (case insensitive).
+    Raises DoesNotExist (or MultipleObjectsReturned) like QuerySet.get().
+    """
+    if magicauth_settings.USER_CACHE:
+        user = get_cached_user(email)
+        current_span.set_attribute("cache_hit", user is not None)
+        if user is not None:
+            return user
+    user = get_user_model().objects.get(**get_email_lookup(email))
+    if magicauth_settings.USER_CACHE:
+        cache_user(user)
+    return user
+
+
+def user_exists(email, current_span=NOOP_SPAN):
+    if not magicauth_settings.USER_CACHE:
+        return get_user_model().objects.filter(**get_email_lookup(email)).exists()
+    try:
+        get_user_by_email(email, current_span)
+    except get_user_model().DoesNotExist:
+        return False
+    return True
+
+
+def invalidate_user(sender, instance, **kwargs):
+    """
+    post_save and post_delete receiver for the user model.
+    """
+    if not magicauth_settings.USER_CACHE:
+        return
+    update_fields = kwargs.get("update_fields")
+    if update_fields is not None and not update_fields & {
+        magicauth_settings.EMAIL_FIELD,
+        "is_active",
+    }:
+        return
+    keys = [USER_CACHE_KEY % instance.pk]
+    email = getattr(instance, magicauth_settings.EMAIL_FIELD, None)
+    if email:
+        keys.append(get_email_cache_key(email))
+    get_cache().delete_many(keys)
@@ -2,6 +2,7 @@ import binascii
 import os
 
 from django import forms
+from django.core.cache import caches
 
 from . import settings as magicauth_settings
 
@@ -10,6 +11,10 @@ def generate_token():
     return binascii.hexlify(os.urandom(20)).decode()
 
 
+def get_cache():
+    return caches[magicauth_settings.CACHE_ALIAS]
+
+
 def raise_error(email=None):
     """
     Just raise an error - this can be used as a call back function
@@ -1,20 +1,47 @@
+import hashlib
 import logging
+import re
 import warnings
 
 from django.contrib import messages
-from django.contrib.auth import get_user_model, login
+from django.contrib.auth import login
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
 from django.forms.utils import ErrorList
+from django.http import Http404, HttpResponse, JsonResponse
+from django.middleware.csrf import get_token
 from django.shortcuts import redirect
 from django.urls import reverse, reverse_lazy
+from django.utils.cache import add_never_cache_headers
 from django.utils.decorators import method_decorator
+from django.utils.translation import get_language
+from django.views import View
 from django.views.decorators.http import require_GET
 from django.views.generic import FormView, TemplateView
 
+from asgiref.sync import sync_to_async
+
 from magicauth import settings as magicauth_settings
+from magicauth.audit import record_event
+from magicauth.circuit_breaker import EmailUnavailable
+from magicauth.flash import FlashMessagesMixin, add_warning, get_flash_messages
 from magicauth.forms import EmailForm
-from magicauth.models import MagicToken
+from magicauth.funnel import record_funnel
+from magicauth.limiter import SendLimitMixin
+from magicauth.login_status import (
+    SHORT_POLL_SECONDS,
+    get_attempt_status,
+    notify_logged_in,
+    start_attempt,
+    wait_for_login,
+)
+from magicauth.models import AuthEvent, LoginFunnelDay, MagicToken
 from magicauth.next_url import NextUrlMixin
 from magicauth.send_token import SendTokenMixin
+from magicauth.token_probe import is_token_alive, unmark_tokens
+from magicauth.tracing import span
+from magicauth.user_cache import get_user_by_email
+from magicauth.utils import get_cache
 
 try:
     from magicauth.otp_forms import OTPForm, TokenValidationForm
@@ -24,8 +51,21 @@ except ImportError:
 
 logger = logging.getLogger()
 
-
-class LoginView(NextUrlMixin, SendTokenMixin, FormView):
+LOGIN_PAGE_CACHE_KEY = "magicauth:login-page:%s"
+CSRF_TOKEN_PLACEHOLDER = "magicauth-csrf-token-placeholder"
+ATTEMPT_ID_RE = re.compile(r"^[\w-]{1,64}$")
+TOKEN_INVALID_MESSAGE = (
+    "Ce lien de connexion ne fonctionne plus. "
+    "Pour en recevoir un nouveau, nous vous invitons à renseigner "
+    "votre email ci-dessous puis à cliquer sur valider."
+)
+
+
+# The token is committed before the email is sent, even with ATOMIC_REQUESTS
+@method_decorator(transaction.non_atomic_requests, name="dispatch")
+class LoginView(
+    FlashMessagesMixin, SendLimitMixin, NextUrlMixin, SendTokenMixin, FormView
+):
     """
     Step 1 of login process : GET the LoginView.
     Step 2 of login process : POST your email to the LoginView.
@@ -41,8 +81,54 @@ class LoginView(NextUrlMixin, SendTokenMixin, FormView):
         if request.user.is_authenticated:
             next_url = self.get_next_url(self.request)
             return redirect(next_url)
+        if (
+            magicauth_settings.LOGIN_PAGE_CACHE_SECONDS
+            and self.has_default_next_url()
+            and not self.has_messages()
+        ):
+            return self.get_cached_page()
         return super(LoginView, self).get(request, *args, **kwargs)
 
+    def has_messages(self):
+        if get_flash_messages(self.request):
+            return True
+        # len() does not mark the messages as read
+        return len(messages.get_messages(self.request)) > 0
+
+    def has_default_next_url(self):
+        """
+        Only the page without next URL is cached : any ?next= would add a cache entry.
+        """
+        next_url = self.request.GET.get("next")
+        return not next_url or next_url == reverse(
+            magicauth_settings.LOGGED_IN_REDIRECT_URL_NAME
+        )
+
+    def get_page_cache_key(self):
+        key = "\n".join([self.get_template_names()[0], get_language() or ""])
+        return LOGIN_PAGE_CACHE_KEY % hashlib.sha256(key.encode()).hexdigest()
+
+    def get_cached_page(self):
+        """
+        The page rendered once with a placeholder instead of the CSRF token, which is
+        replaced in each response.
+        """
+        cache = get_cache()
+        cache_key = self.get_page_cache_key()
+        content = cache.get(cache_key)
+        if content is None:
+            response = self.render_to_response(
+                self.get_context_data(csrf_token=CSRF_TOKEN_PLACEHOLDER)
+            )
+            content = response.rendered_content
+            cache.set(
+                cache_key, content, timeout=magicauth_settings.LOGIN_PAGE_CACHE_SECONDS
+            )
+        # get_token() also makes the middleware set the CSRF cookie
+        return HttpResponse(
+            content.replace(CSRF_TOKEN_PLACEHOLDER, get_token(self.request))
+        )
+
     def get_context_data(self, **kwargs):
         if magicauth_settings.ENABLE_2FA and "OTP_form" not in kwargs:
             kwargs["OTP_form"] = self.get_otp_form()
@@ -57,6 +143,9 @@ class LoginView(NextUrlMixin, SendTokenMixin, FormView):
         url = reverse_lazy("magicauth-email-sent")
         # Use encoded next URL before including it in a string
         next_url_quoted = self.get_next_url_encoded(self.request)
+        attempt_id = getattr(self, "attempt_id", None)
+        if attempt_id:
+            return f"{url}?next={next_url_quoted}&attempt={attempt_id}"
         return f"{url}?next={next_url_quoted}"
 
     def form_valid(self, form, *args, **kwargs):
@@ -69,14 +158,34 @@ class LoginView(NextUrlMixin, SendTokenMixin, FormView):
         if magicauth_settings.ENABLE_2FA and not otp_form.is_valid():
             return self.otp_form_invalid(form, otp_form)
 
-        self.send_token(user_email=user_email, extra_context=context)
+        try:
+            token = self.send_token(user_email=user_email, extra_context=context)
+        except EmailUnavailable:
+            form.add_error("email", magicauth_settings.EMAIL_UNAVAILABLE_MESSAGE)
+            return self.form_invalid(form)
+        if magicauth_settings.LOGIN_STATUS_LONG_POLL:
+            self.attempt_id = start_attempt(token)
+        record_event(AuthEvent.LINK_REQUESTED, self.request, user.pk, user_email)
+        record_funnel(self.request, LoginFunnelDay.LINKS_REQUESTED)
         return super().form_valid(form)
 
+    def form_invalid(self, form):
+        record_event(
+            AuthEvent.LINK_REQUEST_FAILED, self.request, email=form.data.get("email")
+        )
+        return super().form_invalid(form)
+
     def get_user(self, user_email):
-        email_field = "%s__iexact" % magicauth_settings.EMAIL_FIELD
-        return get_user_model().objects.get(**{email_field: user_email})
+        with span("magicauth.user_lookup", step="login_view") as current_span:
+            return get_user_by_email(user_email, current_span)
 
     def otp_form_invalid(self, form, otp_form):
+        record_event(
+            AuthEvent.OTP_FAILED,
+            self.request,
+            otp_form.user.pk,
+            form.cleaned_data.get("email"),
+        )
         if self.use_deprecated_login_for_errors:
             # This should be done on the client side if needed
             msg = (
@@ -124,6 +233,42 @@ class EmailSentView(NextUrlMixin, TemplateView):
 
     template_name = magicauth_settings.EMAIL_SENT_VIEW_TEMPLATE
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        attempt_id = self.request.GET.get("attempt", "")
+        if magicauth_settings.LOGIN_STATUS_LONG_POLL and ATTEMPT_ID_RE.match(
+            attempt_id
+        ):
+            context["login_status_url"] = reverse(
+                "magicauth-login-status", kwargs={"attempt_id": attempt_id}
+            )
+        return context
+
+
+class LoginStatusView(View):
+    """
+    Long-polled by the email sent page : answers once the token of the login attempt is
+    used, or after LOGIN_STATUS_TIMEOUT_SECONDS. Only reads the cache. Under WSGI it
+    answers at once, retry_seconds tells the page when to ask again.
+    {"status": "logged_in"} or {"status": "pending"}, 404 for an unknown attempt.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        if not magicauth_settings.LOGIN_STATUS_LONG_POLL:
+            raise Http404()
+        if isinstance(request, ASGIRequest):
+            status = await wait_for_login(kwargs["attempt_id"])
+            retry_seconds = 0
+        else:
+            status = await sync_to_async(get_attempt_status)(kwargs["attempt_id"])
+            retry_seconds = SHORT_POLL_SECONDS
+        if status is None:
+            response = JsonResponse({"status": "unknown"}, status=404)
+        else:
+            response = JsonResponse({"status": status, "retry_seconds": retry_seconds})
+        add_never_cache_headers(response)
+        return response
+
 
 class WaitView(NextUrlMixin, TemplateView):
     """
@@ -138,6 +283,19 @@ class WaitView(NextUrlMixin, TemplateView):
 
     template_name = magicauth_settings.WAIT_VIEW_TEMPLATE
 
+    def get(self, request, *args, **kwargs):
+        if magicauth_settings.WAIT_TOKEN_PRECHECK:
+            # An unsafe next URL is a 404 first, whatever the token
+            self.get_next_url(request)
+            with span("magicauth.token_precheck") as current_span:
+                token_alive = is_token_alive(kwargs.get("key"))
+                current_span.set_attribute("token_alive", token_alive)
+            if not token_alive:
+                return add_warning(
+                    request, redirect(reverse("magicauth-login")), TOKEN_INVALID_MESSAGE
+                )
+        return super().get(request, *args, **kwargs)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         token_key = kwargs.get("key")
@@ -150,8 +308,55 @@ class WaitView(NextUrlMixin, TemplateView):
         return context
 
 
+class TokenLoginMixin(object):
+    """
+    Helper for logging in the user of a token validated by TokenValidationForm.
+    """
+
+    def get_token_error_codes(self, form):
+        return [err.code for err in form.errors.get("token", ErrorList()).data]
+
+    def delete_expired_token(self, form):
+        if "token_expired" in self.get_token_error_codes(form):
+            form.cleaned_data["token"].delete()
+
+    def record_token_error(self, form):
+        if "token_expired" in self.get_token_error_codes(form):
+            token = form.cleaned_data["token"]
+            record_event(AuthEvent.TOKEN_EXPIRED, self.request, token.user_id)
+            record_funnel(self.request, LoginFunnelDay.TOKENS_EXPIRED)
+        else:
+            record_event(AuthEvent.TOKEN_NOT_FOUND, self.request)
+            record_funnel(self.request, LoginFunnelDay.TOKENS_NOT_FOUND)
+
+    def login_token_user(self, token):
+        try:
+            with span("magicauth.login", user_id=token.user_id):
+                login(
+                    self.request,
+                    token.user,
+                    backend=magicauth_settings.DEFAULT_AUTHENTICATION_BACKEND,
+                )
+        except ValueError as e:
+            raise ValueError(
+                "You have multiple authentication backends configured and therefore "
+                "must define the MAGICAUTH_DEFAULT_AUTHENTICATION_BACKEND setting. "
+                "MAGICAUTH_DEFAULT_AUTHENTICATION_BACKEND should be a "
+                "dotted import path string."
+            ) from e
+        record_event(AuthEvent.TOKEN_VALIDATED, self.request, token.user_id)
+        record_funnel(self.request, LoginFunnelDay.LOGINS_COMPLETED)
+        notify_logged_in(token)
+        # Remove them all for this user
+        with span("magicauth.purge_tokens", user_id=token.user_id) as current_span:
+            tokens = MagicToken.objects.filter(user=token.user)
+            unmark_tokens(tokens.values_list("pk", flat=True))
+            tokens_deleted, _ = tokens.delete()
+            current_span.set_attribute("tokens_deleted", tokens_deleted)
+
+
 @method_decorator(require_GET, name="dispatch")
-class ValidateTokenView(NextUrlMixin, FormView):
+class ValidateTokenView(NextUrlMixin, TokenLoginMixin, FormView):
     form_class = TokenValidationForm
     """
     Step 5 of login process : you visit the ValidateTokenView that validates the token, logs you in,
@@ -180,42 +385,20 @@ class ValidateTokenView(NextUrlMixin, FormView):
             return self.form_invalid(form)
 
     def form_invalid(self, form):
-        token = form.cleaned_data.get("token")
-        error_codes = [err.code for err in form.errors.get("token", ErrorList()).data]
-        if "token_expired" in error_codes:
-            token.delete()
-
+        self.record_token_error(form)
+        self.delete_expired_token(form)
         return self.token_invalid()
 
     def token_invalid(self):
-        messages.warning(
-            self.request,
-            "Ce lien de connexion ne fonctionne plus. "
-            "Pour en recevoir un nouveau, nous vous invitons à renseigner "
-            "votre email ci-dessous puis à cliquer sur valider.",
+        return add_warning(
+            self.request, redirect(reverse("magicauth-login")), TOKEN_INVALID_MESSAGE
         )
-        return redirect(reverse("magicauth-login"))
 
     def form_valid(self, form):
         # Early compute success URL for validation before login
         success_url = self.get_success_url()
 
-        token = form.cleaned_data["token"]
-        try:
-            login(
-                self.request,
-                token.user,
-                backend=magicauth_settings.DEFAULT_AUTHENTICATION_BACKEND,
-            )
-        except ValueError as e:
-            raise ValueError(
-                "You have multiple authentication backends configured and therefore "
-                "must define the MAGICAUTH_DEFAULT_AUTHENTICATION_BACKEND setting. "
-                "MAGICAUTH_DEFAULT_AUTHENTICATION_BACKEND should be a "
-                "dotted import path string."
-            ) from e
-        # Remove them all for this user
-        MagicToken.objects.filter(user=token.user).delete()
+        self.login_token_user(form.cleaned_data["token"])
         return redirect(success_url)
 
     def get_success_url(self):
@@ -0,0 +1,11 @@
+from pytest import fixture
+
+from magicauth import settings
+
+
+@fixture
+def disable_2fa(monkeypatch):
+    """
+    Log in with the email only, whatever MAGICAUTH_ENABLE_2FA the test settings use.
+    """
+    monkeypatch.setattr(settings, "ENABLE_2FA", False)
@@ -1,9 +1,14 @@
+from datetime import timedelta
+
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 
 import factory
 from faker import Factory as FakerFactory
 from pytest_factoryboy import register
 
+from magicauth import settings
+
 faker = FakerFactory.create("fr_FR")
 
 
@@ -22,3 +27,18 @@ class MagicTokenFactory(factory.django.DjangoModelFactory):
 
     class Meta:
         model = "magicauth.MagicToken"
+        skip_postgeneration_save = True
+
+    @factory.post_generation
+    def expired(token, create, extracted, **kwargs):
+        """
+        MagicTokenFactory(expired=True). `created` is set by auto_now_add on insert, it is
+        changed afterwards.
+        """
+        if not extracted:
+            return
+        token.created = timezone.now() - timedelta(
+            seconds=settings.TOKEN_DURATION_SECONDS * 2
+        )
+        if create:
+            token.save(update_fields=["created"])
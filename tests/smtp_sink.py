@@ -0,0 +1,143 @@
+"""
+A minimal local SMTP server, used as a stand-in for a real relay in tests and benchmarks.
+It accepts every message and keeps it in memory. No network access is needed.
+"""
+
+import socketserver
+import threading
+import time
+from email import message_from_bytes
+
+
+class ReceivedMessage(object):
+    def __init__(self, mail_from, recipients, data):
+        self.mail_from = mail_from
+        self.recipients = recipients
+        self.data = data
+        self.received_at = time.monotonic()
+
+    @property
+    def text_body(self):
+        message = message_from_bytes(self.data)
+        for part in message.walk():
+            if part.get_content_type() == "text/plain":
+                return part.get_payload(decode=True).decode(part.get_content_charset())
+        return ""
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+        self.wfile.flush()
+
+    def handle(self):
+        sink = self.server.sink
+        sink.on_connection()
+        mail_from, recipients = None, []
+        self.reply("220 localhost SMTP sink")
+        for raw_line in self.rfile:
+            command = raw_line.decode().strip()
+            verb = command[:4].upper()
+            if verb in ("HELO", "EHLO"):
+                self.reply("250 localhost")
+            elif verb == "MAIL":
+                mail_from, recipients = command[10:].strip(" <>"), []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                recipient = command[8:].strip(" <>")
+                reply = sink.check_recipient(recipient)
+                if reply.startswith("250"):
+                    recipients.append(recipient)
+                self.reply(reply)
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                sink.store(mail_from, recipients, self.read_data())
+                self.reply("250 OK")
+            elif verb in ("RSET", "NOOP"):
+                if verb == "RSET":
+                    mail_from, recipients = None, []
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+    def read_data(self):
+        lines = []
+        for line in self.rfile:
+            if line == b".\r\n":
+                break
+            if line.startswith(b".."):
+                line = line[1:]
+            lines.append(line)
+        return b"".join(lines)
+
+
+class ThreadingSMTPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class SMTPSink(object):
+    """
+    Usage :
+        with SMTPSink() as sink:
+            # point EMAIL_HOST / EMAIL_PORT to sink.host / sink.port
+            ...
+            message = sink.wait_for("user@example.com")
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.server = ThreadingSMTPServer((host, port), SMTPHandler)
+        self.server.sink = self
+        self.host, self.port = self.server.server_address
+        self.messages = []
+        self.connections = 0
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def on_connection(self):
+        with self.condition:
+            self.connections += 1
+
+    def check_recipient(self, recipient):
+        """
+        SMTP reply to a RCPT command. Override to simulate a relay refusing recipients.
+        """
+        return "250 OK"
+
+    def store(self, mail_from, recipients, data):
+        with self.condition:
+            self.messages.append(ReceivedMessage(mail_from, recipients, data))
+            self.condition.notify_all()
+
+    def wait_for(self, recipient, timeout=10):
+        """
+        Return the first received message for `recipient` and remove it from the sink.
+        """
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                for message in self.messages:
+                    if recipient in message.recipients:
+                        self.messages.remove(message)
+                        return message
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"No email received for {recipient}")
+                self.condition.wait(remaining)
@@ -1,4 +1,7 @@
+import re
+
 from django.shortcuts import reverse
+from django.test import Client
 
 from pytest import mark
 
@@ -51,15 +54,63 @@ def test_login_page_raises_404_if_unsafe_next_url_with_authenticated_user(client
     assert response.status_code == 404
 
 
-def test_template_displays_totp_field_when_2FA_enabled(client):
-    settings.ENABLE_2FA = True
+def test_template_displays_totp_field_when_2FA_enabled(client, monkeypatch):
+    monkeypatch.setattr(settings, "ENABLE_2FA", True)
     response = client.get(reverse("magicauth-login"))
     assert response.status_code == 200
     assert "Entrez le code à 6" in response.rendered_content
 
 
-def test_template_does_not_displays_totp_field_when_2FA_disabled(client):
-    settings.ENABLE_2FA = False
+def test_template_does_not_displays_totp_field_when_2FA_disabled(client, monkeypatch):
+    monkeypatch.setattr(settings, "ENABLE_2FA", False)
     response = client.get(reverse("magicauth-login"))
     assert response.status_code == 200
     assert "Entrez le code" not in response.rendered_content
+
+
+def get_csrf_token(response):
+    return re.search(
+        r'name="csrfmiddlewaretoken" value="([^"]+)"', response.content.decode()
+    ).group(1)
+
+
+def test_cached_login_page_is_rendered_once(client, monkeypatch, disable_2fa):
+    monkeypatch.setattr(settings, "LOGIN_PAGE_CACHE_SECONDS", 60)
+    url = reverse("magicauth-login")
+    first_response = client.get(url)
+    other_client = Client(enforce_csrf_checks=True)
+    response = other_client.get(url)
+    assert response.status_code == 200
+    assert response.templates == []
+    assert response.content.count(b"csrfmiddlewaretoken") == 1
+    assert get_csrf_token(response) != get_csrf_token(first_response)
+
+    user = factories.UserFactory()
+    response = other_client.post(
+        url, {"email": user.email, "csrfmiddlewaretoken": get_csrf_token(response)}
+    )
+    assert response.status_code == 302
+
+
+def test_login_page_with_next_url_is_not_cached(client, monkeypatch):
+    monkeypatch.setattr(settings, "LOGIN_PAGE_CACHE_SECONDS", 60)
+    url = reverse("magicauth-login")
+    client.get(url)
+    for _ in range(2):
+        response = client.get(url, {"next": "/test_dashboard/"})
+        assert response.templates != []
+    response = client.get(url, {"next": "/landing/"})
+    assert response.templates == []
+
+
+def test_login_page_with_messages_is_not_cached(client, monkeypatch):
+    monkeypatch.setattr(settings, "LOGIN_PAGE_CACHE_SECONDS", 60)
+    url = reverse("magicauth-login")
+    client.get(url)
+    # An expired token redirects to the login page with a message
+    token = factories.MagicTokenFactory(expired=True)
+    response = client.get(
+        reverse("magicauth-validate-token", args=[token.key]), follow=True
+    )
+    assert response.templates != []
+    assert len(response.context["messages"]) == 1
@@ -6,6 +6,7 @@ from pytest import mark
 
 from magicauth import settings
 from magicauth.models import MagicToken
+from magicauth.views import LoginView
 from tests import factories
 
 """
@@ -61,13 +62,13 @@ def test_posting_email_for_valid_existing_user_creates_token(client):
     assert count_after == count_before + 1
 
 
-def test_loging_with_email_is_case_insensitive(client):
+def test_loging_with_email_is_case_insensitive(client, monkeypatch):
     user = factories.UserFactory()
     response = post_email(client, user.email.upper())
     assert response.status_code == 302
     assert len(mail.outbox) == 1
 
-    settings.ENABLE_2FA = True
+    monkeypatch.setattr(settings, "ENABLE_2FA", True)
 
     # Testing the case of email with capital letters in DB
     user = factories.UserFactory(email=FakerFactory.create("fr_FR").email().upper())
@@ -95,8 +96,8 @@ def post_email_and_OTP(client, email, OTP):
     return client.post(url, data=data)
 
 
-def test_posting_good_email_and_good_totp_success(client):
-    settings.ENABLE_2FA = True
+def test_posting_good_email_and_good_totp_success(client, monkeypatch):
+    monkeypatch.setattr(settings, "ENABLE_2FA", True)
     token = factories.MagicTokenFactory()
     thierry = token.user
     device = thierry.staticdevice_set.create()
@@ -108,8 +109,8 @@ def test_posting_good_email_and_good_totp_success(client):
     assert len(mail.outbox) == 1
 
 
-def test_posting_good_email_and_wrong_otp_error(client):
-    settings.ENABLE_2FA = True
+def test_posting_good_email_and_wrong_otp_error(client, monkeypatch):
+    monkeypatch.setattr(settings, "ENABLE_2FA", True)
     token = factories.MagicTokenFactory()
     thierry = token.user
     device = thierry.staticdevice_set.create()
@@ -126,8 +127,8 @@ def test_posting_good_email_and_wrong_otp_error(client):
     assert len(mail.outbox) == 0
 
 
-def test_posting_wrong_email_and_wrong_otp_error(client):
-    settings.ENABLE_2FA = True
+def test_posting_wrong_email_and_wrong_otp_error(client, monkeypatch):
+    monkeypatch.setattr(settings, "ENABLE_2FA", True)
     token = factories.MagicTokenFactory()
     thierry = token.user
     device = thierry.staticdevice_set.create()
@@ -140,8 +141,8 @@ def test_posting_wrong_email_and_wrong_otp_error(client):
     assert len(mail.outbox) == 0
 
 
-def test_posting_good_email_and_has_not_otp_error(client):
-    settings.ENABLE_2FA = True
+def test_posting_good_email_and_has_not_otp_error(client, monkeypatch):
+    monkeypatch.setattr(settings, "ENABLE_2FA", True)
     user = factories.UserFactory()
 
     response = post_email_and_OTP(client, user.email, "567654")
@@ -155,8 +156,8 @@ def test_posting_good_email_and_has_not_otp_error(client):
     assert len(mail.outbox) == 0
 
 
-def test_thierry_has_several_devices_first_device(client):
-    settings.ENABLE_2FA = True
+def test_thierry_has_several_devices_first_device(client, monkeypatch):
+    monkeypatch.setattr(settings, "ENABLE_2FA", True)
     token = factories.MagicTokenFactory()
     thierry = token.user
     device_1 = thierry.staticdevice_set.create()
@@ -170,8 +171,8 @@ def test_thierry_has_several_devices_first_device(client):
     assert len(mail.outbox) == 1
 
 
-def test_thierry_has_several_devices_second_device(client):
-    settings.ENABLE_2FA = True
+def test_thierry_has_several_devices_second_device(client, monkeypatch):
+    monkeypatch.setattr(settings, "ENABLE_2FA", True)
     token = factories.MagicTokenFactory()
     thierry = token.user
     device_1 = thierry.staticdevice_set.create()
@@ -183,3 +184,58 @@ def test_thierry_has_several_devices_second_device(client):
 
     assert response.status_code == 302
     assert len(mail.outbox) == 1
+
+
+# Tests with token reuse
+def test_rapid_resubmit_reuses_token_and_resends_email(
+    client, monkeypatch, disable_2fa
+):
+    monkeypatch.setattr(settings, "TOKEN_REUSE_SECONDS", 60)
+    user = factories.UserFactory()
+    post_email(client, user.email)
+    response = post_email(client, user.email)
+    assert response.status_code == 302
+    assert MagicToken.objects.filter(user=user).count() == 1
+    assert len(mail.outbox) == 2
+    assert mail.outbox[0].body == mail.outbox[1].body
+
+
+def test_rapid_resubmit_in_skip_mode_does_not_resend_email(
+    client, monkeypatch, disable_2fa
+):
+    monkeypatch.setattr(settings, "TOKEN_REUSE_SECONDS", 60)
+    monkeypatch.setattr(settings, "TOKEN_REUSE_MODE", "skip")
+    user = factories.UserFactory()
+    post_email(client, user.email)
+    response = post_email(client, user.email)
+    assert response.status_code == 302
+    assert response.url.startswith(reverse("magicauth-email-sent"))
+    assert MagicToken.objects.filter(user=user).count() == 1
+    assert len(mail.outbox) == 1
+
+
+def test_max_outstanding_tokens_deletes_oldest_tokens(client, monkeypatch, disable_2fa):
+    monkeypatch.setattr(settings, "MAX_OUTSTANDING_TOKENS", 2)
+    user = factories.UserFactory()
+    for _ in range(3):
+        post_email(client, user.email)
+    assert MagicToken.objects.filter(user=user).count() == 2
+    assert len(mail.outbox) == 3
+
+
+def test_email_is_sent_once_the_token_is_committed(
+    client, monkeypatch, disable_2fa, django_capture_on_commit_callbacks
+):
+    monkeypatch.setattr(settings, "SEND_EMAIL_ON_COMMIT", True)
+    user = factories.UserFactory()
+    with django_capture_on_commit_callbacks() as callbacks:
+        post_email(client, user.email)
+        assert len(mail.outbox) == 0
+    assert len(callbacks) == 1
+    callbacks[0]()
+    token = MagicToken.objects.get(user=user)
+    assert token.key in mail.outbox[0].body
+
+
+def test_login_view_does_not_run_in_the_request_transaction():
+    assert LoginView.as_view()._non_atomic_requests
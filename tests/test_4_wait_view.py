@@ -5,6 +5,9 @@ from django.shortcuts import reverse
 from pytest import mark
 
 from magicauth import settings
+from magicauth.models import MagicToken
+from magicauth.token_probe import get_token_cache_key, mark_token
+from magicauth.utils import get_cache
 from tests import factories
 
 """
@@ -65,3 +68,79 @@ def test_wait_page_raises_404_if_unsafe_next_url(client):
     response = open_magic_link_with_wait(client, token, "http://www.myfishingsite.com/")
 
     assert response.status_code == 404
+
+
+def test_wait_page_precheck_redirects_unknown_token(client, monkeypatch):
+    monkeypatch.setattr(settings, "WAIT_TOKEN_PRECHECK", True)
+    url = reverse("magicauth-wait", kwargs={"key": "some-token"})
+    response = client.get(url, follow=True)
+    assert response.redirect_chain == [(reverse("magicauth-login"), 302)]
+    assert "ne fonctionne plus" in response.content.decode()
+
+
+def test_wait_page_precheck_redirects_expired_token(client, monkeypatch):
+    monkeypatch.setattr(settings, "WAIT_TOKEN_PRECHECK", True)
+    token = factories.MagicTokenFactory(expired=True)
+    response = open_magic_link_with_wait(client, token)
+    assert response.status_code == 302
+    assert response.url == reverse("magicauth-login")
+    assert MagicToken.objects.filter(pk=token.pk).exists()
+
+
+def test_wait_page_precheck_uses_cache_then_one_query(
+    client, monkeypatch, django_assert_num_queries
+):
+    monkeypatch.setattr(settings, "WAIT_TOKEN_PRECHECK", True)
+    token = factories.MagicTokenFactory()
+    with django_assert_num_queries(1):
+        assert open_magic_link_with_wait(client, token).status_code == 200
+    with django_assert_num_queries(0):
+        assert open_magic_link_with_wait(client, token).status_code == 200
+
+
+def test_sent_token_is_marked_alive(client, monkeypatch, disable_2fa):
+    monkeypatch.setattr(settings, "WAIT_TOKEN_PRECHECK", True)
+    user = factories.UserFactory()
+    client.post(reverse("magicauth-login"), data={"email": user.email})
+    token = MagicToken.objects.get(user=user)
+    assert get_cache().get(get_token_cache_key(token.key))
+
+
+def send_two_tokens(client, user):
+    for _ in range(2):
+        client.post(reverse("magicauth-login"), data={"email": user.email})
+    return list(MagicToken.objects.filter(user=user).order_by("created"))
+
+
+def test_wait_page_precheck_redirects_token_purged_at_login(
+    client, monkeypatch, disable_2fa
+):
+    monkeypatch.setattr(settings, "WAIT_TOKEN_PRECHECK", True)
+    user = factories.UserFactory()
+    older_token, token = send_two_tokens(client, user)
+    client.get(reverse("magicauth-validate-token", args=[token.key]))
+    client.logout()
+    response = open_magic_link_with_wait(client, older_token)
+    assert response.status_code == 302
+    assert response.url == reverse("magicauth-login")
+
+
+def test_wait_page_precheck_redirects_outstanding_token_removed(
+    client, monkeypatch, disable_2fa
+):
+    monkeypatch.setattr(settings, "WAIT_TOKEN_PRECHECK", True)
+    monkeypatch.setattr(settings, "MAX_OUTSTANDING_TOKENS", 1)
+    user = factories.UserFactory()
+    older_token = factories.MagicTokenFactory(user=user)
+    mark_token(older_token)
+    client.post(reverse("magicauth-login"), data={"email": user.email})
+    response = open_magic_link_with_wait(client, older_token)
+    assert response.status_code == 302
+    assert response.url == reverse("magicauth-login")
+
+
+def test_wait_page_precheck_keeps_404_for_unsafe_next_url(client, monkeypatch):
+    monkeypatch.setattr(settings, "WAIT_TOKEN_PRECHECK", True)
+    url = reverse("magicauth-wait", kwargs={"key": "some-token"})
+    response = client.get(url + "?next=http://www.myfishingsite.com/")
+    assert response.status_code == 404
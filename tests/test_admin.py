@@ -0,0 +1,48 @@
+from django.contrib import admin
+from django.test import RequestFactory
+
+from pytest import mark
+
+from magicauth.admin import EstimatedCountPaginator, ExpiredListFilter, MagicTokenAdmin
+from magicauth.models import MagicToken
+from tests import factories
+
+pytestmark = mark.django_db
+
+
+def test_expired_filter_only_returns_expired_tokens():
+    expired = factories.MagicTokenFactory(expired=True)
+    valid = factories.MagicTokenFactory()
+    request = RequestFactory().get("/", {"expired": "yes"})
+    model_admin = MagicTokenAdmin(MagicToken, admin.site)
+    list_filter = ExpiredListFilter(
+        request, request.GET.dict(), MagicToken, model_admin
+    )
+    queryset = list_filter.queryset(request, MagicToken.objects.all())
+    assert expired in queryset
+    assert valid not in queryset
+
+
+def test_delete_in_chunks_deletes_all_expired_tokens():
+    expired_tokens = [factories.MagicTokenFactory(expired=True) for _ in range(5)]
+    valid = factories.MagicTokenFactory()
+    deleted = MagicToken.objects.expired().delete_in_chunks(chunk_size=2)
+    assert deleted == len(expired_tokens)
+    assert list(MagicToken.objects.all()) == [valid]
+
+
+def test_estimated_count_paginator_falls_back_to_exact_count():
+    factories.MagicTokenFactory.create_batch(3)
+    paginator = EstimatedCountPaginator(MagicToken.objects.all(), 100)
+    assert paginator.count == 3
+
+
+def test_export_csv_streams_tokens_without_keys():
+    token = factories.MagicTokenFactory()
+    model_admin = MagicTokenAdmin(MagicToken, admin.site)
+    request = RequestFactory().get("/")
+    response = model_admin.export_csv(request, MagicToken.objects.all())
+    content = b"".join(response.streaming_content).decode()
+    assert content.splitlines()[0] == "user_id,email,created"
+    assert token.user.username in content
+    assert token.key not in content
@@ -0,0 +1,115 @@
+from django.core import mail
+from django.shortcuts import reverse
+
+from pytest import mark
+
+from magicauth import settings
+from magicauth.models import MagicToken
+from tests import factories
+
+pytestmark = [mark.django_db, mark.usefixtures("disable_2fa")]
+
+
+def post_json(client, url, data):
+    return client.post(url, data, content_type="application/json")
+
+
+def test_login_api_sends_email(client, django_assert_max_num_queries):
+    user = factories.UserFactory()
+    with django_assert_max_num_queries(3):
+        response = post_json(
+            client, reverse("magicauth-api-login"), {"email": user.email}
+        )
+    assert response.status_code == 202
+    assert response.json() == {"status": "sent"}
+    assert len(mail.outbox) == 1
+
+
+def test_login_api_returns_errors_for_unknown_email(client):
+    response = post_json(
+        client, reverse("magicauth-api-login"), {"email": "unknown@email.com"}
+    )
+    assert response.status_code == 400
+    assert response.json() == {"errors": {"email": [settings.EMAIL_UNKNOWN_MESSAGE]}}
+    assert len(mail.outbox) == 0
+
+
+def test_login_api_rejects_invalid_json(client):
+    response = client.post(
+        reverse("magicauth-api-login"), "{", content_type="application/json"
+    )
+    assert response.status_code == 400
+
+
+def test_login_api_rejects_unsafe_next_url(client):
+    user = factories.UserFactory()
+    url = reverse("magicauth-api-login") + "?next=http://www.myfishingsite.com/"
+    response = post_json(client, url, {"email": user.email})
+    assert response.status_code == 400
+    assert len(mail.outbox) == 0
+
+
+def test_login_api_rejects_invalid_otp(client, monkeypatch):
+    monkeypatch.setattr(settings, "ENABLE_2FA", True)
+    user = factories.UserFactory()
+    device = user.staticdevice_set.create()
+    device.token_set.create(token="123456")
+
+    response = post_json(
+        client,
+        reverse("magicauth-api-login"),
+        {"email": user.email, "otp_token": "654321"},
+    )
+    assert response.status_code == 400
+    assert response.json() == {"errors": {"otp_token": ["Ce code n'est pas valide."]}}
+    assert len(mail.outbox) == 0
+
+
+def test_login_api_sends_email_with_valid_otp(client, monkeypatch):
+    monkeypatch.setattr(settings, "ENABLE_2FA", True)
+    user = factories.UserFactory()
+    device = user.staticdevice_set.create()
+    device.token_set.create(token="123456")
+
+    response = post_json(
+        client,
+        reverse("magicauth-api-login"),
+        {"email": user.email, "otp_token": "123456"},
+    )
+    assert response.status_code == 202
+
+
+def test_token_api_status_does_not_consume_token(client, django_assert_num_queries):
+    token = factories.MagicTokenFactory()
+    with django_assert_num_queries(1):
+        response = client.get(reverse("magicauth-api-token", args=[token.key]))
+    assert response.status_code == 200
+    assert response.json()["status"] == "valid"
+    assert 0 < response.json()["expires_in"] <= settings.TOKEN_DURATION_SECONDS
+    assert MagicToken.objects.filter(key=token.key).exists()
+
+
+def test_token_api_status_of_unknown_and_expired_tokens(client):
+    response = client.get(reverse("magicauth-api-token", args=["unknown-token"]))
+    assert response.status_code == 404
+
+    token = factories.MagicTokenFactory(expired=True)
+    response = client.get(reverse("magicauth-api-token", args=[token.key]))
+    assert response.status_code == 410
+
+
+def test_token_api_post_logs_in(client):
+    token = factories.MagicTokenFactory()
+    response = client.post(reverse("magicauth-api-token", args=[token.key]))
+    assert response.status_code == 200
+    assert response.json() == {"status": "logged_in", "next": "/landing/"}
+    assert "_auth_user_id" in client.session
+    assert not MagicToken.objects.filter(user=token.user).exists()
+
+
+def test_token_api_post_with_expired_token_deletes_it(client):
+    token = factories.MagicTokenFactory(expired=True)
+    response = client.post(reverse("magicauth-api-token", args=[token.key]))
+    assert response.status_code == 410
+    assert "_auth_user_id" not in client.session
+    assert not MagicToken.objects.filter(key=token.key).exists()
@@ -0,0 +1,96 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.shortcuts import reverse
+
+from pytest import fixture, mark
+
+from magicauth import settings
+from magicauth.audit import audit_buffer
+from magicauth.models import AuthEvent
+from tests import factories
+
+pytestmark = [mark.django_db, mark.usefixtures("disable_2fa")]
+
+
+@fixture
+def buffered_audit_log(monkeypatch):
+    monkeypatch.setattr(settings, "AUDIT_LOG", "buffered")
+    monkeypatch.setattr(settings, "AUDIT_FLUSH_SECONDS", 60)
+    # Flush in the test thread, which owns the test transaction
+    monkeypatch.setattr(audit_buffer, "start_flush", audit_buffer.flush)
+    yield
+    audit_buffer.flush()
+
+
+def test_no_event_is_recorded_by_default(client):
+    user = factories.UserFactory()
+    client.post(reverse("magicauth-login"), data={"email": user.email})
+    assert not AuthEvent.objects.exists()
+
+
+def test_sync_audit_log_records_link_request(client, monkeypatch):
+    monkeypatch.setattr(settings, "AUDIT_LOG", "sync")
+    user = factories.UserFactory()
+    client.post(
+        reverse("magicauth-login"),
+        data={"email": user.email},
+        REMOTE_ADDR="10.0.0.1",
+    )
+    event = AuthEvent.objects.get()
+    assert event.event == AuthEvent.LINK_REQUESTED
+    assert event.user == user
+    assert event.ip_address == "10.0.0.1"
+
+
+def test_sync_audit_log_records_token_events(client, monkeypatch):
+    monkeypatch.setattr(settings, "AUDIT_LOG", "sync")
+    token = factories.MagicTokenFactory()
+    client.get(reverse("magicauth-validate-token", args=["unknown-token"]))
+    client.get(reverse("magicauth-validate-token", args=[token.key]))
+    assert list(AuthEvent.objects.order_by("id").values_list("event", "user")) == [
+        (AuthEvent.TOKEN_NOT_FOUND, None),
+        (AuthEvent.TOKEN_VALIDATED, token.user_id),
+    ]
+
+
+def test_buffered_audit_log_is_written_in_bulk(
+    client, monkeypatch, buffered_audit_log, django_assert_num_queries
+):
+    monkeypatch.setattr(settings, "AUDIT_BUFFER_SIZE", 3)
+    for _ in range(2):
+        client.post(reverse("magicauth-login"), data={"email": "unknown@email.com"})
+    assert not AuthEvent.objects.exists()
+
+    with django_assert_num_queries(4):
+        # The user lookup, then the bulk insert of the 3 buffered events (in a savepoint
+        # here, in a transaction outside of the tests)
+        client.post(reverse("magicauth-login"), data={"email": "unknown@email.com"})
+    assert AuthEvent.objects.filter(event=AuthEvent.LINK_REQUEST_FAILED).count() == 3
+
+
+def test_export_command_streams_events(client, buffered_audit_log):
+    user = factories.UserFactory()
+    client.post(reverse("magicauth-login"), data={"email": user.email})
+    audit_buffer.flush()
+    out = StringIO()
+    call_command("magicauth_export_audit_log", stdout=out)
+    lines = out.getvalue().splitlines()
+    assert lines[0] == "id,created,event,user_id,email,ip_address"
+    assert AuthEvent.LINK_REQUESTED in lines[1]
+    assert user.email.lower() in lines[1]
+
+
+def test_failed_bulk_insert_saves_events_one_by_one(
+    client, monkeypatch, buffered_audit_log, caplog
+):
+    def bulk_create(*args, **kwargs):
+        raise DatabaseError("The database is gone")
+
+    monkeypatch.setattr(AuthEvent.objects, "bulk_create", bulk_create)
+    for _ in range(2):
+        client.post(reverse("magicauth-login"), data={"email": "unknown@email.com"})
+    audit_buffer.flush()
+    assert AuthEvent.objects.count() == 2
+    assert "could not be inserted in bulk, 0 lost" in caplog.text
@@ -0,0 +1,102 @@
+import threading
+import time
+from io import StringIO
+
+from django.core.management import call_command
+from django.shortcuts import reverse
+
+from pytest import fixture, mark
+
+from magicauth import bloom, settings
+from magicauth.utils import get_cache
+from tests import factories
+
+pytestmark = mark.django_db
+
+
+@fixture
+def email_filter(monkeypatch, disable_2fa):
+    monkeypatch.setattr(settings, "EMAIL_BLOOM_FILTER", True)
+    get_cache().clear()
+    bloom.local_email_filter.reset()
+    yield bloom.local_email_filter
+    bloom.local_email_filter.reset()
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom_filter = bloom.BloomFilter(1000, 0.01)
+    emails = [f"user{i}@example.com" for i in range(1000)]
+    for email in emails:
+        bloom_filter.add(email)
+    assert all(email in bloom_filter for email in emails)
+    false_positives = sum(f"other{i}@example.com" in bloom_filter for i in range(1000))
+    assert false_positives < 50
+
+
+def test_bloom_filter_respects_max_bytes():
+    bloom_filter = bloom.BloomFilter(10**6, 0.01, max_bytes=1024)
+    assert len(bloom_filter.bits) == 1024
+
+
+def test_unknown_email_is_rejected_without_query(
+    client, email_filter, django_assert_num_queries
+):
+    factories.UserFactory()
+    email_filter.build()
+    with django_assert_num_queries(0):
+        response = client.post(
+            reverse("magicauth-login"), data={"email": "unknown@email.com"}
+        )
+    assert "invalid" in str(response.content)
+
+
+def test_known_email_still_logs_in(client, email_filter):
+    user = factories.UserFactory()
+    email_filter.build()
+    response = client.post(reverse("magicauth-login"), data={"email": user.email})
+    assert response.status_code == 302
+
+
+def test_user_created_after_build_is_known(client, email_filter):
+    email_filter.build()
+    user = factories.UserFactory()
+    assert bloom.email_might_exist(user.email.upper())
+
+
+def test_user_created_by_another_process_is_known(email_filter):
+    email_filter.build()
+    user = factories.UserFactory()
+    # Another process has not received the post_save signal
+    email_filter.reset()
+    email_filter.email_filter = bloom.BloomFilter(1000)
+    email_filter.expires_at = float("inf")
+    assert bloom.email_might_exist(user.email)
+
+
+def test_build_command_shares_filter_through_cache(email_filter):
+    user = factories.UserFactory()
+    call_command("magicauth_build_email_filter", stdout=StringIO())
+    _, shared_filter = get_cache().get(bloom.FILTER_CACHE_KEY)
+    assert user.email.lower() in shared_filter
+
+
+def test_emails_are_checked_in_database_while_filter_is_built(
+    email_filter, monkeypatch
+):
+    built = bloom.BloomFilter(1000)
+    started = threading.Event()
+    monkeypatch.setattr(bloom, "build_email_filter", lambda: started.wait(5) and built)
+    assert email_filter.get() is None
+    assert bloom.email_might_exist("unknown@email.com")
+    started.set()
+    email_filter.thread.join()
+    assert email_filter.get() is built
+    assert not bloom.email_might_exist("unknown@email.com")
+
+
+def test_filter_shared_through_cache_is_used_without_building(email_filter):
+    shared_filter = bloom.BloomFilter(1000)
+    shared_filter.add("shared@email.com")
+    get_cache().set(bloom.FILTER_CACHE_KEY, (time.time(), shared_filter))
+    assert "shared@email.com" in email_filter.get()
+    assert email_filter.thread is None
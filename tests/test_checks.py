@@ -0,0 +1,102 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.db.models import Index
+from django.db.models.functions import Upper
+from django.test import override_settings
+from django.utils import timezone
+
+from pytest import mark
+
+from magicauth import checks, settings
+from tests import factories
+
+pytestmark = mark.django_db
+
+
+def get_ids(messages):
+    return [message.id for message in messages]
+
+
+def test_unique_email_field_has_an_index(monkeypatch):
+    monkeypatch.setattr(settings, "EMAIL_FIELD", "username")
+    assert checks.check_email_field_index(None) == []
+
+
+def test_email_field_without_index_warns(monkeypatch):
+    monkeypatch.setattr(settings, "EMAIL_FIELD", "email")
+    assert get_ids(checks.check_email_field_index(None)) == ["magicauth.W001"]
+
+
+def test_functional_index_on_email_field_is_usable(monkeypatch):
+    user_model = get_user_model()
+    monkeypatch.setattr(settings, "EMAIL_FIELD", "email")
+    monkeypatch.setattr(
+        user_model._meta, "indexes", [Index(Upper("email"), name="email_upper")]
+    )
+    assert checks.check_email_field_index(None) == []
+
+
+def test_unknown_email_field_is_an_error(monkeypatch):
+    monkeypatch.setattr(settings, "EMAIL_FIELD", "mail")
+    assert get_ids(checks.check_email_field_index(None)) == ["magicauth.E001"]
+
+
+@override_settings(EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend")
+def test_smtp_backend_without_pool_warns(monkeypatch):
+    monkeypatch.setattr(settings, "EMAIL_CONNECTION_POOL", False)
+    assert get_ids(checks.check_email_backend(None)) == ["magicauth.W002"]
+    monkeypatch.setattr(settings, "EMAIL_CONNECTION_POOL", True)
+    assert checks.check_email_backend(None) == []
+    monkeypatch.setattr(settings, "EMAIL_CONNECTION_POOL", False)
+    monkeypatch.setattr(settings, "EMAIL_DISPATCH", "scheduled")
+    assert checks.check_email_backend(None) == []
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+)
+def test_dummy_cache_warns_only_with_cache_features(monkeypatch):
+    monkeypatch.setattr(settings, "USER_CACHE", False)
+    monkeypatch.setattr(settings, "EMAIL_BLOOM_FILTER", False)
+    assert checks.check_cache_backend(None) == []
+    monkeypatch.setattr(settings, "USER_CACHE", True)
+    assert get_ids(checks.check_cache_backend(None)) == ["magicauth.W003"]
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+)
+@mark.parametrize(
+    "name, value",
+    [
+        ("OTP_THROTTLE", True),
+        ("MAX_CONCURRENT_SENDS_GLOBAL", 100),
+        ("EMAIL_CIRCUIT_BREAKER", True),
+        ("LOGIN_STATUS_LONG_POLL", True),
+        ("LOGIN_PAGE_CACHE_SECONDS", 60),
+        ("WAIT_TOKEN_PRECHECK", True),
+    ],
+)
+def test_dummy_cache_warns_with_cache_based_limits(monkeypatch, name, value):
+    monkeypatch.setattr(settings, "ENABLE_2FA", True)
+    monkeypatch.setattr(settings, name, value)
+    messages = checks.check_cache_backend(None)
+    assert get_ids(messages) == ["magicauth.W003"]
+    assert f"MAGICAUTH_{name}" in messages[0].msg
+
+
+def test_stale_tokens_warn():
+    assert checks.check_stale_tokens(None, databases=["default"]) == []
+    token = factories.MagicTokenFactory()
+    token.created = timezone.now() - timedelta(days=30)
+    token.save()
+    messages = checks.check_stale_tokens(None, databases=["default"])
+    assert get_ids(messages) == ["magicauth.W004"]
+
+
+def test_high_wait_seconds_warns(monkeypatch):
+    monkeypatch.setattr(settings, "WAIT_SECONDS", 3)
+    assert checks.check_wait_seconds(None) == []
+    monkeypatch.setattr(settings, "WAIT_SECONDS", 30)
+    assert get_ids(checks.check_wait_seconds(None)) == ["magicauth.W005"]
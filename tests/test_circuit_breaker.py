@@ -0,0 +1,151 @@
+import smtplib
+import socket
+
+from django.core import mail
+from django.core.mail.backends.base import BaseEmailBackend
+from django.shortcuts import reverse
+from django.test import override_settings
+
+from pytest import fixture, mark, raises
+
+from magicauth import settings
+from magicauth.circuit_breaker import (
+    OPENED_AT_CACHE_KEY,
+    get_circuit_breaker,
+    is_server_error,
+)
+from magicauth.models import MagicToken
+from magicauth.utils import get_cache
+from tests import factories
+
+pytestmark = mark.django_db
+
+FAILING_BACKEND = "tests.test_circuit_breaker.FailingBackend"
+REFUSING_BACKEND = "tests.test_circuit_breaker.RefusingBackend"
+
+
+class FailingBackend(BaseEmailBackend):
+    attempts = 0
+
+    def send_messages(self, email_messages):
+        FailingBackend.attempts += 1
+        raise ConnectionRefusedError("The relay is down")
+
+
+class RefusingBackend(BaseEmailBackend):
+    attempts = 0
+
+    def send_messages(self, email_messages):
+        RefusingBackend.attempts += 1
+        raise smtplib.SMTPRecipientsRefused(
+            {"user@example.com": (550, b"No such user")}
+        )
+
+
+@fixture
+def breaker(monkeypatch, disable_2fa):
+    monkeypatch.setattr(settings, "EMAIL_CIRCUIT_BREAKER", True)
+    monkeypatch.setattr(settings, "EMAIL_CIRCUIT_BREAKER_THRESHOLD", 2)
+    FailingBackend.attempts = RefusingBackend.attempts = 0
+    get_circuit_breaker().reset()
+    yield
+    get_circuit_breaker().reset()
+
+
+def post_email(client, email):
+    return client.post(reverse("magicauth-login"), data={"email": email})
+
+
+@override_settings(EMAIL_BACKEND=FAILING_BACKEND)
+def test_breaker_opens_after_consecutive_failures(client, breaker):
+    user = factories.UserFactory()
+    for _ in range(3):
+        response = post_email(client, user.email)
+        assert response.status_code == 200
+        assert (
+            settings.EMAIL_UNAVAILABLE_MESSAGE
+            in response.context["form"].errors["email"]
+        )
+    # The third login did not wait for the relay
+    assert FailingBackend.attempts == 2
+
+
+def test_breaker_closes_after_a_successful_probe(client, breaker, monkeypatch):
+    monkeypatch.setattr(settings, "EMAIL_CIRCUIT_BREAKER_RESET_SECONDS", 0)
+    user = factories.UserFactory()
+    with override_settings(EMAIL_BACKEND=FAILING_BACKEND):
+        post_email(client, user.email)
+        post_email(client, user.email)
+        # Half-open : one more email is tried, it fails and opens the breaker again
+        post_email(client, user.email)
+    assert FailingBackend.attempts == 3
+    response = post_email(client, user.email)
+    assert response.status_code == 302
+    assert len(mail.outbox) == 1
+    assert get_cache().get(OPENED_AT_CACHE_KEY) is None
+
+
+@override_settings(EMAIL_BACKEND=FAILING_BACKEND)
+def test_fallback_backend_sends_while_the_relay_fails(client, breaker, monkeypatch):
+    monkeypatch.setattr(
+        settings,
+        "EMAIL_FALLBACK_BACKEND",
+        "django.core.mail.backends.locmem.EmailBackend",
+    )
+    user = factories.UserFactory()
+    for _ in range(3):
+        response = post_email(client, user.email)
+        assert response.status_code == 302
+    assert len(mail.outbox) == 3
+    assert FailingBackend.attempts == 2
+
+
+@override_settings(EMAIL_BACKEND=FAILING_BACKEND)
+def test_login_api_answers_503_when_email_is_unavailable(client, breaker):
+    user = factories.UserFactory()
+    response = client.post(reverse("magicauth-api-login"), {"email": user.email})
+    assert response.status_code == 503
+    assert response["Retry-After"] == str(settings.EMAIL_CIRCUIT_BREAKER_RESET_SECONDS)
+
+
+def test_unsent_token_is_not_reused(client, breaker, monkeypatch):
+    monkeypatch.setattr(settings, "TOKEN_REUSE_SECONDS", 60)
+    monkeypatch.setattr(settings, "TOKEN_REUSE_MODE", "skip")
+    user = factories.UserFactory()
+    with override_settings(EMAIL_BACKEND=FAILING_BACKEND):
+        post_email(client, user.email)
+        post_email(client, user.email)
+        # Open : fails without trying
+        post_email(client, user.email)
+    assert not MagicToken.objects.exists()
+    get_circuit_breaker().reset()
+    response = post_email(client, user.email)
+    assert response.status_code == 302
+    assert len(mail.outbox) == 1
+
+
+@override_settings(EMAIL_BACKEND=REFUSING_BACKEND)
+def test_refused_recipients_do_not_open_the_breaker(client, breaker):
+    user = factories.UserFactory()
+    for _ in range(3):
+        with raises(smtplib.SMTPRecipientsRefused):
+            post_email(client, user.email)
+    assert RefusingBackend.attempts == 3
+    assert get_cache().get(OPENED_AT_CACHE_KEY) is None
+
+
+@mark.parametrize(
+    "error, server_error",
+    [
+        (ConnectionRefusedError(), True),
+        (socket.timeout(), True),
+        (smtplib.SMTPServerDisconnected(), True),
+        (smtplib.SMTPConnectError(554, b"No service"), True),
+        (smtplib.SMTPDataError(451, b"Try again later"), True),
+        (smtplib.SMTPDataError(554, b"Rejected"), False),
+        (smtplib.SMTPSenderRefused(553, b"Rejected", "from@example.com"), False),
+        (smtplib.SMTPRecipientsRefused({"user@example.com": (552, b"Full")}), False),
+    ],
+)
+def test_only_server_errors_count_as_failures(error, server_error):
+    assert is_server_error(error) == server_error
@@ -0,0 +1,141 @@
+import smtplib
+import socket
+import threading
+
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.shortcuts import reverse
+
+from pytest import fixture, mark, raises
+
+from magicauth import settings
+from magicauth.email_pool import EmailConnectionPool
+from tests import factories
+from tests.smtp_sink import SMTPSink
+
+
+@fixture
+def sink():
+    with SMTPSink() as sink:
+        yield sink
+
+
+def make_pool(sink, **kwargs):
+    return EmailConnectionPool(
+        backend="django.core.mail.backends.smtp.EmailBackend",
+        host=sink.host,
+        port=sink.port,
+        **kwargs,
+    )
+
+
+def make_message(recipient="user@example.com"):
+    return EmailMessage("Subject", "Body", "from@example.com", [recipient])
+
+
+def test_pool_reuses_the_same_connection(sink):
+    pool = make_pool(sink)
+    for i in range(3):
+        pool.send_messages([make_message(f"user{i}@example.com")])
+    pool.close()
+    assert sink.connections == 1
+    for i in range(3):
+        sink.wait_for(f"user{i}@example.com")
+
+
+def test_pool_reconnects_when_connection_is_broken(sink):
+    pool = make_pool(sink, health_check_seconds=0)
+    pool.send_messages([make_message()])
+    connection, _ = pool._idle[0]
+    connection.connection.sock.shutdown(socket.SHUT_RDWR)
+
+    pool.send_messages([make_message("other@example.com")])
+    pool.close()
+    assert sink.connections == 2
+    sink.wait_for("other@example.com")
+
+
+def test_pool_resends_on_a_new_connection_when_sending_fails(sink):
+    pool = make_pool(sink)
+    pool.send_messages([make_message()])
+    connection, _ = pool._idle[0]
+    connection.connection.sock.shutdown(socket.SHUT_RDWR)
+
+    pool.send_messages([make_message("other@example.com")])
+    pool.close()
+    assert sink.connections == 2
+    sink.wait_for("other@example.com")
+
+
+class RefusingSink(SMTPSink):
+    rcpt_attempts = 0
+
+    def check_recipient(self, recipient):
+        self.rcpt_attempts += 1
+        return "550 No such user"
+
+
+def test_pool_does_not_resend_a_refused_message():
+    with RefusingSink() as sink:
+        pool = make_pool(sink)
+        with raises(smtplib.SMTPRecipientsRefused):
+            pool.send_messages([make_message()])
+        pool.close()
+    assert sink.connections == 1
+    assert sink.rcpt_attempts == 1
+
+
+def test_pool_does_not_resend_once_data_is_sent(sink, monkeypatch):
+    pool = make_pool(sink)
+    pool.send_messages([make_message()])
+    connection, _ = pool._idle[0]
+
+    def getreply():
+        raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+
+    data = connection.connection.data
+
+    def disconnect_after_data(msg):
+        monkeypatch.setattr(connection.connection, "getreply", getreply)
+        return data(msg)
+
+    monkeypatch.setattr(connection.connection, "data", disconnect_after_data)
+    with raises(smtplib.SMTPServerDisconnected):
+        pool.send_messages([make_message("other@example.com")])
+    pool.close()
+    assert sink.connections == 1
+
+
+def test_pool_closes_idle_connections(sink):
+    pool = make_pool(sink, idle_timeout=0)
+    pool.send_messages([make_message()])
+    pool.send_messages([make_message()])
+    pool.close()
+    assert sink.connections == 2
+
+
+def test_pool_never_opens_more_than_size_connections(sink):
+    pool = make_pool(sink, size=2)
+
+    def send_messages():
+        for _ in range(5):
+            pool.send_messages([make_message()])
+
+    threads = [threading.Thread(target=send_messages) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pool.close()
+    assert sink.connections <= 2
+    for _ in range(20):
+        sink.wait_for("user@example.com")
+
+
+@mark.django_db
+def test_login_email_is_sent_through_the_pool(client, monkeypatch, disable_2fa):
+    monkeypatch.setattr(settings, "EMAIL_CONNECTION_POOL", True)
+    user = factories.UserFactory()
+    client.post(reverse("magicauth-login"), data={"email": user.email})
+    assert len(mail.outbox) == 1
+    assert mail.outbox[0].alternatives[0][1] == "text/html"
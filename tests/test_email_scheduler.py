@@ -0,0 +1,189 @@
+import time
+
+from django.core.mail import EmailMessage
+from django.shortcuts import reverse
+from django.test import override_settings
+
+from pytest import fixture, mark
+
+from magicauth import email_scheduler, settings
+from magicauth.email_scheduler import (
+    BULK,
+    INTERACTIVE,
+    DomainQueue,
+    EmailScheduler,
+    QueuedEmail,
+)
+from tests import factories
+from tests.smtp_sink import SMTPSink
+
+
+class ThrottlingSMTPSink(SMTPSink):
+    """
+    Refuses the first `deferrals` recipients of slow.test with a temporary error, and
+    every recipient of refused.test with a permanent one.
+    """
+
+    def __init__(self, deferrals=2, **kwargs):
+        super().__init__(**kwargs)
+        self.deferrals = deferrals
+
+    def check_recipient(self, recipient):
+        if recipient.endswith("@refused.test"):
+            return "550 5.1.1 No such user"
+        if recipient.endswith("@slow.test") and self.deferrals:
+            self.deferrals -= 1
+            return "451 4.7.1 Try again later"
+        return super().check_recipient(recipient)
+
+
+@fixture
+def sink():
+    with ThrottlingSMTPSink() as sink:
+        with override_settings(
+            EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+            EMAIL_HOST=sink.host,
+            EMAIL_PORT=sink.port,
+        ):
+            yield sink
+
+
+@fixture
+def scheduler():
+    scheduler = EmailScheduler(workers=2, defer_seconds=0.05)
+    yield scheduler
+    scheduler.close(timeout=5)
+
+
+def make_message(recipient):
+    return EmailMessage("Subject", "Body", "from@example.com", [recipient])
+
+
+def get_recipients(sink):
+    return sorted(recipient for m in sink.messages for recipient in m.recipients)
+
+
+def test_emails_are_sent_by_domain_on_one_connection(sink, scheduler):
+    recipients = [f"user{i}@a.test" for i in range(6)] + ["user@b.test"]
+    for recipient in recipients:
+        scheduler.submit(make_message(recipient))
+    assert scheduler.join(timeout=5)
+    assert get_recipients(sink) == sorted(recipients)
+    # One for b.test, at most one per worker for a.test
+    assert sink.connections <= 3
+
+
+def test_deferred_domain_is_retried_without_blocking_others(sink, scheduler):
+    scheduler.submit(make_message("user@slow.test"))
+    scheduler.submit(make_message("user@fast.test"))
+    assert scheduler.join(timeout=5)
+    assert get_recipients(sink) == ["user@fast.test", "user@slow.test"]
+    assert sink.messages[0].recipients == ["user@fast.test"]
+
+
+def test_permanently_refused_email_is_not_retried(sink, scheduler):
+    scheduler.submit(make_message("user@refused.test"))
+    scheduler.submit(make_message("user@fast.test"))
+    assert scheduler.join(timeout=5)
+    assert get_recipients(sink) == ["user@fast.test"]
+
+
+def test_email_is_given_up_after_max_attempts(sink):
+    sink.deferrals = 10
+    scheduler = EmailScheduler(workers=1, defer_seconds=0.01, max_attempts=2)
+    scheduler.submit(make_message("user@slow.test"))
+    assert scheduler.join(timeout=5)
+    scheduler.close()
+    assert sink.messages == []
+    assert sink.deferrals == 8
+
+
+def test_expired_email_is_not_sent(sink, scheduler):
+    scheduler.submit(make_message("user@a.test"), expires_at=time.monotonic() - 1)
+    assert scheduler.join(timeout=5)
+    assert sink.messages == []
+
+
+def test_interactive_emails_are_taken_before_bulk_ones():
+    queue = DomainQueue(concurrency=1, rate_per_minute=None, batch_size=2)
+    for priority in (BULK, BULK, INTERACTIVE):
+        queue.push(QueuedEmail(make_message("user@a.test"), priority))
+    batch = queue.take_batch(time.monotonic())
+    assert [email.priority for email in batch] == [INTERACTIVE, BULK]
+
+
+def test_domain_rate_and_concurrency_are_limited():
+    now = time.monotonic()
+    queue = DomainQueue(concurrency=1, rate_per_minute=60, batch_size=5)
+    for _ in range(8):
+        queue.push(QueuedEmail(make_message("user@a.test"), INTERACTIVE))
+    assert queue.ready_at(now) <= now
+    assert len(queue.take_batch(now)) == 5
+    assert queue.ready_at(now) is None  # its only connection is in use
+    queue.in_flight = 0
+    # One email per second
+    assert queue.ready_at(now) >= now + 1
+    assert len(queue.take_batch(now + 2)) == 2
+
+
+@mark.django_db
+def test_login_email_is_queued_when_scheduled(
+    client, sink, scheduler, monkeypatch, disable_2fa
+):
+    monkeypatch.setattr(settings, "EMAIL_DISPATCH", "scheduled")
+    monkeypatch.setattr(email_scheduler, "_scheduler", scheduler)
+    user = factories.UserFactory(email="user@a.test")
+    response = client.post(reverse("magicauth-login"), data={"email": user.email})
+    assert response.status_code == 302
+    assert scheduler.join(timeout=5)
+    assert sink.wait_for("user@a.test")
+
+
+class BrokenMessage(EmailMessage):
+    def message(self):
+        raise ValueError("Malformed message")
+
+
+def test_unexpected_error_does_not_stop_the_workers(sink, caplog):
+    scheduler = EmailScheduler(workers=1)
+    scheduler.submit(BrokenMessage("Subject", "Body", "from@example.com", ["u@a.test"]))
+    scheduler.submit(make_message("user@a.test"))
+    assert scheduler.join(timeout=5)
+    scheduler.submit(make_message("other@a.test"))
+    assert scheduler.join(timeout=5)
+    scheduler.close()
+    assert get_recipients(sink) == ["other@a.test", "user@a.test"]
+    assert "Malformed message" in caplog.text
+
+
+def test_dead_workers_are_replaced(sink, monkeypatch):
+    scheduler = EmailScheduler(workers=1)
+    monkeypatch.setattr(scheduler, "run", lambda: None)
+    scheduler.submit(make_message("user@a.test"))
+    scheduler.threads[0].join()
+    monkeypatch.undo()
+    scheduler.submit(make_message("other@a.test"))
+    assert scheduler.join(timeout=5)
+    scheduler.close()
+    assert get_recipients(sink) == ["other@a.test", "user@a.test"]
+
+
+def test_idle_domains_are_forgotten(sink):
+    scheduler = EmailScheduler(workers=1, rate_per_minute=None)
+    scheduler.submit(make_message("user@a.test"))
+    assert scheduler.join(timeout=5)
+    scheduler.submit(make_message("user@b.test"))
+    assert scheduler.join(timeout=5)
+    scheduler.close()
+    assert "a.test" not in scheduler.domains
+
+
+def test_backoff_is_kept_when_nothing_was_sent():
+    scheduler = EmailScheduler()
+    queue = scheduler.get_domain_queue("a.test")
+    queue.deferrals, queue.in_flight = 2, 1
+    scheduler.batch_done(queue, [], 0, [])
+    assert queue.deferrals == 2
+    queue.in_flight = 1
+    scheduler.batch_done(queue, [], 1, [])
+    assert queue.deferrals == 0
@@ -0,0 +1,60 @@
+from django.conf import settings as django_settings
+from django.shortcuts import reverse
+from django.test import override_settings
+
+from pytest import fixture, mark
+
+from magicauth import settings
+from magicauth.flash import FLASH_COOKIE_NAME
+from tests import factories
+
+pytestmark = mark.django_db
+
+
+@fixture(autouse=True)
+def sessionless(monkeypatch, disable_2fa):
+    monkeypatch.setattr(settings, "SESSIONLESS_ANONYMOUS", True)
+
+
+@fixture(autouse=True)
+def session_message_storage():
+    storage = "django.contrib.messages.storage.session.SessionStorage"
+    with override_settings(MESSAGE_STORAGE=storage):
+        yield
+
+
+def test_dead_link_message_is_shown_without_session(client):
+    response = client.get(reverse("magicauth-validate-token", args=["unknown-token"]))
+    assert FLASH_COOKIE_NAME in response.cookies
+    assert django_settings.SESSION_COOKIE_NAME not in response.cookies
+
+    response = client.get(reverse("magicauth-login"))
+    assert "ne fonctionne plus" in response.content.decode()
+    assert response.cookies[FLASH_COOKIE_NAME]["max-age"] == 0
+    assert django_settings.SESSION_COOKIE_NAME not in response.cookies
+
+
+def test_flash_message_is_shown_once(client):
+    client.get(reverse("magicauth-validate-token", args=["unknown-token"]))
+    client.get(reverse("magicauth-login"))
+    response = client.get(reverse("magicauth-login"))
+    assert "ne fonctionne plus" not in response.content.decode()
+
+
+def test_tampered_flash_cookie_is_ignored(client):
+    client.cookies[FLASH_COOKIE_NAME] = "not-signed"
+    response = client.get(reverse("magicauth-login"))
+    assert response.status_code == 200
+    assert list(response.context["messages"]) == []
+
+
+def test_login_flow_writes_session_only_on_login(client):
+    user = factories.UserFactory()
+    response = client.post(reverse("magicauth-login"), data={"email": user.email})
+    response = client.get(response.url)
+    assert django_settings.SESSION_COOKIE_NAME not in client.cookies
+    token = factories.MagicTokenFactory(user=user)
+    client.get(reverse("magicauth-wait", args=[token.key]))
+    assert django_settings.SESSION_COOKIE_NAME not in client.cookies
+    client.get(reverse("magicauth-validate-token", args=[token.key]))
+    assert django_settings.SESSION_COOKIE_NAME in client.cookies
@@ -0,0 +1,99 @@
+from django.db import DatabaseError
+from django.shortcuts import reverse
+
+from pytest import fixture, mark
+
+from magicauth import funnel, settings
+from magicauth.funnel import funnel_buffer, get_day, increment
+from magicauth.models import LoginFunnelDay
+from tests import factories
+
+pytestmark = [mark.django_db, mark.usefixtures("disable_2fa")]
+
+
+def run_login_flow(client):
+    user = factories.UserFactory()
+    client.post(reverse("magicauth-login"), data={"email": user.email})
+    client.get(reverse("magicauth-validate-token", args=["unknown-token"]))
+    client.get(
+        reverse(
+            "magicauth-validate-token",
+            args=[factories.MagicTokenFactory(expired=True).key],
+        )
+    )
+    token = factories.MagicTokenFactory(user=user)
+    client.get(reverse("magicauth-validate-token", args=[token.key]))
+    client.logout()
+
+
+def get_counters(day):
+    return LoginFunnelDay.objects.values(*LoginFunnelDay.COUNTERS).get(
+        day=day, site="testserver"
+    )
+
+
+def test_no_funnel_is_recorded_by_default(client):
+    run_login_flow(client)
+    assert not LoginFunnelDay.objects.exists()
+
+
+def test_sync_funnel_counts_each_step(client, monkeypatch):
+    monkeypatch.setattr(settings, "LOGIN_FUNNEL", "sync")
+    run_login_flow(client)
+    run_login_flow(client)
+    funnel_day = LoginFunnelDay.objects.get()
+    assert get_counters(get_day()) == {
+        "links_requested": 2,
+        "logins_completed": 2,
+        "tokens_expired": 2,
+        "tokens_not_found": 2,
+    }
+    assert funnel_day.links_clicked == 6
+
+
+@fixture
+def buffered_funnel(monkeypatch):
+    monkeypatch.setattr(settings, "LOGIN_FUNNEL", "buffered")
+    monkeypatch.setattr(settings, "LOGIN_FUNNEL_FLUSH_SECONDS", 60)
+    yield
+    # Also cancels the timer when the test fails
+    funnel_buffer.flush()
+
+
+def test_buffered_funnel_is_written_on_flush(client, buffered_funnel):
+    run_login_flow(client)
+    run_login_flow(client)
+    assert not LoginFunnelDay.objects.exists()
+    funnel_buffer.flush()
+    assert get_counters(get_day())["links_requested"] == 2
+
+
+def test_increment_adds_to_existing_row():
+    day = get_day()
+    increment(day, "testserver", LoginFunnelDay.LINKS_REQUESTED, 3)
+    increment(day, "testserver", LoginFunnelDay.LINKS_REQUESTED)
+    increment(day, "other.site", LoginFunnelDay.LINKS_REQUESTED)
+    assert get_counters(day)["links_requested"] == 4
+    assert LoginFunnelDay.objects.count() == 2
+
+
+def test_buffered_funnel_keeps_unwritten_counts(
+    client, buffered_funnel, monkeypatch, caplog
+):
+    run_login_flow(client)
+    written = []
+
+    def failing_increment(day, site, counter, count=1):
+        if written:
+            raise DatabaseError("The database is gone")
+        written.append(counter)
+        increment(day, site, counter, count)
+
+    monkeypatch.setattr(funnel, "increment", failing_increment)
+    funnel_buffer.flush()
+    assert "could not be written" in caplog.text
+    monkeypatch.setattr(funnel, "increment", increment)
+    funnel_buffer.flush()
+    counters = get_counters(get_day())
+    assert counters["links_requested"] == 1
+    assert counters["logins_completed"] == 1
@@ -0,0 +1,100 @@
+import time
+
+from django.core import mail
+from django.shortcuts import reverse
+
+from pytest import fixture, mark
+
+from magicauth import limiter, settings
+from magicauth.limiter import GLOBAL_COUNTER_CACHE_KEY, get_semaphore
+from magicauth.utils import get_cache
+from tests import factories
+
+pytestmark = mark.django_db
+
+
+@fixture
+def user(disable_2fa):
+    return factories.UserFactory()
+
+
+@fixture
+def busy_process(monkeypatch):
+    """
+    Another login in progress in this process, with a limit of one.
+    """
+    monkeypatch.setattr(settings, "MAX_CONCURRENT_SENDS", 1)
+    semaphore = get_semaphore(1)
+    semaphore.acquire()
+    yield
+    semaphore.release()
+
+
+def post_email(client, email):
+    return client.post(reverse("magicauth-login"), data={"email": email})
+
+
+def test_sends_over_the_process_limit_are_shed(client, user, busy_process):
+    response = post_email(client, user.email)
+    assert response.status_code == 503
+    assert response["Retry-After"] == str(settings.SEND_RETRY_AFTER_SECONDS)
+    assert "magicauth/overloaded.html" in [t.name for t in response.templates]
+    assert len(mail.outbox) == 0
+
+
+def test_login_page_is_served_over_the_limit(client, busy_process):
+    response = client.get(reverse("magicauth-login"))
+    assert response.status_code == 200
+
+
+def test_sends_under_the_limit_release_their_slot(client, user, monkeypatch):
+    monkeypatch.setattr(settings, "MAX_CONCURRENT_SENDS", 1)
+    for _ in range(2):
+        assert post_email(client, user.email).status_code == 302
+
+
+def test_sends_over_the_global_limit_are_shed(client, user, monkeypatch):
+    monkeypatch.setattr(settings, "MAX_CONCURRENT_SENDS_GLOBAL", 2)
+    cache = get_cache()
+    cache.set(GLOBAL_COUNTER_CACHE_KEY, 2)
+    try:
+        response = post_email(client, user.email)
+        assert response.status_code == 503
+        assert cache.get(GLOBAL_COUNTER_CACHE_KEY) == 2
+        cache.set(GLOBAL_COUNTER_CACHE_KEY, 1)
+        assert post_email(client, user.email).status_code == 302
+        assert cache.get(GLOBAL_COUNTER_CACHE_KEY) == 1
+    finally:
+        cache.delete(GLOBAL_COUNTER_CACHE_KEY)
+
+
+def test_login_api_sheds_with_json(client, user, busy_process):
+    response = client.post(reverse("magicauth-api-login"), {"email": user.email})
+    assert response.status_code == 503
+    assert "errors" in response.json()
+
+
+def test_global_counter_does_not_expire_during_a_storm(monkeypatch):
+    monkeypatch.setattr(settings, "MAX_CONCURRENT_SENDS_GLOBAL", 10)
+    monkeypatch.setattr(limiter, "GLOBAL_COUNTER_SECONDS", 1)
+    cache = get_cache()
+    with limiter.global_slot():
+        time.sleep(0.6)
+        with limiter.global_slot():
+            # Past the expiry set by the first submission
+            time.sleep(0.6)
+            assert cache.get(GLOBAL_COUNTER_CACHE_KEY) == 2
+        assert cache.get(GLOBAL_COUNTER_CACHE_KEY) == 1
+    assert cache.get(GLOBAL_COUNTER_CACHE_KEY) == 0
+    cache.delete(GLOBAL_COUNTER_CACHE_KEY)
+
+
+def test_global_counter_never_goes_below_zero(monkeypatch):
+    monkeypatch.setattr(settings, "MAX_CONCURRENT_SENDS_GLOBAL", 10)
+    cache = get_cache()
+    with limiter.global_slot():
+        cache.delete(GLOBAL_COUNTER_CACHE_KEY)  # Expired
+        with limiter.global_slot():
+            assert cache.get(GLOBAL_COUNTER_CACHE_KEY) == 1
+    assert cache.get(GLOBAL_COUNTER_CACHE_KEY) == 0
+    cache.delete(GLOBAL_COUNTER_CACHE_KEY)
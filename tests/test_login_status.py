@@ -0,0 +1,83 @@
+import re
+
+from django.core import mail
+from django.shortcuts import reverse
+
+from asgiref.sync import async_to_sync
+from pytest import fixture, mark
+
+from magicauth import settings
+from magicauth.login_status import (
+    LOGGED_IN,
+    PENDING,
+    SHORT_POLL_SECONDS,
+    get_attempt_status,
+)
+from tests import factories
+
+pytestmark = mark.django_db
+
+
+@fixture
+def long_poll(monkeypatch, disable_2fa):
+    monkeypatch.setattr(settings, "LOGIN_STATUS_LONG_POLL", True)
+    monkeypatch.setattr(settings, "LOGIN_STATUS_TIMEOUT_SECONDS", 0)
+
+
+def request_link(client, user):
+    response = client.post(reverse("magicauth-login"), data={"email": user.email})
+    attempt_id = re.search(r"attempt=([\w-]+)", response.url).group(1)
+    token_key = re.search(r"code/(\w+)/", mail.outbox[-1].body).group(1)
+    return response, attempt_id, token_key
+
+
+def test_email_sent_page_waits_for_the_login(client, long_poll):
+    response, attempt_id, _ = request_link(client, factories.UserFactory())
+    assert get_attempt_status(attempt_id) == PENDING
+    response = client.get(response.url)
+    status_url = reverse("magicauth-login-status", args=[attempt_id])
+    assert response.context["login_status_url"] == status_url
+    assert b"waitForLogin()" in response.content
+
+
+def test_status_is_pending_until_the_token_is_used(client, long_poll):
+    _, attempt_id, token_key = request_link(client, factories.UserFactory())
+    status_url = reverse("magicauth-login-status", args=[attempt_id])
+    response = client.get(status_url)
+    assert response.json() == {"status": PENDING, "retry_seconds": SHORT_POLL_SECONDS}
+
+    # The link opened on another device
+    client.__class__().get(reverse("magicauth-validate-token", args=[token_key]))
+    response = client.get(status_url)
+    assert response.json()["status"] == LOGGED_IN
+    assert "no-store" in response["Cache-Control"]
+
+
+def test_status_is_long_polled_under_asgi(client, async_client, long_poll):
+    _, attempt_id, _ = request_link(client, factories.UserFactory())
+    status_url = reverse("magicauth-login-status", args=[attempt_id])
+
+    async def get_status():
+        return await async_client.get(status_url)
+
+    response = async_to_sync(get_status)()
+    assert response.json() == {"status": PENDING, "retry_seconds": 0}
+
+
+def test_status_does_not_query_the_database(
+    client, long_poll, django_assert_num_queries
+):
+    _, attempt_id, _ = request_link(client, factories.UserFactory())
+    with django_assert_num_queries(0):
+        client.get(reverse("magicauth-login-status", args=[attempt_id]))
+
+
+def test_unknown_attempt_is_not_found(client, long_poll):
+    response = client.get(reverse("magicauth-login-status", args=["unknown"]))
+    assert response.status_code == 404
+
+
+def test_status_view_is_disabled_by_default(client, monkeypatch):
+    monkeypatch.setattr(settings, "LOGIN_STATUS_LONG_POLL", False)
+    response = client.get(reverse("magicauth-login-status", args=["unknown"]))
+    assert response.status_code == 404
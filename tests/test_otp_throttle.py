@@ -0,0 +1,74 @@
+from django.shortcuts import reverse
+
+from django_otp.plugins.otp_static.models import StaticDevice
+from pytest import fixture, mark
+
+from magicauth import settings
+from magicauth.otp_throttle import FAILURES_CACHE_KEY
+from magicauth.utils import get_cache
+from tests import factories
+
+pytestmark = mark.django_db
+
+
+@fixture
+def user(monkeypatch):
+    monkeypatch.setattr(settings, "ENABLE_2FA", True)
+    monkeypatch.setattr(settings, "OTP_THROTTLE", True)
+    monkeypatch.setattr(settings, "OTP_THROTTLE_MAX_FAILURES", 2)
+    user = factories.UserFactory()
+    device = user.staticdevice_set.create()
+    device.token_set.create(token="123456")
+    device.token_set.create(token="654321")
+    yield user
+    get_cache().delete(FAILURES_CACHE_KEY % user.pk)
+
+
+def post_email_and_otp(client, email, otp_token):
+    return client.post(
+        reverse("magicauth-login"), data={"email": email, "otp_token": otp_token}
+    )
+
+
+def get_otp_error(response):
+    return response.context_data["OTP_form"].errors["otp_token"][0]
+
+
+def test_wrong_codes_are_rejected_without_loading_devices(client, user):
+    for _ in range(2):
+        response = post_email_and_otp(client, user.email, "000000")
+        assert get_otp_error(response) == "Ce code n'est pas valide."
+    device = user.staticdevice_set.get()
+    failure_count = device.throttling_failure_count
+
+    response = post_email_and_otp(client, user.email, "123456")
+    assert get_otp_error(response) == (
+        "Trop de codes erronés. Réessayez dans quelques minutes."
+    )
+    device.refresh_from_db()
+    assert device.throttling_failure_count == failure_count
+
+
+def test_valid_code_clears_failures(client, user, monkeypatch):
+    monkeypatch.setattr(settings, "OTP_THROTTLE_MAX_FAILURES", 5)
+    post_email_and_otp(client, user.email, "000000")
+    assert get_cache().get(FAILURES_CACHE_KEY % user.pk) == 1
+    # django-otp delays the attempt following a failure
+    user.staticdevice_set.update(throttling_failure_count=0)
+    response = post_email_and_otp(client, user.email, "123456")
+    assert response.status_code == 302
+    assert get_cache().get(FAILURES_CACHE_KEY % user.pk) is None
+
+
+def test_attempt_is_counted_before_the_code_is_checked(client, user, monkeypatch):
+    counts = []
+    verify_token = StaticDevice.verify_token
+
+    def counting_verify_token(device, token):
+        counts.append(get_cache().get(FAILURES_CACHE_KEY % user.pk))
+        return verify_token(device, token)
+
+    monkeypatch.setattr(StaticDevice, "verify_token", counting_verify_token)
+    post_email_and_otp(client, user.email, "000000")
+    # A parallel guess would already see this attempt
+    assert counts == [1]
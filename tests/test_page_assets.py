@@ -0,0 +1,35 @@
+import re
+
+from django.shortcuts import reverse
+
+from pytest import mark
+
+from magicauth import settings
+
+pytestmark = mark.django_db
+
+EXTERNAL_RESOURCE_RE = re.compile(r'(?:href|src)="(?:https?:)?//')
+
+
+def get_pages():
+    return [
+        reverse("magicauth-login"),
+        reverse("magicauth-email-sent"),
+        reverse("magicauth-wait", kwargs={"key": "some-token"}),
+    ]
+
+
+def test_pages_inline_their_styles(client, monkeypatch):
+    monkeypatch.setattr(settings, "INLINE_CSS", True)
+    for url in get_pages():
+        content = client.get(url).content.decode()
+        assert "<style>" in content
+        assert ".btn-primary" in content
+        assert not EXTERNAL_RESOURCE_RE.search(content)
+
+
+def test_pages_link_the_static_stylesheet(client, monkeypatch):
+    monkeypatch.setattr(settings, "INLINE_CSS", False)
+    content = client.get(reverse("magicauth-login")).content.decode()
+    assert "<style>" not in content
+    assert re.search(r'<link href="[^"]*magicauth/magicauth\.css\?v=\w+"', content)
@@ -0,0 +1,97 @@
+from datetime import date, timedelta
+from datetime import timezone as dt_timezone
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.utils import timezone
+
+from pytest import mark, raises
+
+from magicauth import partitioning, settings
+from magicauth.models import MagicToken
+from tests import factories
+
+pytestmark = mark.django_db
+
+
+def test_partition_days_cover_the_valid_tokens_and_the_next_days():
+    days = partitioning.get_partition_days(
+        date(2024, 2, 27), days_ahead=2, today=date(2024, 2, 28)
+    )
+    assert days == [
+        date(2024, 2, 27),
+        date(2024, 2, 28),
+        date(2024, 2, 29),
+        date(2024, 3, 1),
+    ]
+
+
+def test_partition_name_and_bounds():
+    day = date(2024, 3, 1)
+    assert partitioning.get_partition_name(day) == "magicauth_magictoken_p20240301"
+    assert partitioning.get_day_bounds(day) == (
+        "2024-03-01T00:00:00+00:00",
+        "2024-03-02T00:00:00+00:00",
+    )
+
+
+def test_cleanup_deletes_expired_tokens_without_partitioning(monkeypatch):
+    monkeypatch.setattr(settings, "TOKEN_PARTITIONING", True)
+    valid = factories.MagicTokenFactory()
+    factories.MagicTokenFactory(expired=True)
+    out = StringIO()
+    call_command("magicauth_cleanup_tokens", "--chunk-size", "1", stdout=out)
+    assert list(MagicToken.objects.all()) == [valid]
+    assert "Deleted 1 expired tokens." in out.getvalue()
+
+
+def test_cleanup_refuses_to_convert_on_sqlite(monkeypatch):
+    monkeypatch.setattr(settings, "TOKEN_PARTITIONING", True)
+    with raises(CommandError):
+        call_command("magicauth_cleanup_tokens", "--convert", stdout=StringIO())
+
+
+postgresql = mark.skipif(
+    connection.vendor != "postgresql", reason="Partitioning needs PostgreSQL"
+)
+
+
+def count_rows(table):
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT count(*) FROM {connection.ops.quote_name(table)}")
+        return cursor.fetchone()[0]
+
+
+@postgresql
+def test_cleanup_converts_the_table_and_drops_expired_tokens(monkeypatch):
+    monkeypatch.setattr(settings, "TOKEN_PARTITIONING", True)
+    valid = factories.MagicTokenFactory()
+    factories.MagicTokenFactory(expired=True)
+    out = StringIO()
+    call_command("magicauth_cleanup_tokens", "--convert", stdout=out)
+    assert "Converted the token table" in out.getvalue()
+    assert partitioning.is_partitioned(connection)
+    assert list(MagicToken.objects.all()) == [valid]
+    # Runs again on the partitioned table
+    call_command("magicauth_cleanup_tokens", stdout=StringIO())
+    assert list(MagicToken.objects.all()) == [valid]
+
+
+@postgresql
+def test_tokens_of_the_default_partition_move_to_their_new_partition(monkeypatch):
+    monkeypatch.setattr(settings, "TOKEN_PARTITIONING", True)
+    monkeypatch.setattr(settings, "TOKEN_PARTITION_DAYS_AHEAD", 1)
+    call_command("magicauth_cleanup_tokens", "--convert", stdout=StringIO())
+    token = factories.MagicTokenFactory()
+    # No partition yet for that day
+    created = timezone.now() + timedelta(days=5)
+    MagicToken.objects.filter(pk=token.pk).update(created=created)
+    assert count_rows(partitioning.DEFAULT_PARTITION) == 1
+
+    monkeypatch.setattr(settings, "TOKEN_PARTITION_DAYS_AHEAD", 6)
+    call_command("magicauth_cleanup_tokens", stdout=StringIO())
+    assert count_rows(partitioning.DEFAULT_PARTITION) == 0
+    partition = partitioning.get_partition_name(created.astimezone(dt_timezone.utc))
+    assert count_rows(partition) == 1
+    assert MagicToken.objects.get().pk == token.pk
@@ -0,0 +1,50 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+
+from pytest import mark, raises
+
+from magicauth import settings
+from magicauth.models import MagicToken
+
+pytestmark = mark.django_db
+
+
+def seed(*args):
+    call_command("magicauth_seed", *args, stdout=StringIO())
+
+
+def test_seed_creates_users_and_tokens_by_chunks():
+    seed("--users", "7", "--tokens", "30", "--chunk-size", "4", "--fresh-ratio", "0.5")
+    assert get_user_model().objects.count() == 7
+    assert MagicToken.objects.count() == 30
+    assert 0 < MagicToken.objects.valid().count() < 30
+    counts = {user.magic_token.count() for user in get_user_model().objects.all()}
+    assert counts == {4, 5}
+
+
+def test_seed_is_deterministic():
+    seed("--users", "5", "--tokens", "10", "--seed", "1")
+    first_run = list(
+        MagicToken.objects.order_by("key").values_list("key", "user__email")
+    )
+    MagicToken.objects.all().delete()
+    seed("--users", "5", "--tokens", "10", "--seed", "1")
+    second_run = list(
+        MagicToken.objects.order_by("key").values_list("key", "user__email")
+    )
+    assert first_run == second_run
+    assert get_user_model().objects.count() == 5
+
+
+def test_seed_uses_email_field(monkeypatch):
+    monkeypatch.setattr(settings, "EMAIL_FIELD", "email")
+    seed("--users", "2", "--tokens", "0")
+    assert get_user_model().objects.filter(email="user1@seed.magicauth.test").exists()
+
+
+def test_seed_refuses_to_create_the_same_tokens_twice():
+    seed("--users", "2", "--tokens", "2")
+    with raises(CommandError):
+        seed("--users", "2", "--tokens", "2")
@@ -1,13 +1,25 @@
+import os
+
 SECRET_KEY = "can you keep a secret?"
 
 DATABASES = {"default": {"ENGINE": "django.db.backends.sqlite3"}}
+if os.environ.get("MAGICAUTH_TEST_POSTGRES_DB"):
+    # Connection parameters are read from the PG* environment variables
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ["MAGICAUTH_TEST_POSTGRES_DB"],
+        }
+    }
 
 ROOT_URLCONF = "tests.test_url"
 
 INSTALLED_APPS = [
     "tests",
+    "django.contrib.admin",
     "django.contrib.auth",
     "django.contrib.contenttypes",
+    "django.contrib.messages",
     "magicauth",
     "django_otp",
     "django_otp.plugins.otp_static",
@@ -20,7 +32,17 @@ MAGICAUTH_LOGGED_IN_REDIRECT_URL_NAME = "test_home"
 
 
 TEMPLATES = [
-    {"BACKEND": "django.template.backends.django.DjangoTemplates", "APP_DIRS": True}
+    {
+        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "APP_DIRS": True,
+        "OPTIONS": {
+            "context_processors": [
+                "django.template.context_processors.request",
+                "django.contrib.auth.context_processors.auth",
+                "django.contrib.messages.context_processors.messages",
+            ]
+        },
+    }
 ]
 
 MIDDLEWARE = [
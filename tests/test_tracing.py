@@ -0,0 +1,97 @@
+from django.shortcuts import reverse
+
+from pytest import fixture, importorskip, mark
+
+from magicauth import settings
+from magicauth.tracing import NOOP_SPAN, get_tracer, span
+from tests import factories
+
+pytestmark = mark.django_db
+
+
+@fixture
+def tracer(monkeypatch, disable_2fa):
+    monkeypatch.setattr(settings, "TRACER", "magicauth.tracing.InMemoryTracer")
+    tracer = get_tracer()
+    tracer.clear()
+    return tracer
+
+
+def test_tracing_is_disabled_by_default():
+    assert settings.TRACER is None
+    assert span("magicauth.test") is NOOP_SPAN
+
+
+def test_login_post_is_traced(client, tracer):
+    user = factories.UserFactory()
+    client.post(reverse("magicauth-login"), data={"email": user.email})
+
+    span_names = [recorded_span.name for recorded_span in tracer.spans]
+    assert span_names == [
+        "magicauth.user_lookup",
+        "magicauth.user_lookup",
+        "magicauth.user_lookup",
+        "magicauth.create_token",
+        "magicauth.render_email",
+        "magicauth.send_email",
+    ]
+    assert tracer.spans[0].attributes["user_found"] is True
+    create_token_span = tracer.get_span("magicauth.create_token")
+    assert create_token_span.attributes["token_reused"] is False
+    assert create_token_span.duration >= 0
+
+
+def test_token_validation_is_traced(client, tracer):
+    token = factories.MagicTokenFactory()
+    factories.MagicTokenFactory(user=token.user)
+    client.get(reverse("magicauth-validate-token", args=[token.key]))
+
+    assert tracer.get_span("magicauth.token_lookup").attributes == {
+        "token_found": True,
+        "token_expired": False,
+    }
+    assert tracer.get_span("magicauth.login").attributes["user_id"] == token.user_id
+    assert tracer.get_span("magicauth.purge_tokens").attributes["tokens_deleted"] == 2
+
+
+def test_unknown_token_lookup_is_traced(client, tracer):
+    client.get(reverse("magicauth-validate-token", args=["unknown-token"]))
+
+    assert tracer.get_span("magicauth.token_lookup").attributes["token_found"] is False
+
+
+def test_collecting_tracer_attributes_queries_to_steps(client, monkeypatch):
+    monkeypatch.setattr(settings, "TRACER", "magicauth.tracing.CollectingTracer")
+    tracer = get_tracer()
+    token = factories.MagicTokenFactory()
+    assert span("magicauth.test") is NOOP_SPAN
+
+    tracer.start_collecting()
+    client.get(reverse("magicauth-validate-token", args=[token.key]))
+    spans = tracer.stop_collecting()
+
+    assert [collected.name for collected in spans] == [
+        "magicauth.token_lookup",
+        "magicauth.login",
+        "magicauth.purge_tokens",
+    ]
+    lookup_span, login_span, purge_span = spans
+    assert len(lookup_span.queries) == 1
+    assert "magicauth_magictoken" in lookup_span.queries[0][0]
+    assert any("DELETE" in sql for sql, _ in purge_span.queries)
+    assert all(collected.depth == 0 for collected in spans)
+    assert span("magicauth.test") is NOOP_SPAN
+
+
+def test_debug_toolbar_panel_describes_the_token_lifecycle(monkeypatch):
+    panels = importorskip("magicauth.panels", reason="django-debug-toolbar")
+    monkeypatch.setattr(settings, "TRACER", "magicauth.tracing.CollectingTracer")
+    tracer = get_tracer()
+    tracer.start_collecting()
+    with span("magicauth.token_lookup", token_found=True, token_expired=False):
+        pass
+    with span("magicauth.login"):
+        pass
+    spans = tracer.stop_collecting()
+    assert panels.get_token_states(spans) == ["valid", "consumed"]
+    assert panels.serialize_span(spans[0])["attributes"]["token_found"] == "True"
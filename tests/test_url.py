@@ -3,5 +3,6 @@ from django.views.generic import TemplateView
 
 urlpatterns = [
     path("", include("magicauth.urls")),
+    path("api/", include("magicauth.api_urls")),
     path("landing/", TemplateView.as_view(template_name="home.html"), name="test_home"),
 ]
@@ -0,0 +1,79 @@
+from django.contrib.auth import get_user_model
+from django.shortcuts import reverse
+
+from pytest import fixture, mark, raises
+
+from magicauth import settings
+from magicauth.user_cache import get_user_by_email
+from magicauth.utils import get_cache
+from tests import factories
+
+pytestmark = mark.django_db
+
+
+@fixture
+def user_cache(monkeypatch, disable_2fa):
+    monkeypatch.setattr(settings, "USER_CACHE", True)
+    get_cache().clear()
+
+
+def test_cached_user_is_found_without_query(user_cache, django_assert_num_queries):
+    user = factories.UserFactory()
+    get_user_by_email(user.email)
+    with django_assert_num_queries(0):
+        assert get_user_by_email(user.email.upper()) == user
+
+
+def test_login_post_looks_up_user_once(client, user_cache, django_assert_num_queries):
+    user = factories.UserFactory()
+    # One user lookup, then the token insert
+    with django_assert_num_queries(2):
+        response = client.post(reverse("magicauth-login"), data={"email": user.email})
+    assert response.status_code == 302
+
+
+def test_cache_is_invalidated_when_user_is_saved(user_cache):
+    user = factories.UserFactory()
+    get_user_by_email(user.email)
+    user.first_name = "Thierry"
+    user.save()
+    assert get_user_by_email(user.email).first_name == "Thierry"
+
+
+def test_cache_is_invalidated_when_email_changes(user_cache):
+    user = factories.UserFactory()
+    old_email = user.email
+    get_user_by_email(old_email)
+    user.username = user.email = "new-email@example.com"
+    user.save()
+    assert get_user_by_email("new-email@example.com") == user
+    with raises(get_user_model().DoesNotExist):
+        get_user_by_email(old_email)
+
+
+def test_cache_is_invalidated_when_user_is_deleted(user_cache):
+    user = factories.UserFactory()
+    email = user.email
+    get_user_by_email(email)
+    user.delete()
+    with raises(get_user_model().DoesNotExist):
+        get_user_by_email(email)
+
+
+def test_login_keeps_user_cached(client, user_cache, django_assert_num_queries):
+    user = factories.UserFactory()
+    for _ in range(2):
+        get_user_by_email(user.email)
+        token = factories.MagicTokenFactory(user=user)
+        client.get(reverse("magicauth-validate-token", args=[token.key]))
+        client.logout()
+    with django_assert_num_queries(0):
+        assert get_user_by_email(user.email) == user
+
+
+def test_cache_is_invalidated_when_user_is_deactivated(user_cache):
+    user = factories.UserFactory()
+    get_user_by_email(user.email)
+    user.is_active = False
+    user.save(update_fields=["is_active"])
+    assert not get_user_by_email(user.email).is_active